@@ -0,0 +1,22 @@
+import argparse
+
+from core_data_modules.logging import Logger
+
+from src.common.code_schemes import CODE_SCHEMES_DIR, CodeSchemeLoader
+
+log = Logger(__name__)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-parses all the code schemes into a bundle file, so that the pipeline stages don't need to "
+                    "parse the code scheme json files on startup")
+
+    parser.add_argument("--code-schemes-dir", default=CODE_SCHEMES_DIR,
+                        help=f"Directory containing the code scheme json files to bundle. "
+                             f"Defaults to '{CODE_SCHEMES_DIR}'")
+
+    args = parser.parse_args()
+
+    loader = CodeSchemeLoader(args.code_schemes_dir)
+    bundled_count = loader.write_bundle()
+    log.info(f"Wrote {bundled_count} code schemes to bundle '{loader.bundle_path}'")
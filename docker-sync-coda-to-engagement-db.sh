@@ -11,6 +11,9 @@ while [[ $# -gt 0 ]]; do
             INCREMENTAL_ARG="--incremental-cache-path /cache"
             INCREMENTAL_CACHE_VOLUME_NAME="$2"
             shift 2;;
+        --follow)
+            FOLLOW_ARG="--follow"
+            shift;;
         --)
             shift
             break;;
@@ -22,7 +25,7 @@ done
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 4 ]]; then
     echo "Usage: $0 
-    [--incremental-cache-volume <incremental-cache-volume>] 
+    [--incremental-cache-volume <incremental-cache-volume>] [--follow] 
     <user> <google-cloud-credentials-file-path> <configuration-module> <data-dir>"
     exit
 fi
@@ -37,7 +40,7 @@ DATA_DIR=$4
 docker build -t "$IMAGE_NAME" .
 
 # Create a container from the image that was just built.
-CMD="pipenv run python -u sync_coda_to_engagement_db.py ${INCREMENTAL_ARG} \
+CMD="pipenv run python -u sync_coda_to_engagement_db.py ${INCREMENTAL_ARG} ${FOLLOW_ARG} \
     ${USER} /credentials/google-cloud-credentials.json ${CONFIGURATION_MODULE}"
 
 if [[ "$INCREMENTAL_ARG" ]]; then
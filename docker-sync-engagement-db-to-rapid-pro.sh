@@ -11,6 +11,12 @@ while [[ $# -gt 0 ]]; do
             INCREMENTAL_ARG="--incremental-cache-path /cache"
             INCREMENTAL_CACHE_VOLUME_NAME="$2"
             shift 2;;
+        --shard-count)
+            SHARD_ARGS="$SHARD_ARGS --shard-count $2"
+            shift 2;;
+        --shard-index)
+            SHARD_ARGS="$SHARD_ARGS --shard-index $2"
+            shift 2;;
         --)
             shift
             break;;
@@ -22,7 +28,7 @@ done
 # Check that the correct number of arguments were provided.
 if [[ $# -ne 3 ]]; then
     echo "Usage: $0
-    [--incremental-cache-volume <incremental-cache-volume>]
+    [--incremental-cache-volume <incremental-cache-volume>] [--shard-count <shard-count>] [--shard-index <shard-index>]
     <user> <google-cloud-credentials-file-path> <configuration-module>"
     exit
 fi
@@ -36,7 +42,7 @@ CONFIGURATION_MODULE=$3
 docker build -t "$IMAGE_NAME" .
 
 # Create a container from the image that was just built.
-CMD="pipenv run python -u sync_engagement_db_to_rapid_pro.py ${INCREMENTAL_ARG} ${USER} \
+CMD="pipenv run python -u sync_engagement_db_to_rapid_pro.py ${INCREMENTAL_ARG} ${SHARD_ARGS} ${USER} \
     /credentials/google-cloud-credentials.json ${CONFIGURATION_MODULE}"
 
 if [[ "$INCREMENTAL_ARG" ]]; then
@@ -0,0 +1,91 @@
+from datetime import datetime
+import json
+import os
+
+from core_data_modules.util import IOUtils
+from engagement_database.data_models import Message
+
+
+class Cache:
+    def __init__(self, cache_dir):
+        """
+        Initialises a general-purpose cache at the given directory.
+
+        The cache can be used to locally save/retrieve named entries needed to enable incremental running of a tool.
+
+        :param cache_dir: Directory to use for the cache.
+        :type cache_dir: str
+        """
+        self.cache_dir = cache_dir
+
+    def _message_path(self, entry_name):
+        return f"{self.cache_dir}/{entry_name}.json"
+
+    def get_message(self, entry_name):
+        """
+        Gets a message from the cache.
+
+        :param entry_name: Name of the cache entry to get.
+        :type entry_name: str
+        :return: Cached message, or None if there is no cache entry with this name yet.
+        :rtype: engagement_database.data_models.Message | None
+        """
+        try:
+            with open(self._message_path(entry_name)) as f:
+                message_dict = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        message_dict["timestamp"] = datetime.fromisoformat(message_dict["timestamp"])
+        message_dict["last_updated"] = datetime.fromisoformat(message_dict["last_updated"])
+        return Message.from_dict(message_dict)
+
+    def set_message(self, entry_name, message):
+        """
+        Sets a message in the cache.
+
+        :param entry_name: Name of the cache entry to set.
+        :type entry_name: str
+        :param message: Message to write to the cache.
+        :type message: engagement_database.data_models.Message
+        """
+        export_path = self._message_path(entry_name)
+        IOUtils.ensure_dirs_exist_for_file(export_path)
+        with open(export_path, "w") as f:
+            json.dump(message.to_dict(serialize_datetimes_to_str=True), f)
+
+    def _json_path(self, entry_name):
+        return f"{self.cache_dir}/{entry_name}.data.json"
+
+    def get_json(self, entry_name):
+        """
+        Gets a JSON-serializable object from the cache.
+
+        :param entry_name: Name of the cache entry to get.
+        :type entry_name: str
+        :return: Cached object, or None if there is no cache entry with this name yet.
+        :rtype: dict | list | str | int | float | bool | None
+        """
+        try:
+            with open(self._json_path(entry_name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def set_json(self, entry_name, obj):
+        """
+        Sets a JSON-serializable object in the cache.
+
+        The object is written to a temporary file first then moved into place, so that an interrupted write can't
+        leave a corrupted cache entry.
+
+        :param entry_name: Name of the cache entry to set.
+        :type entry_name: str
+        :param obj: Object to write to the cache.
+        :type obj: dict | list | str | int | float | bool
+        """
+        export_path = self._json_path(entry_name)
+        IOUtils.ensure_dirs_exist_for_file(export_path)
+        with open(f"{export_path}.tmp", "w") as f:
+            json.dump(obj, f)
+        os.replace(f"{export_path}.tmp", export_path)
@@ -0,0 +1,181 @@
+class CodeSchemeRegistry:
+    def __init__(self, code_schemes):
+        """
+        Initialises a registry of precomputed look-up tables over the given code schemes.
+
+        The registry is intended to be built once per run, and then used in place of linear scans over code schemes
+        and their codes when decoding or validating labels.
+
+        Scheme ids of duplicated code schemes (i.e. schemes ending in '-2', '-3' etc.) resolve to the primary code
+        scheme they were duplicated from.
+
+        :param code_schemes: Code schemes to register.
+        :type code_schemes: iterable of core_data_modules.data_models.CodeScheme
+        """
+        self._code_schemes_lut = dict()  # of scheme id -> CodeScheme
+        self._codes_lut = dict()  # of scheme id -> (dict of code id -> Code)
+        self._control_codes_lut = dict()  # of scheme id -> (dict of control code -> Code)
+        self._meta_codes_lut = dict()  # of scheme id -> (dict of meta code -> Code)
+        self._duplicate_scheme_ids_lut = dict()  # of duplicate scheme id -> primary scheme id
+
+        for code_scheme in code_schemes:
+            self._code_schemes_lut[code_scheme.scheme_id] = code_scheme
+            self._codes_lut[code_scheme.scheme_id] = {code.code_id: code for code in code_scheme.codes}
+            self._control_codes_lut[code_scheme.scheme_id] = {
+                code.control_code: code for code in code_scheme.codes if code.control_code is not None
+            }
+            self._meta_codes_lut[code_scheme.scheme_id] = {
+                code.meta_code: code for code in code_scheme.codes if code.meta_code is not None
+            }
+
+    @property
+    def code_schemes(self):
+        """
+        :return: All the code schemes in this registry.
+        :rtype: list of core_data_modules.data_models.CodeScheme
+        """
+        return list(self._code_schemes_lut.values())
+
+    def _primary_scheme_id(self, scheme_id):
+        """
+        :param scheme_id: Scheme id to resolve, which may be the id of a duplicated code scheme e.g. 'Scheme-abc123-2'.
+        :type scheme_id: str
+        :return: Id of the registered code scheme that `scheme_id` refers to, or None if there is no such scheme.
+        :rtype: str | None
+        """
+        if scheme_id in self._code_schemes_lut:
+            return scheme_id
+
+        if scheme_id in self._duplicate_scheme_ids_lut:
+            return self._duplicate_scheme_ids_lut[scheme_id]
+
+        primary_scheme_id = None
+        if "-" in scheme_id:
+            prefix, suffix = scheme_id.rsplit("-", 1)
+            if suffix.isdigit() and prefix in self._code_schemes_lut:
+                primary_scheme_id = prefix
+
+        self._duplicate_scheme_ids_lut[scheme_id] = primary_scheme_id
+        return primary_scheme_id
+
+    def _get_primary_scheme_id(self, scheme_id):
+        primary_scheme_id = self._primary_scheme_id(scheme_id)
+        if primary_scheme_id is None:
+            raise ValueError(f"Scheme id '{scheme_id}' is not in this registry "
+                             f"(this has ids {list(self._code_schemes_lut.keys())})")
+        return primary_scheme_id
+
+    def has_code_scheme(self, scheme_id):
+        """
+        :param scheme_id: Scheme id to check, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :return: Whether this registry contains a code scheme with the given scheme id.
+        :rtype: bool
+        """
+        return self._primary_scheme_id(scheme_id) is not None
+
+    def normalise_scheme_id(self, scheme_id):
+        """
+        Normalises a scheme id to the id of the registered code scheme it refers to e.g. 'Scheme-abc123-2' will be
+        normalised to 'Scheme-abc123'.
+
+        Raises a ValueError if the scheme id isn't in this registry.
+
+        :param scheme_id: Scheme id to normalise.
+        :type scheme_id: str
+        :return: Normalised scheme id.
+        :rtype: str
+        """
+        return self._get_primary_scheme_id(scheme_id)
+
+    def get_code_scheme(self, scheme_id):
+        """
+        Returns the code scheme with the given scheme id.
+
+        Raises a ValueError if the scheme id isn't in this registry.
+
+        :param scheme_id: Id of the code scheme to get, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :return: Code scheme with the given id.
+        :rtype: core_data_modules.data_models.CodeScheme
+        """
+        return self._code_schemes_lut[self._get_primary_scheme_id(scheme_id)]
+
+    def has_code(self, scheme_id, code_id):
+        """
+        :param scheme_id: Id of the code scheme to check, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :param code_id: Id of the code to check for.
+        :type code_id: str
+        :return: Whether this registry contains a code scheme with the given scheme id, which contains the given code.
+        :rtype: bool
+        """
+        primary_scheme_id = self._primary_scheme_id(scheme_id)
+        return primary_scheme_id is not None and code_id in self._codes_lut[primary_scheme_id]
+
+    def get_code(self, scheme_id, code_id):
+        """
+        Returns the code with the given code id in the code scheme with the given scheme id.
+
+        Raises a ValueError if either the scheme id or the code id can't be found.
+
+        :param scheme_id: Id of the code scheme to get the code from, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :param code_id: Id of the code to get.
+        :type code_id: str
+        :return: Code with the given code id.
+        :rtype: core_data_modules.data_models.Code
+        """
+        codes = self._codes_lut[self._get_primary_scheme_id(scheme_id)]
+        if code_id not in codes:
+            raise ValueError(f"Code id '{code_id}' not found in scheme '{scheme_id}'")
+        return codes[code_id]
+
+    def get_code_for_label(self, label):
+        """
+        Returns the code for the given label.
+
+        Raises a ValueError if the label isn't for any of the code schemes in this registry.
+
+        :param label: Label to get the code for.
+        :type label: core_data_modules.data_models.Label
+        :return: Code for the label.
+        :rtype: core_data_modules.data_models.Code
+        """
+        return self.get_code(label.scheme_id, label.code_id)
+
+    def get_code_with_control_code(self, scheme_id, control_code):
+        """
+        Returns the code with the given control code in the code scheme with the given scheme id.
+
+        Raises a ValueError if either the scheme id or the control code can't be found.
+
+        :param scheme_id: Id of the code scheme to get the code from, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :param control_code: Control code of the code to get.
+        :type control_code: str
+        :return: Code with the given control code.
+        :rtype: core_data_modules.data_models.Code
+        """
+        codes = self._control_codes_lut[self._get_primary_scheme_id(scheme_id)]
+        if control_code not in codes:
+            raise ValueError(f"Control code '{control_code}' not found in scheme '{scheme_id}'")
+        return codes[control_code]
+
+    def get_code_with_meta_code(self, scheme_id, meta_code):
+        """
+        Returns the code with the given meta code in the code scheme with the given scheme id.
+
+        Raises a ValueError if either the scheme id or the meta code can't be found.
+
+        :param scheme_id: Id of the code scheme to get the code from, which may be the id of a duplicated code scheme.
+        :type scheme_id: str
+        :param meta_code: Meta code of the code to get.
+        :type meta_code: str
+        :return: Code with the given meta code.
+        :rtype: core_data_modules.data_models.Code
+        """
+        codes = self._meta_codes_lut[self._get_primary_scheme_id(scheme_id)]
+        if meta_code not in codes:
+            raise ValueError(f"Meta code '{meta_code}' not found in scheme '{scheme_id}'")
+        return codes[meta_code]
@@ -0,0 +1,161 @@
+import glob
+import json
+import os
+import pickle
+import threading
+
+from core_data_modules.data_models import CodeScheme
+from core_data_modules.logging import Logger
+from core_data_modules.util import IOUtils
+
+from src.common.code_scheme_registry import CodeSchemeRegistry
+
+log = Logger(__name__)
+
+CODE_SCHEMES_DIR = "code_schemes"
+BUNDLE_FILE_NAME = ".bundle.pickle"
+
+
+class CodeSchemeLoader:
+    def __init__(self, code_schemes_dir=CODE_SCHEMES_DIR):
+        """
+        Initialises a memoised loader of the code scheme json files in a directory.
+
+        Each code scheme file is only parsed the first time it's requested, and then again only if the file's
+        modification time or size has changed since it was last parsed. The code schemes returned are shared between
+        callers, so must be copied before being modified.
+
+        If there is a bundle file in the directory (see `write_bundle`), the parsed code schemes it contains are used
+        for every file whose modification time and size still match the bundle, so that no json needs to be parsed at
+        all at startup. Out-of-date entries in the bundle are ignored, so a stale bundle is never wrong, just slower.
+
+        :param code_schemes_dir: Directory containing the code scheme json files.
+        :type code_schemes_dir: str
+        """
+        self.code_schemes_dir = code_schemes_dir
+        self._code_schemes = dict()  # of path -> ((mtime_ns, size), CodeScheme)
+        self._registry = None
+        self._registry_signatures = None  # of path -> (mtime_ns, size), of the files the registry was built from
+        self._bundle_loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def bundle_path(self):
+        return os.path.join(self.code_schemes_dir, BUNDLE_FILE_NAME)
+
+    @staticmethod
+    def _file_signature(path):
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load_bundle(self):
+        if self._bundle_loaded:
+            return
+        self._bundle_loaded = True
+
+        try:
+            with open(self.bundle_path, "rb") as f:
+                bundle = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as ex:
+            log.warning(f"Ignoring unreadable code schemes bundle at '{self.bundle_path}': {ex}")
+            return
+
+        for path, entry in bundle.items():
+            self._code_schemes.setdefault(path, entry)
+        log.debug(f"Loaded {len(bundle)} code schemes from bundle '{self.bundle_path}'")
+
+    def _load_path(self, path):
+        signature = self._file_signature(path)
+        cached = self._code_schemes.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(path) as f:
+            code_scheme = CodeScheme.from_firebase_map(json.load(f))
+        self._code_schemes[path] = (signature, code_scheme)
+        return code_scheme
+
+    def _all_paths(self):
+        return sorted(glob.glob(os.path.join(self.code_schemes_dir, "*.json")))
+
+    def load_code_scheme(self, name):
+        """
+        :param name: Name of the code scheme file to load, without the '.json' extension e.g. 'age'.
+        :type name: str
+        :return: Code scheme in the file `<code_schemes_dir>/<name>.json`.
+        :rtype: core_data_modules.data_models.CodeScheme
+        """
+        with self._lock:
+            self._load_bundle()
+            return self._load_path(os.path.join(self.code_schemes_dir, f"{name}.json"))
+
+    def load_all_code_schemes(self):
+        """
+        :return: All the code schemes in the code schemes directory.
+        :rtype: list of core_data_modules.data_models.CodeScheme
+        """
+        with self._lock:
+            self._load_bundle()
+            return [self._load_path(path) for path in self._all_paths()]
+
+    def get_code_scheme_registry(self):
+        """
+        :return: Registry of all the code schemes in the code schemes directory. This is only rebuilt if any of the
+                 code scheme files have been added, removed, or changed since the registry was last built.
+        :rtype: src.common.code_scheme_registry.CodeSchemeRegistry
+        """
+        with self._lock:
+            self._load_bundle()
+            paths = self._all_paths()
+            signatures = {path: self._file_signature(path) for path in paths}
+            if self._registry is None or signatures != self._registry_signatures:
+                self._registry = CodeSchemeRegistry([self._load_path(path) for path in paths])
+                self._registry_signatures = signatures
+            return self._registry
+
+    def write_bundle(self):
+        """
+        Parses all the code schemes in the code schemes directory and writes them to a bundle file in that directory,
+        so that future loaders can start without parsing any json.
+
+        :return: Number of code schemes written to the bundle.
+        :rtype: int
+        """
+        with self._lock:
+            bundle = dict()
+            for path in self._all_paths():
+                self._load_path(path)
+                bundle[path] = self._code_schemes[path]
+
+        IOUtils.ensure_dirs_exist_for_file(self.bundle_path)
+        with open(f"{self.bundle_path}.tmp", "wb") as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{self.bundle_path}.tmp", self.bundle_path)
+        return len(bundle)
+
+
+_default_loader = CodeSchemeLoader()
+
+
+def load_code_scheme(name):
+    """
+    Loads a code scheme from the project's code schemes directory, using a process-wide memoised loader.
+
+    :param name: Name of the code scheme file to load, without the '.json' extension e.g. 'age'.
+    :type name: str
+    :return: Code scheme in the file `code_schemes/<name>.json`. This is shared with other callers, so must be copied
+             before being modified.
+    :rtype: core_data_modules.data_models.CodeScheme
+    """
+    return _default_loader.load_code_scheme(name)
+
+
+def get_code_scheme_registry():
+    """
+    :return: Registry of all the code schemes in the project's code schemes directory, from a process-wide memoised
+             loader.
+    :rtype: src.common.code_scheme_registry.CodeSchemeRegistry
+    """
+    return _default_loader.get_code_scheme_registry()
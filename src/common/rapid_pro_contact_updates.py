@@ -0,0 +1,39 @@
+from core_data_modules.logging import Logger
+
+log = Logger(__name__)
+
+
+def reidentify_and_update_contacts(writer, uuid_table, contact_fields_by_participant, on_participant_updated=None):
+    """
+    Writes contact fields to many Rapid Pro contacts.
+
+    All the participants are re-identified with a single batch request to the uuid table, rather than one request per
+    participant. The contacts themselves are still written one request per contact: the Rapid Pro API's bulk contact
+    actions can only change group membership and blocking, and contact imports aren't available through the API, so
+    there's no bulk way of setting contact fields. The `writer` makes these requests concurrently, within the
+    workspace's rate limit.
+
+    :param writer: Writer to update the Rapid Pro contacts with.
+    :type writer: src.common.rapid_pro_writer.RapidProContactWriter
+    :param uuid_table: UUID table to use to re-identify the participants.
+    :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :param contact_fields_by_participant: Dictionary of participant uuid -> (dictionary of contact field key -> value)
+                                          to write.
+    :type contact_fields_by_participant: dict of str -> (dict of str -> str)
+    :param on_participant_updated: Function to call after each participant has been updated successfully, or None.
+                                   This can be used to checkpoint progress. It's always called on the thread that
+                                   called this function.
+    :type on_participant_updated: (function of str -> None) | None
+    """
+    if len(contact_fields_by_participant) == 0:
+        return
+
+    log.info(f"Re-identifying {len(contact_fields_by_participant)} participant(s)...")
+    urn_lut = uuid_table.uuid_to_data_batch(list(contact_fields_by_participant.keys()))
+
+    log.info(f"Updating {len(contact_fields_by_participant)} Rapid Pro contact(s)...")
+    writer.update_contacts(
+        [(participant_uuid, urn_lut[participant_uuid], contact_fields)
+         for participant_uuid, contact_fields in contact_fields_by_participant.items()],
+        on_participant_updated
+    )
@@ -0,0 +1,154 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from core_data_modules.logging import Logger
+from temba_client.exceptions import TembaRateExceededError
+
+log = Logger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_second, capacity=None):
+        """
+        Initialises a thread-safe token bucket, for limiting the rate of requests made to a service.
+
+        :param rate_per_second: Number of tokens to add to the bucket per second, or None to never run out of tokens
+                                (in which case the bucket only blocks while paused).
+        :type rate_per_second: float | None
+        :param capacity: Maximum number of tokens the bucket can hold i.e. the largest burst of requests allowed.
+                         If None, defaults to `max(1, rate_per_second)`.
+        :type capacity: float | None
+        """
+        assert rate_per_second is None or rate_per_second > 0, \
+            f"rate_per_second must be None or > 0, but was {rate_per_second}"
+        if capacity is None:
+            capacity = 1.0 if rate_per_second is None else max(1.0, rate_per_second)
+        assert capacity >= 1, f"capacity must be >= 1, but was {capacity}"
+
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    def pause(self, seconds):
+        """
+        Stops any tokens from being taken from this bucket for the given number of seconds, and empties the bucket so
+        that requests resume at the bucket's rate afterwards rather than in a burst.
+
+        :param seconds: Number of seconds to pause for.
+        :type seconds: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + seconds)
+            self._tokens = 0
+            self._last_refill = self._paused_until
+
+    def take(self):
+        """
+        Takes a token from this bucket, blocking until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait_seconds = self._paused_until - now
+                elif self.rate_per_second is None:
+                    return
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait_seconds = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+
+
+class RapidProContactWriter:
+    def __init__(self, rapid_pro, max_concurrent_writes=1, max_writes_per_second=None, max_rate_limit_retries=5):
+        """
+        Initialises a writer which updates Rapid Pro contacts concurrently, within the workspace's rate limit.
+
+        Writing contacts one at a time limits throughput to 1/latency of the Rapid Pro API. This writer keeps up to
+        `max_concurrent_writes` requests in flight, and uses a token bucket to start no more than
+        `max_writes_per_second` requests per second, so that throughput can be held at the workspace's rate limit.
+        If Rapid Pro rejects a request because the rate limit was exceeded anyway, all the writes are paused for the
+        time given in the response's Retry-After header, then the rejected request is retried.
+
+        :param rapid_pro: Rapid Pro client to write contacts with. This is shared between the writer's threads.
+        :type rapid_pro: rapid_pro_tools.rapid_pro_client.RapidProClient
+        :param max_concurrent_writes: Maximum number of requests to have in flight at once.
+        :type max_concurrent_writes: int
+        :param max_writes_per_second: Maximum number of requests to start per second, or None to not limit the rate
+                                      other than by following Retry-After headers. This should be set to the workspace's
+                                      rate limit for the contacts endpoint.
+        :type max_writes_per_second: float | None
+        :param max_rate_limit_retries: Maximum number of times to retry each request that is rejected by the rate limit.
+        :type max_rate_limit_retries: int
+        """
+        assert max_concurrent_writes >= 1, f"max_concurrent_writes must be >= 1, but was {max_concurrent_writes}"
+
+        self.rapid_pro = rapid_pro
+        self.max_concurrent_writes = max_concurrent_writes
+        self.max_rate_limit_retries = max_rate_limit_retries
+        # The token bucket is used even if there's no rate limit configured, so that Retry-After pauses apply to all
+        # the threads.
+        self._bucket = TokenBucket(max_writes_per_second)
+
+    def _update_contact(self, urn, contact_fields):
+        retries = 0
+        while True:
+            self._bucket.take()
+            try:
+                self.rapid_pro.update_contact(urn, contact_fields=contact_fields)
+                return
+            except TembaRateExceededError as ex:
+                if retries >= self.max_rate_limit_retries:
+                    raise
+                retries += 1
+                log.warning(f"Rapid Pro rate limit exceeded; pausing writes for {ex.retry_after} seconds "
+                            f"(retry {retries}/{self.max_rate_limit_retries})...")
+                self._bucket.pause(ex.retry_after)
+
+    def update_contacts(self, updates, on_contact_updated=None):
+        """
+        Updates the contact fields of many Rapid Pro contacts.
+
+        :param updates: Tuples of (id, urn, contact fields to write). The id identifies the update to
+                        `on_contact_updated`, and can be any hashable value e.g. the urn or a participant uuid.
+        :type updates: iterable of (hashable, str, dict of str -> str)
+        :param on_contact_updated: Function to call with the id of each update once it has been written successfully,
+                                   or None. This is always called on the thread that called this method, so it can be
+                                   used to checkpoint progress without further synchronisation.
+        :type on_contact_updated: (function of hashable -> None) | None
+        """
+        if self.max_concurrent_writes == 1:
+            for update_id, urn, contact_fields in updates:
+                self._update_contact(urn, contact_fields)
+                if on_contact_updated is not None:
+                    on_contact_updated(update_id)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_writes) as executor:
+            futures = {
+                executor.submit(self._update_contact, urn, contact_fields): update_id
+                for update_id, urn, contact_fields in updates
+            }
+            try:
+                for future in as_completed(futures):
+                    future.result()
+                    if on_contact_updated is not None:
+                        on_contact_updated(futures[future])
+            except BaseException:
+                # Don't start any more writes after a failure. Writes already in flight will still finish, but won't be
+                # reported to on_contact_updated, so at worst they'll be repeated in the next run.
+                for future in futures:
+                    future.cancel()
+                raise
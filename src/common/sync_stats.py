@@ -1,24 +1,220 @@
 import abc
+import json
+import time
 from abc import ABC
+from collections import deque
+from contextlib import contextmanager
+
+from core_data_modules.logging import Logger
+
+log = Logger(__name__)
+
+# Number of most recent occurrences of each event to use when estimating the current rate of that event.
+_RATE_WINDOW_SIZE = 100
 
 
 class SyncStats(ABC):
     def __init__(self, initial_event_counts):
         self.event_counts = initial_event_counts
+        self.timings = dict()  # of timer name -> list of durations in seconds
+        self._start_time = time.monotonic()
+        self._end_time = None  # Set when these stats are stopped.
+        self._recent_event_times = dict()  # of event -> deque of the times of the most recent occurrences
 
     def add_event(self, event):
         if event not in self.event_counts:
             self.event_counts[event] = 0
         self.event_counts[event] += 1
 
+        if event not in self._recent_event_times:
+            self._recent_event_times[event] = deque(maxlen=_RATE_WINDOW_SIZE)
+        self._recent_event_times[event].append(time.monotonic())
+
     def add_events(self, events):
         for event in events:
             self.add_event(event)
 
+    def add_timing(self, timer_name, seconds):
+        """
+        Records a duration for the given timer.
+
+        :param timer_name: Name of the timer to record the duration for e.g. 'coda.get_dataset_messages'.
+        :type timer_name: str
+        :param seconds: Duration to record, in seconds.
+        :type seconds: float
+        """
+        if timer_name not in self.timings:
+            self.timings[timer_name] = []
+        self.timings[timer_name].append(seconds)
+
+    @contextmanager
+    def timer(self, timer_name):
+        """
+        Context manager which records how long its body took to run under the given timer name.
+
+        :param timer_name: Name of the timer to record the duration for e.g. 'coda.get_dataset_messages'.
+        :type timer_name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(timer_name, time.perf_counter() - start)
+
     def add_stats(self, stats):
         for k, v in stats.event_counts.items():
+            if k not in self.event_counts:
+                self.event_counts[k] = 0
             self.event_counts[k] += v
 
+        for timer_name, durations in stats.timings.items():
+            if timer_name not in self.timings:
+                self.timings[timer_name] = []
+            self.timings[timer_name].extend(durations)
+
+        for event, event_times in stats._recent_event_times.items():
+            merged_event_times = sorted(list(self._recent_event_times.get(event, [])) + list(event_times))
+            self._recent_event_times[event] = deque(merged_event_times, maxlen=_RATE_WINDOW_SIZE)
+
+        self._start_time = min(self._start_time, stats._start_time)
+        if self._end_time is not None and stats._end_time is not None:
+            self._end_time = max(self._end_time, stats._end_time)
+        else:
+            self._end_time = None
+
+    def stop(self):
+        """
+        Records that the work these stats describe has finished, so that the elapsed time and throughput are measured up
+        to now, rather than up to whenever they're next read.
+
+        Stats that are stopped stay stopped when more stopped stats are added to them. Adding stats that are still
+        running restarts them.
+        """
+        self._end_time = time.monotonic()
+
+    def elapsed_seconds(self):
+        """
+        :return: Number of seconds from when these stats (or the earliest of any stats added to them) started recording,
+                 until they were stopped or until now if they haven't been stopped.
+        :rtype: float
+        """
+        end_time = time.monotonic() if self._end_time is None else self._end_time
+        return end_time - self._start_time
+
+    def throughput(self, event):
+        """
+        :param event: Event to compute the throughput of.
+        :type event: str
+        :return: Mean number of times the given event occurred per second, over the elapsed time of these stats.
+        :rtype: float
+        """
+        elapsed_seconds = self.elapsed_seconds()
+        if elapsed_seconds == 0:
+            return 0.0
+        return self.event_counts.get(event, 0) / elapsed_seconds
+
+    def eta_seconds(self, event, total):
+        """
+        Estimates how long it will take until the given event has occurred `total` times, based on the rate at which the
+        most recent occurrences of the event happened.
+
+        :param event: Event to estimate the time remaining for.
+        :type event: str
+        :param total: Number of times the event is expected to occur in total.
+        :type total: int
+        :return: Estimated number of seconds remaining, or None if there isn't enough data to make an estimate yet.
+        :rtype: float | None
+        """
+        remaining = total - self.event_counts.get(event, 0)
+        if remaining <= 0:
+            return 0.0
+
+        recent_event_times = self._recent_event_times.get(event)
+        if recent_event_times is None or len(recent_event_times) < 2:
+            return None
+        window_seconds = recent_event_times[-1] - recent_event_times[0]
+        if window_seconds == 0:
+            return None
+
+        return remaining * window_seconds / (len(recent_event_times) - 1)
+
+    def latency_percentiles(self, timer_name, percentiles=(50, 95, 99)):
+        """
+        Computes percentiles of the durations recorded for the given timer, using the nearest-rank method.
+
+        :param timer_name: Name of the timer to compute the percentiles of.
+        :type timer_name: str
+        :param percentiles: Percentiles to compute, each in the range (0, 100].
+        :type percentiles: iterable of number
+        :return: Dictionary of percentile -> duration in seconds. If no durations have been recorded for this timer,
+                 returns an empty dictionary.
+        :rtype: dict of number -> float
+        """
+        durations = sorted(self.timings.get(timer_name, []))
+        if len(durations) == 0:
+            return dict()
+
+        result = dict()
+        for p in percentiles:
+            assert 0 < p <= 100, f"Percentiles must be in the range (0, 100], but got {p}"
+            rank = -(-p * len(durations) // 100)  # ceil(p / 100 * n), in integer arithmetic
+            result[p] = durations[int(rank) - 1]
+        return result
+
+    def to_dict(self):
+        """
+        :return: Machine-readable summary of these stats.
+        :rtype: dict
+        """
+        timings = dict()
+        for timer_name, durations in self.timings.items():
+            percentiles = self.latency_percentiles(timer_name)
+            timings[timer_name] = {
+                "count": len(durations),
+                "total_seconds": sum(durations),
+                "p50_seconds": percentiles.get(50),
+                "p95_seconds": percentiles.get(95),
+                "p99_seconds": percentiles.get(99)
+            }
+
+        return {
+            "elapsed_seconds": self.elapsed_seconds(),
+            "event_counts": dict(self.event_counts),
+            "events_per_second": {event: self.throughput(event) for event in self.event_counts},
+            "timings": timings
+        }
+
+    def to_json(self):
+        """
+        :return: Summary of these stats, serialized as JSON.
+        :rtype: str
+        """
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def print_timings_summary(self):
+        for timer_name in sorted(self.timings.keys()):
+            durations = self.timings[timer_name]
+            percentiles = self.latency_percentiles(timer_name)
+            log.info(f"Timings for '{timer_name}': n={len(durations)}, total={sum(durations):.1f}s, "
+                     f"p50={percentiles[50] * 1000:.0f}ms, p95={percentiles[95] * 1000:.0f}ms, "
+                     f"p99={percentiles[99] * 1000:.0f}ms")
+        log.info(f"Elapsed time: {self.elapsed_seconds():.1f}s")
+        log.debug(f"Sync stats as JSON: {self.to_json()}")
+
     @abc.abstractmethod
     def print_summary(self):
         pass
+
+
+def format_eta(eta_seconds):
+    """
+    :param eta_seconds: Estimated number of seconds remaining, or None if unknown.
+    :type eta_seconds: float | None
+    :return: Human-readable version of the estimate, for use in progress logs.
+    :rtype: str
+    """
+    if eta_seconds is None:
+        return "ETA unknown"
+    minutes, seconds = divmod(int(eta_seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"ETA {hours}h{minutes:02d}m{seconds:02d}s"
@@ -1,22 +1,134 @@
+from collections.abc import MutableMapping
 from datetime import datetime
 import json
+import sqlite3
 
 from core_data_modules.util import IOUtils
 from engagement_database.data_models import Message
 
 
+class LabelsFingerprints(MutableMapping):
+    def __init__(self, fingerprints=None):
+        """
+        Initialises a dictionary of engagement database message id -> fingerprint of the labels that message was last
+        found to be up to date with, which records the message ids that have been set or removed since it was last
+        saved to a `CodaSyncCache`, so that saving it only needs to write those changes.
+
+        :param fingerprints: Dictionary of message id -> fingerprint to initialise with, or None to start empty.
+        :type fingerprints: dict of str -> str | None
+        """
+        self._fingerprints = dict() if fingerprints is None else fingerprints
+        self.set_message_ids = set()
+        self.removed_message_ids = set()
+
+    def __getitem__(self, message_id):
+        return self._fingerprints[message_id]
+
+    def __setitem__(self, message_id, fingerprint):
+        self._fingerprints[message_id] = fingerprint
+        self.set_message_ids.add(message_id)
+        self.removed_message_ids.discard(message_id)
+
+    def __delitem__(self, message_id):
+        del self._fingerprints[message_id]
+        self.set_message_ids.discard(message_id)
+        self.removed_message_ids.add(message_id)
+
+    def __iter__(self):
+        return iter(self._fingerprints)
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+
 class CodaSyncCache:
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, commit_interval=100):
         """
         Initialises a Coda sync cache at the given directory.
 
         The sync cache can be used to locally save/retrieve data needed to enable incremental running of a
         engagement database <-> Coda sync tools.
 
+        The cache is stored in a single sqlite database in `cache_dir`, with a table for each type of data cached.
+        Writes are committed in batches of `commit_interval` writes, or when `commit` is called. Uncommitted writes are
+        lost if the process exits before they are committed, in which case the next run will redo some work that has
+        already been done, but will not skip any.
+
         :param cache_dir: Directory to use for the cache.
         :type cache_dir: str
+        :param commit_interval: Number of writes to make before automatically committing them.
+        :type commit_interval: int
         """
         self.cache_dir = cache_dir
+        self.commit_interval = commit_interval
+        self._uncommitted_writes = 0
+
+        db_path = f"{cache_dir}/coda-sync-cache.sqlite"
+        IOUtils.ensure_dirs_exist_for_file(db_path)
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS last_seen_messages (
+                dataset TEXT PRIMARY KEY,
+                message TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS last_updated_timestamps (
+                dataset TEXT PRIMARY KEY,
+                timestamp TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS labels_fingerprints (
+                dataset TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (dataset, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS coda_dataset_configuration_hashes (
+                coda_dataset_id TEXT PRIMARY KEY,
+                configuration_hash TEXT NOT NULL
+            );
+        """)
+        self._connection.commit()
+
+    def commit(self):
+        """
+        Commits all the writes made to this cache so far.
+        """
+        self._connection.commit()
+        self._uncommitted_writes = 0
+
+    def close(self):
+        """
+        Commits all the writes made to this cache so far, then closes the cache.
+        """
+        self.commit()
+        self._connection.close()
+
+    def _wrote(self):
+        self._uncommitted_writes += 1
+        if self._uncommitted_writes >= self.commit_interval:
+            self.commit()
+
+    def _get_value(self, table, key_column, key, value_column):
+        row = self._connection.execute(
+            f"SELECT {value_column} FROM {table} WHERE {key_column} = ?", (key,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _set_value(self, table, key_column, key, value_column, value):
+        self._connection.execute(
+            f"INSERT OR REPLACE INTO {table} ({key_column}, {value_column}) VALUES (?, ?)", (key, value)
+        )
+        self._wrote()
+
+    def _read_legacy_file(self, file_name):
+        # Caches written by earlier versions of this tool used a file per dataset. Read from these if the data isn't
+        # in the sqlite database yet, so that upgrading doesn't force a sync of everything from the beginning.
+        try:
+            with open(f"{self.cache_dir}/{file_name}") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
 
     def message_to_json(self, message):
         message_dict = message.to_dict()
@@ -30,34 +142,88 @@ class CodaSyncCache:
         message_dict["last_updated"] = datetime.fromisoformat(message_dict["last_updated"])
         return Message.from_dict(message_dict)
 
-    def _last_seen_message_path(self, dataset):
-        return f"{self.cache_dir}/last-seen-message-{dataset}.json"
-
     def get_last_seen_message(self, dataset):
-        try:
-            with open(self._last_seen_message_path(dataset)) as f:
-                return self.json_to_message(f.read())
-        except FileNotFoundError:
-            return None
+        blob = self._get_value("last_seen_messages", "dataset", dataset, "message")
+        if blob is None:
+            blob = self._read_legacy_file(f"last-seen-message-{dataset}.json")
+        return None if blob is None else self.json_to_message(blob)
 
     def set_last_seen_message(self, dataset, message):
-        export_path = self._last_seen_message_path(dataset)
-        IOUtils.ensure_dirs_exist_for_file(export_path)
-        with open(export_path, "w") as f:
-            f.write(self.message_to_json(message))
-
-    def _last_updated_timestamp_path(self, dataset):
-        return f"{self.cache_dir}/last-updated-timestamp-{dataset}.txt"
+        self._set_value("last_seen_messages", "dataset", dataset, "message", self.message_to_json(message))
 
     def get_last_updated_timestamp(self, dataset):
-        try:
-            with open(self._last_updated_timestamp_path(dataset)) as f:
-                return datetime.fromisoformat(f.read())
-        except FileNotFoundError:
-            return None
+        timestamp = self._get_value("last_updated_timestamps", "dataset", dataset, "timestamp")
+        if timestamp is None:
+            timestamp = self._read_legacy_file(f"last-updated-timestamp-{dataset}.txt")
+        return None if timestamp is None else datetime.fromisoformat(timestamp)
 
     def set_last_updated_timestamp(self, dataset, last_updated_timestamp):
-        export_path = self._last_updated_timestamp_path(dataset)
-        IOUtils.ensure_dirs_exist_for_file(export_path)
-        with open(export_path, "w") as f:
-            f.write(last_updated_timestamp.isoformat())
+        self._set_value("last_updated_timestamps", "dataset", dataset, "timestamp", last_updated_timestamp.isoformat())
+
+    def get_labels_fingerprints(self, dataset):
+        """
+        Gets the cached labels fingerprints for the given dataset.
+
+        :param dataset: Engagement database dataset to get the labels fingerprints for.
+        :type dataset: str
+        :return: Dictionary of engagement database message id -> fingerprint of the labels that message was last found
+                 to be up to date with. If there is no cache yet for this dataset, returns an empty dictionary.
+        :rtype: LabelsFingerprints
+        """
+        rows = self._connection.execute(
+            "SELECT message_id, fingerprint FROM labels_fingerprints WHERE dataset = ?", (dataset,)
+        ).fetchall()
+        return LabelsFingerprints(dict(rows))
+
+    def set_labels_fingerprints(self, dataset, labels_fingerprints):
+        """
+        Sets the cached labels fingerprints for the given dataset.
+
+        Only the fingerprints that were set or removed since `labels_fingerprints` was loaded or last saved are
+        written, so saving after each page of a sync costs time proportional to the page, not to the dataset.
+
+        :param dataset: Engagement database dataset to set the labels fingerprints for.
+        :type dataset: str
+        :param labels_fingerprints: Labels fingerprints for this dataset, as returned by `get_labels_fingerprints`.
+        :type labels_fingerprints: LabelsFingerprints
+        """
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO labels_fingerprints (dataset, message_id, fingerprint) VALUES (?, ?, ?)",
+            [(dataset, message_id, labels_fingerprints[message_id])
+             for message_id in labels_fingerprints.set_message_ids]
+        )
+        self._connection.executemany(
+            "DELETE FROM labels_fingerprints WHERE dataset = ? AND message_id = ?",
+            [(dataset, message_id) for message_id in labels_fingerprints.removed_message_ids]
+        )
+        labels_fingerprints.set_message_ids.clear()
+        labels_fingerprints.removed_message_ids.clear()
+        self._wrote()
+
+    def get_coda_dataset_configuration_hash(self, coda_dataset_id):
+        """
+        Gets the hash of the code schemes and users that were last applied to the given Coda dataset.
+
+        :param coda_dataset_id: Id of the Coda dataset to get the configuration hash for.
+        :type coda_dataset_id: str
+        :return: Hash of the configuration last applied to this dataset, or None if there is no cache yet for this
+                 dataset.
+        :rtype: str | None
+        """
+        return self._get_value(
+            "coda_dataset_configuration_hashes", "coda_dataset_id", coda_dataset_id, "configuration_hash"
+        )
+
+    def set_coda_dataset_configuration_hash(self, coda_dataset_id, configuration_hash):
+        """
+        Sets the hash of the code schemes and users that were last applied to the given Coda dataset.
+
+        :param coda_dataset_id: Id of the Coda dataset to set the configuration hash for.
+        :type coda_dataset_id: str
+        :param configuration_hash: Hash of the configuration applied to this dataset.
+        :type configuration_hash: str
+        """
+        self._set_value(
+            "coda_dataset_configuration_hashes", "coda_dataset_id", coda_dataset_id, "configuration_hash",
+            configuration_hash
+        )
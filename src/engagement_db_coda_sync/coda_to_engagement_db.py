@@ -3,58 +3,205 @@ from engagement_database.data_models import MessageStatuses
 from google.cloud import firestore
 
 from src.engagement_db_coda_sync.cache import CodaSyncCache
-from src.engagement_db_coda_sync.lib import _update_engagement_db_message_from_coda_message
+from src.engagement_db_coda_sync.lib import (_update_engagement_db_message_from_coda_message,
+                                              _engagement_db_message_matches_coda_message, _get_ws_correct_dataset,
+                                              make_dataset_code_scheme_registry, FIRESTORE_IN_QUERY_LIMIT)
+from src.common.sync_stats import format_eta
 from src.engagement_db_coda_sync.sync_stats import CodaToEngagementDBSyncStats, CodaSyncEvents
+from src.engagement_db_coda_sync.ws_correction import WSCorrectionPlanner
 
 log = Logger(__name__)
 
+# Number of Coda messages to sync between each checkpoint of the incremental cache.
+_CODA_MESSAGES_PAGE_SIZE = 500
+
+
+def _get_engagement_db_messages_for_coda_ids(engagement_db, engagement_db_dataset, coda_ids):
+    """
+    Downloads the engagement database messages in the given dataset that have any of the given coda ids, in bulk.
+
+    :param engagement_db: Engagement database to download the messages from.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param engagement_db_dataset: Dataset in the engagement database to download the messages from.
+    :type engagement_db_dataset: str
+    :param coda_ids: Coda ids to download the messages for.
+    :type coda_ids: iterable of str
+    :return: Dictionary of coda id -> engagement database messages with that coda id.
+             Coda ids which don't match any messages will not be in this dictionary.
+    :rtype: dict of str -> list of engagement_database.data_models.Message
+    """
+    coda_ids = sorted(set(coda_ids))
+    messages_by_coda_id = dict()  # of coda id -> list of Message
+    for i in range(0, len(coda_ids), FIRESTORE_IN_QUERY_LIMIT):
+        coda_ids_chunk = coda_ids[i:i + FIRESTORE_IN_QUERY_LIMIT]
+
+        # Firestore only supports one 'in' filter per query, so filter for status after downloading.
+        chunk_messages = engagement_db.get_messages(
+            firestore_query_filter=lambda q: q
+                .where("dataset", "==", engagement_db_dataset)
+                .where("coda_id", "in", coda_ids_chunk)
+        )
+        for msg in chunk_messages:
+            if msg.status not in [MessageStatuses.LIVE, MessageStatuses.STALE]:
+                continue
+            if msg.coda_id not in messages_by_coda_id:
+                messages_by_coda_id[msg.coda_id] = []
+            messages_by_coda_id[msg.coda_id].append(msg)
+
+    return messages_by_coda_id
+
+
+def _pages_of_coda_messages(coda_messages, page_size):
+    """
+    Yields the given Coda messages in pages, in order of when they were last updated.
+
+    Messages which have no last_updated timestamp are yielded first. Pages may be larger than `page_size` where
+    needed to ensure that messages with the same last_updated timestamp are always in the same page, so that a page's
+    most recent last_updated timestamp can be safely used as a `last_updated_after` checkpoint.
+
+    The given list is sorted in place, and messages are removed from it as their pages are yielded, so that pages which
+    have been processed can be garbage collected once the caller releases them. The caller must not otherwise use the
+    list after passing it here.
+
+    :param coda_messages: Coda messages to page. This list is emptied by the time the last page is yielded.
+    :type coda_messages: list of core_data_modules.data_models.Message
+    :param page_size: Target number of messages in each page.
+    :type page_size: int
+    :return: Generator of pages of Coda messages.
+    :rtype: generator of (list of core_data_modules.data_models.Message)
+    """
+    assert page_size > 0, f"page_size must be > 0, but was {page_size}"
+
+    # Sort in descending order so that pages can be cheaply popped off the end of the list.
+    remaining_messages = coda_messages
+    remaining_messages.sort(key=lambda msg: (msg.last_updated is not None, msg.last_updated or 0), reverse=True)
+    while len(remaining_messages) > 0:
+        page_end = max(len(remaining_messages) - page_size, 0)
+        last_updated = remaining_messages[page_end].last_updated
+        while page_end > 0 and last_updated is not None and \
+                remaining_messages[page_end - 1].last_updated == last_updated:
+            page_end -= 1
+
+        page = remaining_messages[page_end:]
+        page.reverse()
+        del remaining_messages[page_end:]
+        yield page
+
 
 @firestore.transactional
-def _sync_coda_message_to_engagement_db(transaction, coda_message, engagement_db, engagement_db_dataset, coda_config):
+def _update_engagement_db_message_in_transaction(transaction, engagement_db, message_id, coda_message,
+                                                 engagement_db_dataset, coda_config, code_scheme_registry,
+                                                 labels_fingerprints):
     """
-    Syncs a coda message to an engagement database, by downloading all the engagement database messages which match the
-    coda message's id and dataset, and making sure the labels match.
+    Re-downloads an engagement database message in a transaction, and updates it to match the labels in a Coda message.
+
+    The message is re-downloaded so that the update is applied to the latest version of the message. If the message no
+    longer matches the Coda message's id and dataset, it is left unchanged.
 
     :param transaction: Transaction in the engagement database to perform the update in.
     :type transaction: google.cloud.firestore.Transaction
+    :param engagement_db: Engagement database to update.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param message_id: Id of the engagement database message to update.
+    :type message_id: str
     :param coda_message: Coda Message to sync.
     :type coda_message: core_data_modules.data_models.Message
-    :param engagement_db: Engagement database to sync from.
+    :param engagement_db_dataset: Dataset in the engagement database to update.
+    :type engagement_db_dataset: str
+    :param coda_config: Configuration for the update.
+    :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the dataset being updated.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that message
+                                was last found to be up to date with.
+    :type labels_fingerprints: dict of str -> str
+    :return: Sync events for the update.
+    :rtype: list of str
+    """
+    engagement_db_messages = engagement_db.get_messages(
+        firestore_query_filter=lambda q: q.where("message_id", "==", message_id),
+        transaction=transaction
+    )
+    assert len(engagement_db_messages) == 1, \
+        f"Expected exactly 1 engagement db message with id '{message_id}', but found {len(engagement_db_messages)}"
+    engagement_db_message = engagement_db_messages[0]
+
+    if engagement_db_message.dataset != engagement_db_dataset or \
+            engagement_db_message.coda_id != coda_message.message_id or \
+            engagement_db_message.status not in [MessageStatuses.LIVE, MessageStatuses.STALE]:
+        log.info(f"Engagement db message {message_id} no longer matches Coda message {coda_message.message_id}; "
+                 f"not updating")
+        return []
+
+    return _update_engagement_db_message_from_coda_message(
+        engagement_db, engagement_db_message, coda_message, coda_config, code_scheme_registry,
+        transaction=transaction, labels_fingerprints=labels_fingerprints
+    )
+
+
+def _sync_coda_message_to_engagement_db(coda_message, engagement_db_messages, engagement_db, engagement_db_dataset,
+                                        coda_config, code_scheme_registry, labels_fingerprints, ws_correction_planner):
+    """
+    Syncs a coda message to an engagement database, by making sure the labels of all the engagement database messages
+    which match the coda message's id and dataset match.
+
+    The labels are compared outside of a transaction. A transaction is only opened for messages that need their labels
+    updated. Messages that need to be WS-corrected are added to the `ws_correction_planner`, to be moved later.
+
+    :param coda_message: Coda Message to sync.
+    :type coda_message: core_data_modules.data_models.Message
+    :param engagement_db_messages: Engagement database messages that match the coda message's id and dataset.
+    :type engagement_db_messages: list of engagement_database.data_models.Message
+    :param engagement_db: Engagement database to sync to.
     :type engagement_db: engagement_database.EngagementDatabase
     :param engagement_db_dataset: Dataset in the engagement database to update.
     :type engagement_db_dataset: str
     :param coda_config: Configuration for the update.
     :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the dataset being updated.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that message
+                                was last found to be up to date with.
+    :type labels_fingerprints: dict of str -> str
+    :param ws_correction_planner: Planner to add WS-corrections to.
+    :type ws_correction_planner: src.engagement_db_coda_sync.ws_correction.WSCorrectionPlanner
     :return Sync stats.
     :rtype src.engagement_db_coda_sync.sync_stats.CodaToEngagementDBSyncStats
     """
     sync_stats = CodaToEngagementDBSyncStats()
-
-    # Get the messages in the engagement database that match this dataset and coda message id
-    engagement_db_messages = engagement_db.get_messages(
-        firestore_query_filter=lambda q: q
-            .where("dataset", "==", engagement_db_dataset)
-            .where("coda_id", "==", coda_message.message_id)
-            .where("status", "in", [MessageStatuses.LIVE, MessageStatuses.STALE]),
-        transaction=transaction
-    )
     log.info(f"{len(engagement_db_messages)} engagement db message(s) match Coda message {coda_message.message_id}")
 
-    for _ in engagement_db_messages:
-        sync_stats.add_event(CodaSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB)
-
     # Update each of the matching messages with the labels currently in Coda.
     for i, engagement_db_message in enumerate(engagement_db_messages):
         log.info(f"Processing matching engagement message {i + 1}/{len(engagement_db_messages)}: "
                  f"{engagement_db_message.message_id}...")
-        message_sync_events = _update_engagement_db_message_from_coda_message(
-            engagement_db, engagement_db_message, coda_message, coda_config, transaction=transaction)
+        if _engagement_db_message_matches_coda_message(engagement_db_message, coda_message, coda_config,
+                                                       code_scheme_registry, labels_fingerprints):
+            log.debug("Labels match")
+            sync_stats.add_event(CodaSyncEvents.LABELS_MATCH)
+            continue
+
+        correct_dataset = _get_ws_correct_dataset(coda_message, coda_config, code_scheme_registry)
+        if correct_dataset is not None:
+            log.debug(f"Planning WS-correction from {engagement_db_message.dataset} to {correct_dataset}")
+            origin_details = {"coda_dataset": coda_config.get_dataset_config_by_engagement_db_dataset(
+                                  engagement_db_dataset).coda_dataset_id,
+                              "coda_message": coda_message.to_dict(serialize_datetimes_to_str=True)}
+            ws_correction_planner.add_ws_correction(engagement_db_message, correct_dataset, origin_details)
+            continue
+
+        with sync_stats.timer("engagement_db.update_message_labels"):
+            message_sync_events = _update_engagement_db_message_in_transaction(
+                engagement_db.transaction(), engagement_db, engagement_db_message.message_id, coda_message,
+                engagement_db_dataset, coda_config, code_scheme_registry, labels_fingerprints
+            )
         sync_stats.add_events(message_sync_events)
 
     return sync_stats
 
 
-def _sync_coda_dataset_to_engagement_db(coda, engagement_db, coda_config, dataset_config, cache=None):
+def _sync_coda_dataset_to_engagement_db(coda, engagement_db, coda_config, dataset_config, ws_correction_planner,
+                                        cache=None):
     """
     Syncs messages from one Coda dataset to an engagement database.
     
@@ -64,6 +211,10 @@ def _sync_coda_dataset_to_engagement_db(coda, engagement_db, coda_config, datase
     :type engagement_db: engagement_database.EngagementDatabase
     :param coda_config: Coda sync configuration.
     :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param dataset_config: Configuration for the dataset to sync.
+    :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param ws_correction_planner: Planner to use to WS-correct messages.
+    :type ws_correction_planner: src.engagement_db_coda_sync.ws_correction.WSCorrectionPlanner
     :param cache: Coda sync cache.
     :type cache: src.engagement_db_coda_sync.cache.CodaSyncCache | None
     :return Sync stats for the update.
@@ -72,27 +223,64 @@ def _sync_coda_dataset_to_engagement_db(coda, engagement_db, coda_config, datase
     log.info(f"Getting messages from Coda dataset {dataset_config.coda_dataset_id}...")
 
     sync_stats = CodaToEngagementDBSyncStats()
+    code_scheme_registry = make_dataset_code_scheme_registry(dataset_config, coda_config.ws_correct_dataset_code_scheme)
+    labels_fingerprints = dict() if cache is None else cache.get_labels_fingerprints(dataset_config.engagement_db_dataset)
 
-    coda_messages = coda.get_dataset_messages(
-        dataset_config.coda_dataset_id,
-        last_updated_after=None if cache is None else cache.get_last_updated_timestamp(dataset_config.coda_dataset_id)
-    )
-    for _ in coda_messages:
-        sync_stats.add_event(CodaSyncEvents.READ_MESSAGE_FROM_CODA)
-
-    for i, coda_message in enumerate(coda_messages):
-        log.info(f"Processing Coda message {i + 1}/{len(coda_messages)}: {coda_message.message_id}...")
-        message_sync_stats = _sync_coda_message_to_engagement_db(
-            engagement_db.transaction(), coda_message, engagement_db, dataset_config.engagement_db_dataset,
-            coda_config
-        )
-        sync_stats.add_stats(message_sync_stats)
+    last_updated_after = None if cache is None else cache.get_last_updated_timestamp(dataset_config.coda_dataset_id)
+    with sync_stats.timer("coda.get_dataset_messages"):
+        coda_messages = coda.get_dataset_messages(dataset_config.coda_dataset_id, last_updated_after=last_updated_after)
+    coda_messages_count = len(coda_messages)
+    log.info(f"Downloaded {coda_messages_count} message(s) from Coda dataset {dataset_config.coda_dataset_id}")
 
-    seen_timestamps = [msg.last_updated for msg in coda_messages if msg.last_updated is not None]
-    if cache is not None and len(seen_timestamps) > 0:
-        most_recently_updated_timestamp = sorted(seen_timestamps)[-1]
-        cache.set_last_updated_timestamp(dataset_config.coda_dataset_id, most_recently_updated_timestamp)
+    most_recently_updated_timestamp = None
+    pages = _pages_of_coda_messages(coda_messages, _CODA_MESSAGES_PAGE_SIZE)
+    del coda_messages  # Now owned by the pages generator, which releases each page's messages as it yields them.
+    for page in pages:
+        # Download all the engagement database messages that match the Coda messages in this page in bulk, rather
+        # than querying for each Coda message in turn.
+        log.info(f"Getting engagement db messages that match the {len(page)} Coda message(s) in this page...")
+        with sync_stats.timer("engagement_db.get_messages_for_coda_ids"):
+            engagement_db_messages_by_coda_id = _get_engagement_db_messages_for_coda_ids(
+                engagement_db, dataset_config.engagement_db_dataset, [msg.message_id for msg in page]
+            )
+        for engagement_db_messages in engagement_db_messages_by_coda_id.values():
+            for _ in engagement_db_messages:
+                sync_stats.add_event(CodaSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB)
 
+        for coda_message in page:
+            sync_stats.add_event(CodaSyncEvents.READ_MESSAGE_FROM_CODA)
+            messages_processed = sync_stats.event_counts[CodaSyncEvents.READ_MESSAGE_FROM_CODA]
+            eta = sync_stats.eta_seconds(CodaSyncEvents.READ_MESSAGE_FROM_CODA, coda_messages_count)
+            log.info(f"Processing Coda message {messages_processed}/{coda_messages_count} ({format_eta(eta)}): "
+                     f"{coda_message.message_id}...")
+            with sync_stats.timer("sync_coda_message"):
+                message_sync_stats = _sync_coda_message_to_engagement_db(
+                    coda_message, engagement_db_messages_by_coda_id.get(coda_message.message_id, []), engagement_db,
+                    dataset_config.engagement_db_dataset, coda_config, code_scheme_registry, labels_fingerprints,
+                    ws_correction_planner
+                )
+            sync_stats.add_stats(message_sync_stats)
+
+            if coda_message.last_updated is not None and \
+                    (most_recently_updated_timestamp is None or
+                     coda_message.last_updated > most_recently_updated_timestamp):
+                most_recently_updated_timestamp = coda_message.last_updated
+
+        # Apply this page's WS-corrections before checkpointing, so that none are lost if the sync is interrupted.
+        with sync_stats.timer("engagement_db.apply_ws_corrections"):
+            applied_ws_corrections = ws_correction_planner.apply(engagement_db, labels_fingerprints)
+        for _ in applied_ws_corrections:
+            sync_stats.add_event(CodaSyncEvents.WS_CORRECTION)
+
+        # Checkpoint after each page, so that an interrupted sync resumes from the end of the last complete page.
+        # Pages never split messages that share a last_updated timestamp, so no messages are skipped on resume.
+        if cache is not None:
+            cache.set_labels_fingerprints(dataset_config.engagement_db_dataset, labels_fingerprints)
+            if most_recently_updated_timestamp is not None:
+                cache.set_last_updated_timestamp(dataset_config.coda_dataset_id, most_recently_updated_timestamp)
+            cache.commit()
+
+    sync_stats.stop()
     return sync_stats
 
 
@@ -109,6 +297,11 @@ def sync_coda_to_engagement_db(coda, engagement_db, coda_config, cache_path=None
     :param cache_path: Path to a directory to use to cache results needed for incremental operation.
                        If None, runs in non-incremental mode.
     :type cache_path: str | None
+    :return: A tuple of:
+             1. Sync stats for all the datasets synced.
+             2. The engagement database datasets that messages were WS-corrected to. These datasets need to be
+                re-synced to Coda so that the moved messages can be labelled in their new datasets.
+    :rtype: (src.engagement_db_coda_sync.sync_stats.CodaToEngagementDBSyncStats, set of str)
     """
     # Initialise the cache
     if cache_path is None:
@@ -120,10 +313,13 @@ def sync_coda_to_engagement_db(coda, engagement_db, coda_config, cache_path=None
 
     # Sync each Coda dataset to the engagement db in turn
     dataset_to_sync_stats = dict()  # of coda dataset id -> CodaToEngagementDBSyncStats
+    ws_correction_planner = WSCorrectionPlanner()
     for dataset_config in coda_config.dataset_configurations:
         log.info(f"Syncing Coda dataset {dataset_config.coda_dataset_id} to engagement db dataset "
                  f"{dataset_config.coda_dataset_id}")
-        dataset_sync_stats = _sync_coda_dataset_to_engagement_db(coda, engagement_db, coda_config, dataset_config, cache)
+        dataset_sync_stats = _sync_coda_dataset_to_engagement_db(
+            coda, engagement_db, coda_config, dataset_config, ws_correction_planner, cache
+        )
         dataset_to_sync_stats[dataset_config.coda_dataset_id] = dataset_sync_stats
 
     # Log the summaries of actions taken for each dataset then for all datasets combined.
@@ -135,3 +331,8 @@ def sync_coda_to_engagement_db(coda, engagement_db, coda_config, cache_path=None
 
     log.info(f"Summary of actions for all datasets:")
     all_sync_stats.print_summary()
+
+    if cache is not None:
+        cache.close()
+
+    return all_sync_stats, ws_correction_planner.resync_datasets
@@ -1,17 +1,96 @@
+import time
+
 from core_data_modules.logging import Logger
 from core_data_modules.util import SHAUtils
 from engagement_database.data_models import MessageStatuses, HistoryEntryOrigin
 from google.cloud import firestore
 
 from src.engagement_db_coda_sync.cache import CodaSyncCache
-from src.engagement_db_coda_sync.lib import _update_engagement_db_message_from_coda_message, _add_message_to_coda
+from src.engagement_db_coda_sync.lib import (_update_engagement_db_message_from_coda_message, _add_message_to_coda,
+                                              make_dataset_code_scheme_registry)
 from src.engagement_db_coda_sync.sync_stats import EngagementDBToCodaSyncStats, CodaSyncEvents
 
 log = Logger(__name__)
 
+# Maximum number of messages to assign coda ids to in each transaction. Firestore allows up to 500 writes per
+# transaction, and each message update writes both the message and a history entry.
+_CODA_ID_BACKFILL_BATCH_SIZE = 200
+
 
 @firestore.transactional
-def _sync_next_engagement_db_message_to_coda(transaction, engagement_db, coda, coda_config, dataset_config, last_seen_message):
+def _set_coda_ids_for_next_batch(transaction, engagement_db, dataset_config, batch_size):
+    """
+    Assigns coda ids to a batch of the messages in an engagement database dataset that don't have a coda id yet,
+    in a single transaction.
+
+    :param transaction: Transaction in the engagement database to perform the update in.
+    :type transaction: google.cloud.firestore.Transaction
+    :param engagement_db: Engagement database to update.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param dataset_config: Configuration for the dataset to update.
+    :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param batch_size: Maximum number of messages to update.
+    :type batch_size: int
+    :return: Number of messages that were assigned a coda id. If 0, there are no more messages in this dataset that
+             need a coda id.
+    :rtype: int
+    """
+    messages = engagement_db.get_messages(
+        firestore_query_filter=lambda q: q
+            .where("status", "in", [MessageStatuses.LIVE, MessageStatuses.STALE])
+            .where("dataset", "==", dataset_config.engagement_db_dataset)
+            .where("coda_id", "==", None)
+            .limit(batch_size),
+        transaction=transaction
+    )
+
+    for msg in messages:
+        msg.coda_id = SHAUtils.sha_string(msg.text)
+        engagement_db.set_message(
+            message=msg,
+            origin=HistoryEntryOrigin(origin_name="Set coda_id", details={}),
+            transaction=transaction
+        )
+
+    return len(messages)
+
+
+def _set_missing_coda_ids(engagement_db, dataset_config):
+    """
+    Assigns coda ids to all the messages in an engagement database dataset that don't have a coda id yet.
+
+    Writes are made in batches of `_CODA_ID_BACKFILL_BATCH_SIZE` messages. Doing this before syncing a dataset to Coda
+    means the sync doesn't need to write coda ids back itself, so it doesn't see those messages a second time when
+    they come up again, with their new last_updated timestamps, later in the sync.
+
+    :param engagement_db: Engagement database to update.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param dataset_config: Configuration for the dataset to update.
+    :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :return: Sync stats for the update.
+    :rtype: src.engagement_db_coda_sync.sync_stats.EngagementDBToCodaSyncStats
+    """
+    log.info(f"Setting coda ids for messages in dataset {dataset_config.engagement_db_dataset} that don't have one...")
+    sync_stats = EngagementDBToCodaSyncStats()
+    while True:
+        with sync_stats.timer("engagement_db.set_coda_ids_batch"):
+            updated_messages = _set_coda_ids_for_next_batch(
+                engagement_db.transaction(), engagement_db, dataset_config, _CODA_ID_BACKFILL_BATCH_SIZE
+            )
+        if updated_messages == 0:
+            break
+
+        for _ in range(updated_messages):
+            sync_stats.add_event(CodaSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB)
+            sync_stats.add_event(CodaSyncEvents.SET_CODA_ID)
+        log.info(f"Set coda ids for {sync_stats.event_counts[CodaSyncEvents.SET_CODA_ID]} message(s)")
+
+    return sync_stats
+
+
+@firestore.transactional
+def _sync_next_engagement_db_message_to_coda(transaction, engagement_db, coda, coda_config, dataset_config,
+                                             code_scheme_registry, labels_fingerprints, last_seen_message):
     """
     Syncs a message from an engagement database to Coda.
 
@@ -31,6 +110,11 @@ def _sync_next_engagement_db_message_to_coda(transaction, engagement_db, coda, c
     :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
     :param dataset_config: Configuration for the dataset to sync.
     :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the dataset to sync.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that message
+                                was last found to be up to date with.
+    :type labels_fingerprints: dict of str -> str
     :param last_seen_message: Last seen message, downloaded from the database in a previous call, or None.
                               If provided, downloads the least recently updated (next) message after this one, otherwise
                               downloads the least recently updated message in the database.
@@ -69,7 +153,9 @@ def _sync_next_engagement_db_message_to_coda(transaction, engagement_db, coda, c
 
     log.info(f"Syncing message {engagement_db_message.message_id}...")
 
-    # Ensure the message has a valid coda id. If it doesn't have one yet, write one back to the database.
+    # Ensure the message has a valid coda id. Coda ids are normally assigned in bulk before the sync starts
+    # (see `_set_missing_coda_ids`), but a message may have been added since. If it doesn't have one yet, write one
+    # back to the database.
     if engagement_db_message.coda_id is None:
         log.debug("Creating coda id")
         sync_stats.add_event(CodaSyncEvents.SET_CODA_ID)
@@ -82,20 +168,23 @@ def _sync_next_engagement_db_message_to_coda(transaction, engagement_db, coda, c
     assert engagement_db_message.coda_id == SHAUtils.sha_string(engagement_db_message.text)
 
     # Look-up this message in Coda
-    coda_message = coda.get_dataset_message(dataset_config.coda_dataset_id, engagement_db_message.coda_id)
+    with sync_stats.timer("coda.get_dataset_message"):
+        coda_message = coda.get_dataset_message(dataset_config.coda_dataset_id, engagement_db_message.coda_id)
 
     # If the message exists in Coda, update the database message based on the labels assigned in Coda
     if coda_message is not None:
         log.debug("Message already exists in Coda")
         update_sync_events = _update_engagement_db_message_from_coda_message(
-            engagement_db, engagement_db_message, coda_message, coda_config, transaction=transaction
+            engagement_db, engagement_db_message, coda_message, coda_config, code_scheme_registry,
+            transaction=transaction, labels_fingerprints=labels_fingerprints
         )
         sync_stats.add_events(update_sync_events)
         return engagement_db_message, sync_stats
 
     # The message isn't in Coda, so add it
     sync_stats.add_event(CodaSyncEvents.ADD_MESSAGE_TO_CODA)
-    _add_message_to_coda(coda, dataset_config, coda_config.ws_correct_dataset_code_scheme, engagement_db_message)
+    with sync_stats.timer("coda.add_message_to_dataset"):
+        _add_message_to_coda(coda, dataset_config, code_scheme_registry, engagement_db_message)
 
     return engagement_db_message, sync_stats
 
@@ -122,14 +211,21 @@ def _sync_engagement_db_dataset_to_coda(engagement_db, coda, coda_config, datase
     synced_message_ids = set()
 
     sync_stats = EngagementDBToCodaSyncStats()
+    code_scheme_registry = make_dataset_code_scheme_registry(dataset_config, coda_config.ws_correct_dataset_code_scheme)
+    labels_fingerprints = dict() if cache is None else cache.get_labels_fingerprints(dataset_config.engagement_db_dataset)
+
+    sync_stats.add_stats(_set_missing_coda_ids(engagement_db, dataset_config))
 
     first_run = True
     while first_run or last_seen_message is not None:
         first_run = False
 
+        message_start = time.perf_counter()
         last_seen_message, message_sync_stats = _sync_next_engagement_db_message_to_coda(
-            engagement_db.transaction(), engagement_db, coda, coda_config, dataset_config, last_seen_message
+            engagement_db.transaction(), engagement_db, coda, coda_config, dataset_config, code_scheme_registry,
+            labels_fingerprints, last_seen_message
         )
+        message_sync_stats.add_timing("sync_engagement_db_message", time.perf_counter() - message_start)
         sync_stats.add_stats(message_sync_stats)
 
         if last_seen_message is not None:
@@ -138,8 +234,8 @@ def _sync_engagement_db_dataset_to_coda(engagement_db, coda, coda_config, datase
             if cache is not None:
                 cache.set_last_seen_message(dataset_config.engagement_db_dataset, last_seen_message)
 
-            # We can see the same message twice in a run if we need to set a coda id, labels, or do WS correction,
-            # because in these cases we'll write back to one of the retrieved documents.
+            # We can see the same message twice in a run if we need to set labels or do WS correction, because in
+            # these cases we'll write back to one of the retrieved documents.
             # Log both the number of message objects processed and the number of unique message ids seen so we can
             # monitor both.
             log.info(f"Synced {synced_messages} message objects ({len(synced_message_ids)} unique message ids) in "
@@ -147,10 +243,15 @@ def _sync_engagement_db_dataset_to_coda(engagement_db, coda, coda_config, datase
         else:
             log.info(f"No more new messages in dataset {dataset_config.engagement_db_dataset}")
 
+    if cache is not None:
+        cache.set_labels_fingerprints(dataset_config.engagement_db_dataset, labels_fingerprints)
+        cache.commit()
+
+    sync_stats.stop()
     return sync_stats
 
 
-def sync_engagement_db_to_coda(engagement_db, coda, coda_config, cache_path=None):
+def sync_engagement_db_to_coda(engagement_db, coda, coda_config, cache_path=None, engagement_db_datasets=None):
     """
     Syncs messages from an engagement database to Coda.
 
@@ -163,7 +264,19 @@ def sync_engagement_db_to_coda(engagement_db, coda, coda_config, cache_path=None
     :param cache_path: Path to a directory to use to cache results needed for incremental operation.
                        If None, runs in non-incremental mode.
     :type cache_path: str | None
+    :param engagement_db_datasets: Engagement database datasets to sync, or None to sync all the datasets in the
+                                   `coda_config`. Datasets which aren't in the `coda_config` are ignored.
+    :type engagement_db_datasets: iterable of str | None
+    :return: Sync stats for all the datasets synced.
+    :rtype: src.engagement_db_coda_sync.sync_stats.EngagementDBToCodaSyncStats
     """
+    if engagement_db_datasets is None:
+        dataset_configurations = coda_config.dataset_configurations
+    else:
+        engagement_db_datasets = set(engagement_db_datasets)
+        dataset_configurations = [dataset_config for dataset_config in coda_config.dataset_configurations
+                                  if dataset_config.engagement_db_dataset in engagement_db_datasets]
+
     # Initialise the cache
     if cache_path is None:
         cache = None
@@ -174,7 +287,7 @@ def sync_engagement_db_to_coda(engagement_db, coda, coda_config, cache_path=None
 
     # Sync each dataset in turn to Coda
     dataset_to_sync_stats = dict()  # of engagement db dataset -> EngagementDBToCodaSyncStats
-    for dataset_config in coda_config.dataset_configurations:
+    for dataset_config in dataset_configurations:
         log.info(f"Syncing engagement db dataset {dataset_config.engagement_db_dataset} to Coda dataset "
                  f"{dataset_config.coda_dataset_id}...")
         dataset_sync_stats = _sync_engagement_db_dataset_to_coda(engagement_db, coda, coda_config, dataset_config, cache)
@@ -182,10 +295,15 @@ def sync_engagement_db_to_coda(engagement_db, coda, coda_config, cache_path=None
 
     # Log the summaries of actions taken for each dataset then for all datasets combined.
     all_sync_stats = EngagementDBToCodaSyncStats()
-    for dataset_config in coda_config.dataset_configurations:
+    for dataset_config in dataset_configurations:
         log.info(f"Summary of actions for engagement db dataset '{dataset_config.engagement_db_dataset}':")
         dataset_to_sync_stats[dataset_config.engagement_db_dataset].print_summary()
         all_sync_stats.add_stats(dataset_to_sync_stats[dataset_config.engagement_db_dataset])
 
     log.info(f"Summary of actions for all datasets:")
     all_sync_stats.print_summary()
+
+    if cache is not None:
+        cache.close()
+
+    return all_sync_stats
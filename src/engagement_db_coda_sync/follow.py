@@ -0,0 +1,60 @@
+import signal
+import time
+
+from core_data_modules.logging import Logger
+
+log = Logger(__name__)
+
+
+def follow(sync_pass, min_poll_interval_seconds=5, max_poll_interval_seconds=120, backoff_factor=2):
+    """
+    Repeatedly runs a sync pass, until the process is interrupted or terminated.
+
+    Each pass is expected to sync only the changes since the previous pass, using cursors persisted in an incremental
+    cache. The next pass starts after `min_poll_interval_seconds` if the previous pass found changes, so that new
+    messages are synced within seconds. While passes don't find any changes, the interval between passes backs off
+    exponentially up to `max_poll_interval_seconds`, to reduce the load placed on the services being polled.
+
+    The pass that is running when a SIGINT or SIGTERM is received is allowed to finish, so that its cursors are saved,
+    before this function returns.
+
+    :param sync_pass: Function which runs one pass of a sync, and returns whether it found any changes to sync.
+    :type sync_pass: function with signature () -> bool
+    :param min_poll_interval_seconds: Minimum time to wait between passes.
+    :type min_poll_interval_seconds: float
+    :param max_poll_interval_seconds: Maximum time to wait between passes.
+    :type max_poll_interval_seconds: float
+    :param backoff_factor: Factor to multiply the time to wait between passes by after each pass that finds no changes.
+    :type backoff_factor: float
+    """
+    assert 0 < min_poll_interval_seconds <= max_poll_interval_seconds, \
+        f"Poll intervals must satisfy 0 < min_poll_interval_seconds <= max_poll_interval_seconds, but got " \
+        f"min_poll_interval_seconds={min_poll_interval_seconds}, max_poll_interval_seconds={max_poll_interval_seconds}"
+    assert backoff_factor >= 1, f"backoff_factor must be >= 1, but was {backoff_factor}"
+
+    stop_requested = False
+
+    def request_stop(signum, frame):
+        nonlocal stop_requested
+        log.info(f"Received signal {signum}; stopping after the current sync pass...")
+        stop_requested = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    poll_interval_seconds = min_poll_interval_seconds
+    passes = 0
+    while not stop_requested:
+        passes += 1
+        log.info(f"Starting sync pass {passes}...")
+        if sync_pass():
+            poll_interval_seconds = min_poll_interval_seconds
+        else:
+            poll_interval_seconds = min(poll_interval_seconds * backoff_factor, max_poll_interval_seconds)
+
+        log.info(f"Waiting {poll_interval_seconds} seconds before the next sync pass...")
+        wait_until = time.monotonic() + poll_interval_seconds
+        while not stop_requested and time.monotonic() < wait_until:
+            time.sleep(max(0, min(1, wait_until - time.monotonic())))
+
+    log.info(f"Stopped following after {passes} sync pass(es)")
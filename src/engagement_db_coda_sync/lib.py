@@ -1,18 +1,25 @@
 import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from coda_v2_python_client.firebase_client_wrapper import CodaV2Client
 from core_data_modules.cleaners import Codes
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.data_models import Message as CodaMessage, Label, Origin
 from core_data_modules.logging import Logger
-from core_data_modules.util import TimeUtils
+from core_data_modules.util import TimeUtils, SHAUtils
 from engagement_database.data_models import HistoryEntryOrigin
 from storage.google_cloud import google_cloud_utils
 
+from src.common.code_scheme_registry import CodeSchemeRegistry
+from src.engagement_db_coda_sync.cache import CodaSyncCache
 from src.engagement_db_coda_sync.sync_stats import CodaSyncEvents, EngagementDBToCodaSyncStats
 
 log = Logger(__name__)
 
+# Maximum number of values to use in a Firestore 'in' query. Firestore supports up to 30 values when combined with
+# other filters, but older server and client versions are limited to 10, so we use the more conservative limit here.
+FIRESTORE_IN_QUERY_LIMIT = 10
+
 
 def get_coda_users_from_gcloud(dataset_users_file_url, google_cloud_credentials_file_path):
     return json.loads(google_cloud_utils.download_blob_to_string(
@@ -20,10 +27,115 @@ def get_coda_users_from_gcloud(dataset_users_file_url, google_cloud_credentials_
     ))
 
 
-def ensure_coda_datasets_up_to_date(coda, coda_config, google_cloud_credentials_file_path): 
+def make_dataset_code_scheme_registry(coda_dataset_config, ws_correct_dataset_code_scheme):
+    """
+    Builds a registry of the code schemes that labels in a Coda dataset may be assigned under.
+
+    :param coda_dataset_config: Configuration for the Coda dataset to build the registry for.
+    :type coda_dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
+    :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :return: Registry of this dataset's code schemes and the WS - Correct Dataset code scheme.
+    :rtype: src.common.code_scheme_registry.CodeSchemeRegistry
+    """
+    code_schemes = [c.code_scheme for c in coda_dataset_config.code_scheme_configurations]
+    code_schemes.append(ws_correct_dataset_code_scheme)
+    return CodeSchemeRegistry(code_schemes)
+
+
+def _get_repo_code_schemes(dataset_config, ws_correct_dataset_code_scheme):
+    """
+    Gets the code schemes that a Coda dataset should have, according to this repository.
+
+    :param dataset_config: Configuration for the Coda dataset.
+    :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
+    :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :return: Code schemes for the Coda dataset, including duplicates (e.g. 'Scheme-abc123-2').
+    :rtype: list of core_data_modules.data_models.CodeScheme
+    """
+    repo_code_schemes = []
+    for code_scheme_config in dataset_config.code_scheme_configurations:
+        for count in range(1, code_scheme_config.coda_code_schemes_count + 1):
+            if count == 1:
+                repo_code_schemes.append(code_scheme_config.code_scheme)
+            else:
+                code_scheme_copy = code_scheme_config.code_scheme.copy()
+                code_scheme_copy.scheme_id = f"{code_scheme_copy.scheme_id}-{count}"
+                repo_code_schemes.append(code_scheme_copy)
+    repo_code_schemes.append(ws_correct_dataset_code_scheme)
+    return repo_code_schemes
+
+
+def _coda_dataset_configuration_hash(repo_code_schemes, user_ids):
+    """
+    Computes a hash of the configuration to apply to a Coda dataset.
+
+    :param repo_code_schemes: Code schemes the Coda dataset should have.
+    :type repo_code_schemes: list of core_data_modules.data_models.CodeScheme
+    :param user_ids: User ids the Coda dataset should have.
+    :type user_ids: list of str
+    :return: Hash of the configuration.
+    :rtype: str
+    """
+    return SHAUtils.sha_string(json.dumps({
+        "code_schemes": [code_scheme.to_firebase_map() for code_scheme in repo_code_schemes],
+        "user_ids": user_ids
+    }, sort_keys=True))
+
+
+def _ensure_coda_dataset_up_to_date(coda, dataset_config, repo_code_schemes, user_ids):
+    """
+    Ensures a Coda dataset has the given user ids and code schemes.
+
+    :param coda: Coda instance to update.
+    :type coda: coda_v2_python_client.firebase_client_wrapper.CodaV2Client
+    :param dataset_config: Configuration for the Coda dataset to update.
+    :type dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param repo_code_schemes: Code schemes the Coda dataset should have.
+    :type repo_code_schemes: list of core_data_modules.data_models.CodeScheme
+    :param user_ids: User ids the Coda dataset should have.
+    :type user_ids: list of str
+    """
+    coda.set_dataset_user_ids(dataset_config.coda_dataset_id, user_ids)
+
+    repo_code_schemes = list(repo_code_schemes)
+    repo_code_schemes_lut = {code_scheme.scheme_id: code_scheme for code_scheme in repo_code_schemes}
+
+    coda_code_schemes = coda.get_all_code_schemes(dataset_config.coda_dataset_id)
+    coda_code_schemes_lut = {code_scheme.scheme_id: code_scheme for code_scheme in coda_code_schemes}
+
+    for coda_scheme_id, coda_code_scheme in coda_code_schemes_lut.items():
+        if coda_scheme_id not in repo_code_schemes_lut.keys():
+            log.warning(f"There are code schemes in coda not in this repo; The code schemes will be ignored")
+            coda_code_schemes.remove(coda_code_scheme)
+
+    for repo_scheme_id, repo_code_scheme in repo_code_schemes_lut.items():
+        if repo_scheme_id not in coda_code_schemes_lut.keys():
+            coda.set_dataset_code_scheme(dataset_config.coda_dataset_id, repo_code_scheme)
+            repo_code_schemes.remove(repo_code_scheme)
+
+    assert len(repo_code_schemes) == len(coda_code_schemes), \
+            f"`repo_code_schemes` must be equal to `coda_code_schemes`"
+
+    repo_code_schemes.sort(key=lambda s: s.scheme_id)
+    coda_code_schemes.sort(key=lambda s: s.scheme_id)
+
+    repo_and_coda_code_schemes_pairs = zip(repo_code_schemes, coda_code_schemes)
+    for repo_code_scheme, coda_code_scheme in repo_and_coda_code_schemes_pairs:
+        if repo_code_scheme != coda_code_scheme:
+            log.info(f"Updating code scheme {coda_code_scheme.scheme_id} in coda with the one in this repository")
+            coda.set_dataset_code_scheme(dataset_config.coda_dataset_id, repo_code_scheme)
+
+
+def ensure_coda_datasets_up_to_date(coda, coda_config, google_cloud_credentials_file_path, cache_path=None,
+                                    max_workers=4):
     """
     Ensures coda datasets are up to date based on coda configuration. 
 
+    If a cache is provided, datasets whose code schemes and users haven't changed since they were last brought up to
+    date are skipped, without making any requests to Coda. The remaining datasets are updated concurrently.
+
     :param coda: Coda instance to add the message to.
     :type coda: coda_v2_python_client.firebase_client_wrapper.CodaV2Client
     :param coda_config: Coda sync configuration.
@@ -31,64 +143,66 @@ def ensure_coda_datasets_up_to_date(coda, coda_config, google_cloud_credentials_
     :param google_cloud_credentials_file_path: Path to a Google Cloud service account credentials file 
                                                to use to access the credentials bucket.
     :type google_cloud_credentials_file_path: str
+    :param cache_path: Path to a directory to use to cache results needed for incremental operation.
+                       If None, updates every dataset.
+    :type cache_path: str | None
+    :param max_workers: Maximum number of datasets to update concurrently.
+    :type max_workers: int
     """
+    cache = None if cache_path is None else CodaSyncCache(cache_path)
+
     all_datasets_have_user_file_url = all(
         dataset_config.dataset_users_file_url is not None for dataset_config in coda_config.dataset_configurations)
 
-    default_project_user_ids = []
+    # Download each users file once, even if it's referenced by multiple datasets.
+    users_file_url_to_user_ids = dict()  # of users file url -> list of user ids
     if not all_datasets_have_user_file_url:
         assert coda_config.project_users_file_url is not None, \
          f"Specify user ids for coda datasets in CodaDatasetConfiguration or user ids for this project in CodaSyncConfiguration"
-        default_project_user_ids = get_coda_users_from_gcloud(coda_config.project_users_file_url, google_cloud_credentials_file_path)
+        users_file_url_to_user_ids[coda_config.project_users_file_url] = get_coda_users_from_gcloud(
+            coda_config.project_users_file_url, google_cloud_credentials_file_path)
 
-    ws_correct_dataset_code_scheme = coda_config.ws_correct_dataset_code_scheme
+    # Work out which datasets have changed since they were last brought up to date.
+    datasets_to_update = []  # of (dataset_config, repo_code_schemes, user_ids, configuration_hash)
     for dataset_config in coda_config.dataset_configurations:
-        config_user_ids = []
-        if dataset_config.dataset_users_file_url:
-            config_user_ids = get_coda_users_from_gcloud(dataset_config.dataset_users_file_url, google_cloud_credentials_file_path)
-        else:
-            config_user_ids = default_project_user_ids
-        coda.set_dataset_user_ids(dataset_config.coda_dataset_id, config_user_ids)
-
-        repo_code_schemes = []
-        for code_scheme_config in dataset_config.code_scheme_configurations:
-            for count in range(1, code_scheme_config.coda_code_schemes_count + 1):
-                if count == 1:
-                    repo_code_schemes.append(code_scheme_config.code_scheme)
-                else:
-                    code_scheme_copy = code_scheme_config.code_scheme.copy()
-                    code_scheme_copy.scheme_id = f"{code_scheme_copy.scheme_id}-{count}"
-                    repo_code_schemes.append(code_scheme_copy)
-        repo_code_schemes.append(ws_correct_dataset_code_scheme)
-        repo_code_schemes_lut = {code_scheme.scheme_id: code_scheme for code_scheme in repo_code_schemes}
-
-        coda_code_schemes = coda.get_all_code_schemes(dataset_config.coda_dataset_id)
-        coda_code_schemes_lut = {code_scheme.scheme_id: code_scheme for code_scheme in coda_code_schemes}
-
-        for coda_scheme_id, coda_code_scheme in coda_code_schemes_lut.items():
-            if coda_scheme_id not in repo_code_schemes_lut.keys():
-                log.warning(f"There are code schemes in coda not in this repo; The code schemes will be ignored")
-                coda_code_schemes.remove(coda_code_scheme)
-
-        for repo_scheme_id, repo_code_scheme in repo_code_schemes_lut.items():
-            if repo_scheme_id not in coda_code_schemes_lut.keys():
-                coda.set_dataset_code_scheme(dataset_config.coda_dataset_id, repo_code_scheme)
-                repo_code_schemes.remove(repo_code_scheme)
-
-        assert len(repo_code_schemes) == len(coda_code_schemes), \
-                f"`repo_code_schemes` must be equal to `coda_code_schemes`"
-        
-        repo_code_schemes.sort(key=lambda s: s.scheme_id)
-        coda_code_schemes.sort(key=lambda s: s.scheme_id)
-        
-        repo_and_coda_code_schemes_pairs = zip(repo_code_schemes, coda_code_schemes)
-        for repo_code_scheme, coda_code_scheme in repo_and_coda_code_schemes_pairs:
-            if repo_code_scheme != coda_code_scheme:
-                log.info(f"Updating code scheme {coda_code_scheme.scheme_id} in coda with the one in this repository")
-                coda.set_dataset_code_scheme(dataset_config.coda_dataset_id, repo_code_scheme)
-
-
-def _add_message_to_coda(coda, coda_dataset_config, ws_correct_dataset_code_scheme, engagement_db_message):
+        users_file_url = dataset_config.dataset_users_file_url
+        if not users_file_url:
+            users_file_url = coda_config.project_users_file_url
+        if users_file_url not in users_file_url_to_user_ids:
+            users_file_url_to_user_ids[users_file_url] = get_coda_users_from_gcloud(
+                users_file_url, google_cloud_credentials_file_path)
+        user_ids = users_file_url_to_user_ids[users_file_url]
+
+        repo_code_schemes = _get_repo_code_schemes(dataset_config, coda_config.ws_correct_dataset_code_scheme)
+        configuration_hash = _coda_dataset_configuration_hash(repo_code_schemes, user_ids)
+
+        if cache is not None and cache.get_coda_dataset_configuration_hash(dataset_config.coda_dataset_id) == \
+                configuration_hash:
+            log.info(f"Code schemes and users for Coda dataset {dataset_config.coda_dataset_id} are unchanged since "
+                     f"they were last applied; skipping")
+            continue
+
+        datasets_to_update.append((dataset_config, repo_code_schemes, user_ids, configuration_hash))
+
+    log.info(f"Updating {len(datasets_to_update)}/{len(coda_config.dataset_configurations)} Coda datasets...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(_ensure_coda_dataset_up_to_date, coda, dataset_config, repo_code_schemes, user_ids):
+                (dataset_config, configuration_hash)
+            for dataset_config, repo_code_schemes, user_ids, configuration_hash in datasets_to_update
+        }
+        for future in as_completed(futures):
+            dataset_config, configuration_hash = futures[future]
+            future.result()
+            log.info(f"Updated Coda dataset {dataset_config.coda_dataset_id}")
+            if cache is not None:
+                cache.set_coda_dataset_configuration_hash(dataset_config.coda_dataset_id, configuration_hash)
+
+    if cache is not None:
+        cache.close()
+
+
+def _add_message_to_coda(coda, coda_dataset_config, code_scheme_registry, engagement_db_message):
     """
     Adds a message to Coda.
 
@@ -100,9 +214,9 @@ def _add_message_to_coda(coda, coda_dataset_config, ws_correct_dataset_code_sche
     :type coda: coda_v2_python_client.firebase_client_wrapper.CodaV2Client
     :param coda_dataset_config: Configuration for adding the message.
     :type coda_dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
-    :param ws_correct_dataset_code_scheme: WS Correct Dataset code scheme for the Coda dataset, used to validate any
-                                           existing labels, where applicable.
-    :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :param code_scheme_registry: Registry of the code schemes in the Coda dataset and the WS Correct Dataset code
+                                 scheme, used to validate any existing labels, where applicable.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
     :param engagement_db_message: Message to add to Coda.
     :type engagement_db_message: engagement_database.data_models.Message
     """
@@ -120,17 +234,13 @@ def _add_message_to_coda(coda, coda_dataset_config, ws_correct_dataset_code_sche
         # Ensure the existing labels are valid under the code schemes being copied to, by checking the label's scheme id
         # exists in this dataset's code schemes or the ws correct dataset scheme, and that the code id is in the
         # code scheme.
-        valid_code_schemes = [c.code_scheme for c in coda_dataset_config.code_scheme_configurations]
-        valid_code_schemes.append(ws_correct_dataset_code_scheme)
-        valid_code_schemes_lut = {code_scheme.scheme_id: code_scheme for code_scheme in valid_code_schemes}
         for label in engagement_db_message.labels:
-            assert label.scheme_id in valid_code_schemes_lut.keys(), \
+            assert code_scheme_registry.has_code_scheme(label.scheme_id), \
                 f"Scheme id {label.scheme_id} not valid for Coda dataset {coda_dataset_config.coda_dataset_id}"
-            code_scheme = valid_code_schemes_lut[label.scheme_id]
-            valid_codes = code_scheme.codes
-            valid_code_ids = [code.code_id for code in valid_codes]
-            assert label.code_id == "SPECIAL-MANUALLY_UNCODED" or label.code_id in valid_code_ids, \
-                f"Code ID {label.code_id} not found in Scheme {code_scheme.name} (id {label.scheme_id})"
+            assert label.code_id == "SPECIAL-MANUALLY_UNCODED" or \
+                code_scheme_registry.has_code(label.scheme_id, label.code_id), \
+                f"Code ID {label.code_id} not found in Scheme " \
+                f"{code_scheme_registry.get_code_scheme(label.scheme_id).name} (id {label.scheme_id})"
 
         coda_message.labels = engagement_db_message.labels
 
@@ -148,42 +258,19 @@ def _add_message_to_coda(coda, coda_dataset_config, ws_correct_dataset_code_sche
     coda.add_message_to_dataset(coda_dataset_config.coda_dataset_id, coda_message)
 
 
-def _code_for_label(label, code_schemes):
-    """
-    Returns the code for the given label.
-
-    Handles duplicated scheme ids (i.e. schemes ending in '-1', '-2' etc.).
-    Raises a ValueError if the label isn't for any of the given code schemes.
-
-    :param label: Label to get the code for.
-    :type label: core_data_modules.data_models.Label
-    :param code_schemes: Code schemes to check for the given label.
-    :type code_schemes: list of core_data_modules.data_models.CodeScheme
-    :return: Code for the label.
-    :rtype: core_data_modules.data_models.Code
-    """
-    for code_scheme in code_schemes:
-        if label.scheme_id.startswith(code_scheme.scheme_id):
-            return code_scheme.get_code_with_code_id(label.code_id)
-
-    raise ValueError(f"Label's scheme id '{label.scheme_id}' is not in any of the given `code_schemes` "
-                     f"(these have ids {[scheme.scheme_id for scheme in code_schemes]})")
-
-
-def _get_ws_code(coda_message, coda_dataset_config, ws_correct_dataset_code_scheme):
+def _get_ws_code(coda_message, code_scheme_registry, ws_correct_dataset_code_scheme):
     """
     Gets the WS code assigned to a Coda message, if it exists, otherwise returns None.
 
     :param coda_message: Coda message to check for a WS code.
     :type coda_message: core_data_modules.data_models.Message
-    :param coda_dataset_config: Dataset configuration to use to interpret this message's labels.
-    :type coda_dataset_config: src.engagement_db_coda_sync.configuration.CodaDatasetConfiguration
+    :param code_scheme_registry: Registry of the dataset's code schemes, to use to interpret this message's labels.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
     :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
     :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
     :return: WS code assigned to this message, if it exists.
     :rtype: core_data_modules.data_models.Code | None
     """
-    normal_code_schemes = [c.code_scheme for c in coda_dataset_config.code_scheme_configurations]
     ws_code_scheme = ws_correct_dataset_code_scheme
 
     # Check for a WS code in any of the normal code schemes
@@ -193,7 +280,7 @@ def _get_ws_code(coda_message, coda_dataset_config, ws_correct_dataset_code_sche
             continue
 
         if label.scheme_id != ws_code_scheme.scheme_id:
-            code = _code_for_label(label, normal_code_schemes)
+            code = code_scheme_registry.get_code_for_label(label)
             if code.control_code == Codes.WRONG_SCHEME:
                 ws_code_in_normal_scheme = True
 
@@ -206,7 +293,7 @@ def _get_ws_code(coda_message, coda_dataset_config, ws_correct_dataset_code_sche
 
         if label.scheme_id == ws_code_scheme.scheme_id:
             code_in_ws_scheme = True
-            ws_code = ws_code_scheme.get_code_with_code_id(label.code_id)
+            ws_code = code_scheme_registry.get_code(ws_code_scheme.scheme_id, label.code_id)
 
     # Ensure there is a WS code in a normal scheme and a code in the WS scheme.
     # If there isn't, don't attempt any redirect, so we can impute a CE code later.
@@ -225,8 +312,94 @@ def _get_ws_code(coda_message, coda_dataset_config, ws_correct_dataset_code_sche
     return ws_code
 
 
+def _labels_fingerprint(labels):
+    """
+    Computes a stable fingerprint of a list of labels.
+
+    Two lists of labels have the same fingerprint if and only if they contain the same labels in the same order.
+
+    :param labels: Labels to fingerprint.
+    :type labels: list of core_data_modules.data_models.Label
+    :return: Fingerprint of the labels.
+    :rtype: str
+    """
+    return SHAUtils.sha_string(json.dumps([label.to_dict() for label in labels], sort_keys=True))
+
+
+def _engagement_db_message_matches_coda_message(engagement_db_message, coda_message, coda_config,
+                                                code_scheme_registry, labels_fingerprints=None):
+    """
+    Checks whether an engagement database message is already up to date with a Coda message, i.e. whether the labels
+    already match and the message doesn't need to be WS-corrected.
+
+    This performs no reads or writes, so can be used to avoid opening a transaction for messages that don't need to be
+    updated.
+
+    If `labels_fingerprints` is provided, the labels are first compared by fingerprint against the fingerprint of the
+    labels this message was last found to be up to date with. Both the Coda labels and the engagement database labels
+    are checked, so that labels changed in the engagement database outside of this sync are still repaired. If these
+    all match, the message is up to date without needing to check for WS codes. Otherwise, the full comparison is run,
+    and `labels_fingerprints` is updated if the message is found to be up to date.
+
+    :param engagement_db_message: Engagement database message to check.
+    :type engagement_db_message: engagement_database.data_models.Message
+    :param coda_message: Coda message to check against.
+    :type coda_message: core_data_modules.data_models.Message
+    :param coda_config: Coda sync configuration.
+    :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the engagement database message's dataset.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that message
+                                was last found to be up to date with, or None.
+    :type labels_fingerprints: dict of str -> str | None
+    :return: Whether the engagement database message is up to date with the Coda message.
+    :rtype: bool
+    """
+    if labels_fingerprints is not None:
+        coda_labels_fingerprint = _labels_fingerprint(coda_message.labels)
+        if labels_fingerprints.get(engagement_db_message.message_id) == coda_labels_fingerprint and \
+                _labels_fingerprint(engagement_db_message.labels) == coda_labels_fingerprint:
+            return True
+
+    ws_code = _get_ws_code(coda_message, code_scheme_registry, coda_config.ws_correct_dataset_code_scheme)
+    labels_match = engagement_db_message.labels == coda_message.labels and ws_code is None
+
+    if labels_match and labels_fingerprints is not None:
+        labels_fingerprints[engagement_db_message.message_id] = coda_labels_fingerprint
+
+    return labels_match
+
+
+def _get_ws_correct_dataset(coda_message, coda_config, code_scheme_registry):
+    """
+    Gets the engagement database dataset that a Coda message should be WS-corrected to, if it has been labelled as
+    being in the wrong scheme, otherwise returns None.
+
+    :param coda_message: Coda message to check.
+    :type coda_message: core_data_modules.data_models.Message
+    :param coda_config: Coda sync configuration.
+    :type coda_config: src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the Coda message's dataset.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :return: Engagement database dataset to move the message to, or None if the message doesn't need WS-correcting.
+    :rtype: str | None
+    """
+    ws_code = _get_ws_code(coda_message, code_scheme_registry, coda_config.ws_correct_dataset_code_scheme)
+    if ws_code is None:
+        return None
+
+    try:
+        return coda_config.get_dataset_config_by_ws_code_string_value(ws_code.string_value).engagement_db_dataset
+    except ValueError as e:
+        # No dataset configuration found with an appropriate ws_code_string_value to move the message to.
+        # Fallback to the default dataset if available, otherwise crash.
+        if coda_config.default_ws_dataset is None:
+            raise e
+        return coda_config.default_ws_dataset
+
+
 def _update_engagement_db_message_from_coda_message(engagement_db, engagement_db_message, coda_message, coda_config,
-                                                    transaction=None):
+                                                    code_scheme_registry, transaction=None, labels_fingerprints=None):
     """
     Updates a message in the engagement database based on the labels in the Coda message.
 
@@ -242,8 +415,14 @@ def _update_engagement_db_message_from_coda_message(engagement_db, engagement_db
     :type coda_message: core_data_modules.data_models.Message
     :param coda_config: Configuration for the update.
     :type coda_config:  src.engagement_db_coda_sync.configuration.CodaSyncConfiguration
+    :param code_scheme_registry: Registry of the code schemes in the engagement database message's dataset.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
     :param transaction: Transaction in the engagement database to perform the update in.
     :type transaction: google.cloud.firestore.Transaction | None
+    :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that message
+                                was last found to be up to date with, or None. If provided, this is used to skip the
+                                full label comparison for unchanged messages, and is updated to reflect this update.
+    :type labels_fingerprints: dict of str -> str | None
     :return: Sync events for the update.
     :rtype: list of str
     """
@@ -253,26 +432,17 @@ def _update_engagement_db_message_from_coda_message(engagement_db, engagement_db
     # Check if the labels in the engagement database message already match those from the coda message, and that
     # we don't need to WS-correct (in other words, that the dataset is correct).
     # If they do, return without updating anything.
-    ws_code = _get_ws_code(coda_message, coda_dataset_config, coda_config.ws_correct_dataset_code_scheme)
-    if engagement_db_message.labels == coda_message.labels and ws_code is None:
+    if _engagement_db_message_matches_coda_message(engagement_db_message, coda_message, coda_config,
+                                                   code_scheme_registry, labels_fingerprints):
         log.debug("Labels match")
         sync_events.append(CodaSyncEvents.LABELS_MATCH)
         return sync_events
 
     log.debug("Updating database message labels to match those in Coda")
+    correct_dataset = _get_ws_correct_dataset(coda_message, coda_config, code_scheme_registry)
 
     # WS-correct if there is a valid ws_code
-    if ws_code is not None:
-        try:
-            correct_dataset = \
-                coda_config.get_dataset_config_by_ws_code_string_value(ws_code.string_value).engagement_db_dataset
-        except ValueError as e:
-            # No dataset configuration found with an appropriate ws_code_string_value to move the message to.
-            # Fallback to the default dataset if available, otherwise crash.
-            if coda_config.default_ws_dataset is None:
-                raise e
-            correct_dataset = coda_config.default_ws_dataset
-
+    if correct_dataset is not None:
         # Ensure this message isn't being moved to a dataset which it has previously been assigned to.
         # This is because if the message has already been in this new dataset, there is a chance there is an
         # infinite loop in the WS labels, which could get very expensive if we end up cycling this message through
@@ -301,6 +471,9 @@ def _update_engagement_db_message_from_coda_message(engagement_db, engagement_db
             transaction=transaction
         )
 
+        if labels_fingerprints is not None:
+            labels_fingerprints.pop(engagement_db_message.message_id, None)
+
         sync_events.append(CodaSyncEvents.WS_CORRECTION)
         return sync_events
 
@@ -315,5 +488,8 @@ def _update_engagement_db_message_from_coda_message(engagement_db, engagement_db
         transaction=transaction
     )
 
+    if labels_fingerprints is not None:
+        labels_fingerprints[engagement_db_message.message_id] = _labels_fingerprint(coda_message.labels)
+
     sync_events.append(CodaSyncEvents.UPDATE_ENGAGEMENT_DB_LABELS)
     return sync_events
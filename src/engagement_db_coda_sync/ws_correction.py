@@ -0,0 +1,225 @@
+from dataclasses import dataclass
+
+from core_data_modules.logging import Logger
+from engagement_database.data_models import HistoryEntryOrigin, MessageStatuses
+from google.cloud import firestore
+
+from src.engagement_db_coda_sync.lib import FIRESTORE_IN_QUERY_LIMIT
+
+log = Logger(__name__)
+
+# Maximum number of messages to WS-correct in each transaction. Firestore allows up to 500 writes per transaction,
+# and each message update writes both the message and a history entry.
+_WS_CORRECTION_BATCH_SIZE = 200
+
+
+@dataclass
+class WSCorrection:
+    message_id: str
+    coda_id: str
+    from_dataset: str
+    to_dataset: str
+    previous_datasets: list
+    origin_details: dict
+
+
+@firestore.transactional
+def _apply_ws_corrections_in_transaction(transaction, engagement_db, ws_corrections):
+    """
+    Applies a batch of WS-corrections to an engagement database in a single transaction.
+
+    Each message is re-downloaded in the transaction. Messages which are no longer in the dataset they were planned to
+    be moved from, or which no longer have the expected coda id, are left unchanged.
+
+    :param transaction: Transaction in the engagement database to perform the updates in.
+    :type transaction: google.cloud.firestore.Transaction
+    :param engagement_db: Engagement database to update.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param ws_corrections: WS-corrections to apply.
+    :type ws_corrections: list of WSCorrection
+    :return: The WS-corrections that were applied.
+    :rtype: list of WSCorrection
+    """
+    # Download all the messages before writing any, as Firestore requires all reads in a transaction to happen before
+    # any writes.
+    messages = dict()  # of message id -> Message
+    message_ids = [ws_correction.message_id for ws_correction in ws_corrections]
+    for i in range(0, len(message_ids), FIRESTORE_IN_QUERY_LIMIT):
+        message_ids_chunk = message_ids[i:i + FIRESTORE_IN_QUERY_LIMIT]
+        for msg in engagement_db.get_messages(
+                firestore_query_filter=lambda q: q.where("message_id", "in", message_ids_chunk),
+                transaction=transaction):
+            messages[msg.message_id] = msg
+
+    applied_ws_corrections = []
+    for ws_correction in ws_corrections:
+        msg = messages.get(ws_correction.message_id)
+        if msg is None or msg.dataset != ws_correction.from_dataset or msg.coda_id != ws_correction.coda_id or \
+                msg.status not in [MessageStatuses.LIVE, MessageStatuses.STALE]:
+            log.warning(f"Engagement db message '{ws_correction.message_id}' changed since its WS-correction was "
+                        f"planned; skipping")
+            continue
+
+        assert ws_correction.to_dataset not in msg.previous_datasets, \
+            f"Engagement db message '{msg.message_id}' (text '{msg.text}') is being WS-corrected to dataset " \
+            f"'{ws_correction.to_dataset}', but already has this dataset in its previous_datasets " \
+            f"({msg.previous_datasets}). This suggests an infinite loop in the WS labels."
+
+        log.debug(f"WS correcting {msg.message_id} from {msg.dataset} to {ws_correction.to_dataset}")
+        msg.labels = []
+        msg.previous_datasets.append(msg.dataset)
+        msg.dataset = ws_correction.to_dataset
+        engagement_db.set_message(
+            message=msg,
+            origin=HistoryEntryOrigin(origin_name="Coda -> Database Sync (WS Correction)",
+                                      details=ws_correction.origin_details),
+            transaction=transaction
+        )
+        applied_ws_corrections.append(ws_correction)
+
+    return applied_ws_corrections
+
+
+class WSCorrectionPlanner:
+    def __init__(self):
+        """
+        Initialises a planner for the WS-corrections needed in a sync.
+
+        WS-corrections are collected as the sync finds them, checked for cycles as a whole, then applied together in
+        batches grouped by destination dataset. The planner records the datasets that messages were moved to, so that
+        just those datasets can be re-synced.
+        """
+        self._ws_corrections = dict()  # of message id -> WSCorrection
+        self.resync_datasets = set()
+
+    @property
+    def pending_ws_corrections(self):
+        """
+        :return: The WS-corrections that have been planned but not applied yet.
+        :rtype: list of WSCorrection
+        """
+        return list(self._ws_corrections.values())
+
+    def add_ws_correction(self, engagement_db_message, to_dataset, origin_details):
+        """
+        Plans a WS-correction of an engagement database message.
+
+        :param engagement_db_message: Engagement database message to move.
+        :type engagement_db_message: engagement_database.data_models.Message
+        :param to_dataset: Dataset to move the message to.
+        :type to_dataset: str
+        :param origin_details: Details to record in the history entry for the move.
+        :type origin_details: dict
+        """
+        self._ws_corrections[engagement_db_message.message_id] = WSCorrection(
+            message_id=engagement_db_message.message_id,
+            coda_id=engagement_db_message.coda_id,
+            from_dataset=engagement_db_message.dataset,
+            to_dataset=to_dataset,
+            previous_datasets=list(engagement_db_message.previous_datasets),
+            origin_details=origin_details
+        )
+
+    def find_message_cycles(self):
+        """
+        Finds the planned WS-corrections that would move a message back to a dataset it has already been in.
+
+        :return: WS-corrections that would create a cycle in a message's dataset history.
+        :rtype: list of WSCorrection
+        """
+        return [
+            ws_correction for ws_correction in self._ws_corrections.values()
+            if ws_correction.to_dataset == ws_correction.from_dataset or
+            ws_correction.to_dataset in ws_correction.previous_datasets
+        ]
+
+    def find_dataset_cycles(self):
+        """
+        Finds cycles in the graph of dataset moves made by the planned WS-corrections, for example messages being
+        moved from dataset A to B while other messages are being moved from B to A.
+
+        These don't cause any message to loop, but often indicate inconsistent coding.
+
+        :return: Cycles of datasets, each given as the list of datasets visited in the cycle.
+        :rtype: list of (list of str)
+        """
+        graph = dict()  # of from dataset -> set of to datasets
+        for ws_correction in self._ws_corrections.values():
+            if ws_correction.from_dataset == ws_correction.to_dataset:
+                continue
+            graph.setdefault(ws_correction.from_dataset, set()).add(ws_correction.to_dataset)
+
+        cycles = []
+        visited = set()
+        for start in sorted(graph.keys()):
+            if start in visited:
+                continue
+
+            # Iterative depth-first search, tracking the datasets on the current path to detect back-edges.
+            path = [start]
+            on_path = {start}
+            stack = [iter(sorted(graph.get(start, set())))]
+            while len(stack) > 0:
+                next_dataset = next(stack[-1], None)
+                if next_dataset is None:
+                    stack.pop()
+                    finished_dataset = path.pop()
+                    on_path.discard(finished_dataset)
+                    visited.add(finished_dataset)
+                    continue
+
+                if next_dataset in on_path:
+                    cycles.append(path[path.index(next_dataset):] + [next_dataset])
+                elif next_dataset not in visited:
+                    path.append(next_dataset)
+                    on_path.add(next_dataset)
+                    stack.append(iter(sorted(graph.get(next_dataset, set()))))
+
+        return cycles
+
+    def apply(self, engagement_db, labels_fingerprints=None, batch_size=_WS_CORRECTION_BATCH_SIZE):
+        """
+        Applies all the pending WS-corrections to an engagement database.
+
+        Fails without writing anything if any of the WS-corrections would move a message back to a dataset it has
+        previously been in, because this suggests an infinite loop in the WS labels.
+
+        :param engagement_db: Engagement database to update.
+        :type engagement_db: engagement_database.EngagementDatabase
+        :param labels_fingerprints: Dictionary of engagement database message id -> fingerprint of the labels that
+                                    message was last found to be up to date with, or None. If provided, the
+                                    fingerprints of moved messages are removed.
+        :type labels_fingerprints: dict of str -> str | None
+        :param batch_size: Maximum number of WS-corrections to apply in each transaction.
+        :type batch_size: int
+        :return: The WS-corrections that were applied.
+        :rtype: list of WSCorrection
+        """
+        message_cycles = self.find_message_cycles()
+        assert len(message_cycles) == 0, \
+            f"{len(message_cycles)} engagement db message(s) are being WS-corrected to a dataset they have already " \
+            f"been in. This suggests an infinite loop in the WS labels: " \
+            f"{[(c.message_id, c.from_dataset, c.to_dataset, c.previous_datasets) for c in message_cycles]}"
+
+        for cycle in self.find_dataset_cycles():
+            log.warning(f"Messages are being WS-corrected around a cycle of datasets: {' -> '.join(cycle)}")
+
+        ws_corrections_by_to_dataset = dict()  # of to dataset -> list of WSCorrection
+        for ws_correction in self._ws_corrections.values():
+            ws_corrections_by_to_dataset.setdefault(ws_correction.to_dataset, []).append(ws_correction)
+
+        applied_ws_corrections = []
+        for to_dataset, ws_corrections in sorted(ws_corrections_by_to_dataset.items()):
+            log.info(f"WS-correcting {len(ws_corrections)} message(s) to dataset {to_dataset}...")
+            for i in range(0, len(ws_corrections), batch_size):
+                applied_ws_corrections.extend(_apply_ws_corrections_in_transaction(
+                    engagement_db.transaction(), engagement_db, ws_corrections[i:i + batch_size]
+                ))
+
+        for ws_correction in applied_ws_corrections:
+            self.resync_datasets.add(ws_correction.to_dataset)
+            if labels_fingerprints is not None:
+                labels_fingerprints.pop(ws_correction.message_id, None)
+
+        self._ws_corrections.clear()
+        return applied_ws_corrections
@@ -5,12 +5,10 @@ from core_data_modules.logging import Logger
 from core_data_modules.traced_data.io import TracedDataCSVIO
 from core_data_modules.util import IOUtils
 
-from src.engagement_db_to_analysis.column_view_conversion import analysis_dataset_configs_to_column_configs
-
 log = Logger(__name__)
 
 
-def export_production_file(traced_data_iterable, analysis_config, export_path):
+def export_production_file(traced_data_iterable, indexed_analysis_config, export_path):
     """
     Exports a column-view TracedData to a production file.
 
@@ -18,20 +16,20 @@ def export_production_file(traced_data_iterable, analysis_config, export_path):
 
     :param traced_data_iterable: Data to export.
     :type traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_config: Configuration for the export.
-    :type analysis_config: src.engagement_db_to_analysis.configuration.AnalysisConfiguration
+    :param indexed_analysis_config: Configuration for the export.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :param export_path: Path to export the file to.
     :type export_path: str
     """
     log.info(f"Exporting production file to '{export_path}'...")
     IOUtils.ensure_dirs_exist_for_file(export_path)
     with open(export_path, "w") as f:
-        headers = ["participant_uuid", "timestamp"] + [c.raw_dataset for c in analysis_config.dataset_configurations]
+        headers = ["participant_uuid", "timestamp"] + [c.raw_dataset for c in indexed_analysis_config.dataset_configurations]
         TracedDataCSVIO.export_traced_data_iterable_to_csv(traced_data_iterable, f, headers)
 
 
 
-def _get_analysis_file_headers(pipeline_config, export_timestamps=False):
+def _get_analysis_file_headers(indexed_analysis_config, export_timestamps=False):
     """
     Gets the headers for an analysis file.
 
@@ -42,8 +40,8 @@ def _get_analysis_file_headers(pipeline_config, export_timestamps=False):
      - Labels for each normal code scheme, in matrix format e.g. "age:25", "s01e01:healthcare".
      - Raw messages for each dataset.
     
-    :param pipeline_config: Pipeline configuration to derive the headers from.
-    :type pipeline_config: PipelineConfiguration
+    :param indexed_analysis_config: Analysis configuration to derive the headers from.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :return: Analysis file headers.
     :rtype: list of str
 
@@ -52,12 +50,12 @@ def _get_analysis_file_headers(pipeline_config, export_timestamps=False):
     if export_timestamps:
         headers.append("timestamp")
 
-    if pipeline_config.analysis.membership_group_configuration is not None:
-        for membership_group in pipeline_config.analysis.membership_group_configuration.membership_group_csv_urls.keys():
+    membership_group_configuration = indexed_analysis_config.analysis_config.membership_group_configuration
+    if membership_group_configuration is not None:
+        for membership_group in membership_group_configuration.membership_group_csv_urls.keys():
             headers.append(membership_group)
     
-    column_configs = analysis_dataset_configs_to_column_configs(pipeline_config.analysis.dataset_configurations)
-    for config in column_configs:
+    for config in indexed_analysis_config.column_configs:
         # Add headers for each label in this column's code scheme, in matrix format e.g. "age:25", "s01e01:healthcare"
         for code in config.code_scheme.codes:
             headers.append(f"{config.dataset_name}:{code.string_value}")
@@ -72,33 +70,31 @@ def _get_analysis_file_headers(pipeline_config, export_timestamps=False):
     return headers
 
 
-def _get_analysis_file_row(column_view_td, pipeline_config, export_timestamps=False):
+def _get_analysis_file_row(column_view_td, indexed_analysis_config, export_timestamps=False):
     """
     Gets a row of an analysis file from a Traced Data object in column-view format
 
     :param column_view_td: Traced Data object to produce the row for.
     :type column_view_td: core_data_modules.traced_data.TracedData
-    :param pipeline_config: Pipeline configuration.
-    :type pipeline_config: PipelineConfiguration
+    :param indexed_analysis_config: Analysis configuration.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :return: Dictionary representing a row of an analysis file
     :rtype: dict
     """
-    
-    column_configs = analysis_dataset_configs_to_column_configs(pipeline_config.analysis.dataset_configurations)
-
     row = {
         "participant_uuid": column_view_td["participant_uuid"],
         "consent_withdrawn": column_view_td["consent_withdrawn"]
     }
 
-    if pipeline_config.analysis.membership_group_configuration is not None:
-        for membership_group in pipeline_config.analysis.membership_group_configuration.membership_group_csv_urls.keys():
+    membership_group_configuration = indexed_analysis_config.analysis_config.membership_group_configuration
+    if membership_group_configuration is not None:
+        for membership_group in membership_group_configuration.membership_group_csv_urls.keys():
             row[membership_group] = column_view_td[membership_group]
     
     if export_timestamps:
         row["timestamp"] = column_view_td["timestamp"]
 
-    for config in column_configs:
+    for config in indexed_analysis_config.column_configs:
         # Raw field
         row[config.raw_field] = column_view_td[config.raw_field]
 
@@ -113,7 +109,7 @@ def _get_analysis_file_row(column_view_td, pipeline_config, export_timestamps=Fa
     return row
 
 
-def export_analysis_file(traced_data_iterable, pipeline_config, export_path, export_timestamps=False):
+def export_analysis_file(traced_data_iterable, indexed_analysis_config, export_path, export_timestamps=False):
     """
     Exports a column-view TracedData to a csv for analysis.
 
@@ -121,8 +117,8 @@ def export_analysis_file(traced_data_iterable, pipeline_config, export_path, exp
 
     :param traced_data_iterable: Data to export.
     :type traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :pipeline_config: pipeline configuration module
-    :type PipelineConfiguration:
+    :param indexed_analysis_config: Analysis configuration for the export.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :param export_path: Path to export the file to.
     :type export_path: str
     """
@@ -130,10 +126,10 @@ def export_analysis_file(traced_data_iterable, pipeline_config, export_path, exp
 
     IOUtils.ensure_dirs_exist_for_file(export_path)
     with open(export_path, "w") as f:
-        headers = _get_analysis_file_headers(pipeline_config, export_timestamps)
+        headers = _get_analysis_file_headers(indexed_analysis_config, export_timestamps)
         writer = csv.DictWriter(f, fieldnames=headers)
         writer.writeheader()
 
         for td in traced_data_iterable:
-            row = _get_analysis_file_row(td, pipeline_config, export_timestamps)
+            row = _get_analysis_file_row(td, indexed_analysis_config, export_timestamps)
             writer.writerow(row)
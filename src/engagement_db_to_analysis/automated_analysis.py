@@ -4,14 +4,12 @@ from core_data_modules.analysis.mapping import participation_maps, kenya_mapper
 from core_data_modules.logging import Logger
 from core_data_modules.util import IOUtils
 
-from src.engagement_db_to_analysis.column_view_conversion import (analysis_dataset_configs_to_rqa_column_configs,
-                                                                  analysis_dataset_configs_to_demog_column_configs)
 from src.engagement_db_to_analysis.configuration import AnalysisLocations
 
 log = Logger(__name__)
 
 
-def run_automated_analysis(messages_by_column, participants_by_column, analysis_config, export_dir_path):
+def run_automated_analysis(messages_by_column, participants_by_column, indexed_analysis_config, export_dir_path):
     """
     Runs automated analysis and exports the results to disk.
 
@@ -19,14 +17,14 @@ def run_automated_analysis(messages_by_column, participants_by_column, analysis_
     :type messages_by_column: iterable of core_data_modules.traced_data.TracedData
     :param participants_by_column: Participants traced data in column-view format.
     :type participants_by_column: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_config: Configuration for the export.
-    :type analysis_config: src.engagement_db_to_analysis.configuration.AnalysisConfiguration
+    :param indexed_analysis_config: Configuration for the export.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :param export_dir_path: Directory to export the automated analysis files to.
     :type export_dir_path: str
     """
     log.info(f"Running automated analysis...")
-    rqa_column_configs = analysis_dataset_configs_to_rqa_column_configs(analysis_config.dataset_configurations)
-    demog_column_configs = analysis_dataset_configs_to_demog_column_configs(analysis_config.dataset_configurations)
+    rqa_column_configs = indexed_analysis_config.rqa_column_configs
+    demog_column_configs = indexed_analysis_config.demog_column_configs
     IOUtils.ensure_dirs_exist(export_dir_path)
 
     log.info(f"Exporting engagement counts.csv...")
@@ -65,7 +63,7 @@ def run_automated_analysis(messages_by_column, participants_by_column, analysis_
         AnalysisLocations.KENYA_CONSTITUENCY: kenya_mapper.export_kenya_constituencies_map
     }
 
-    for analysis_dataset_config in analysis_config.dataset_configurations:
+    for analysis_dataset_config in indexed_analysis_config.dataset_configurations:
         for coding_config in analysis_dataset_config.coding_configs:
             if coding_config.kenya_analysis_location is not None:
                 location_column_config = AnalysisConfiguration(
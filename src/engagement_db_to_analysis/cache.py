@@ -1,10 +1,11 @@
 from datetime import datetime
 from os import path
 import json
-
+import sqlite3
 
 from core_data_modules.util import IOUtils
-from engagement_database.data_models import Message
+
+from src.engagement_db_to_analysis.message_schema import analysis_message_from_dict, project_analysis_message_dict
 
 
 class AnalysisCache:
@@ -14,11 +15,33 @@ class AnalysisCache:
         The cache can be used to locally save/retrieve data needed to enable incremental running of a
         Engagement database-> Analysis tool.
 
+        Messages are stored in a sqlite database in `cache_dir`, keyed by (dataset, message id), so that each run only
+        needs to write the messages that changed since the previous run.
+
         :param cache_dir: Directory to use for the cache.
         :type cache_dir: str
         """
         self.cache_dir = cache_dir
 
+        db_path = f"{cache_dir}/analysis-cache.sqlite"
+        IOUtils.ensure_dirs_exist_for_file(db_path)
+        self._connection = sqlite3.connect(db_path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                dataset TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                last_updated TEXT NOT NULL,
+                message TEXT NOT NULL,
+                PRIMARY KEY (dataset, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS cached_datasets (
+                dataset TEXT PRIMARY KEY
+            );
+        """)
+        self._connection.commit()
+
     def _latest_message_timestamp_path(self, engagement_db_dataset):
         return f"{self.cache_dir}/last_updated_{engagement_db_dataset}.txt"
 
@@ -51,6 +74,14 @@ class AnalysisCache:
         with open(export_path, "w") as f:
             f.write(last_updated.isoformat())
 
+    def _legacy_messages_path(self, engagement_db_dataset):
+        return path.join(f"{self.cache_dir}/{engagement_db_dataset}.jsonl")
+
+    def _has_dataset(self, engagement_db_dataset):
+        return self._connection.execute(
+            "SELECT 1 FROM cached_datasets WHERE dataset = ?", (engagement_db_dataset,)
+        ).fetchone() is not None
+
     def get_messages(self, engagement_db_dataset):
         """
         Gets a list of messages for the given engagement_db_dataset from the cache.
@@ -60,31 +91,101 @@ class AnalysisCache:
         :return: list of messages
         :rtype: list of engagement_database.data_models.Message
         """
-        previous_export_file_path = path.join(f"{self.cache_dir}/{engagement_db_dataset}.jsonl")
-        messages = []
-        try:
-            with open(previous_export_file_path) as f:
-                for line in f:
-                    messages.append(Message.from_dict(json.loads(line)))
-        except FileNotFoundError:
-            return []
-
-        return messages
+        if not self._has_dataset(engagement_db_dataset):
+            # Caches written by earlier versions of this tool stored each dataset in a jsonl file. Read from these if
+            # this dataset isn't in the sqlite database yet, so that upgrading doesn't force a full download.
+            messages = []
+            try:
+                with open(self._legacy_messages_path(engagement_db_dataset)) as f:
+                    for line in f:
+                        messages.append(analysis_message_from_dict(json.loads(line)))
+            except FileNotFoundError:
+                return []
+            return messages
+
+        # Have sqlite join the stored messages into a single json array, so they can be parsed with one call to
+        # json.loads rather than one call per message.
+        messages_json = self._connection.execute(
+            "SELECT json_group_array(json(message)) FROM messages WHERE dataset = ?", (engagement_db_dataset,)
+        ).fetchone()[0]
+        return [analysis_message_from_dict(d) for d in json.loads(messages_json)]
 
     def set_messages(self, engagement_db_dataset, messages):
         """
         Sets a list of messages for the given engagement_db_dataset.
 
+        Only the messages that are new, have a different `last_updated` to the cached version, or are no longer in the
+        dataset are written to the cache. Only the fields in the analysis message schema are stored.
+
         :param engagement_db_dataset: Engagement db dataset name for this context.
         :type engagement_db_dataset: str
         :param messages: Messages to set, for the given engagement db dataset.
         :type messages: list of engagement_database.data_models.Message
         """
-        export_file_path = path.join(f"{self.cache_dir}/{engagement_db_dataset}.jsonl")
-        IOUtils.ensure_dirs_exist_for_file(export_file_path)
-        with open(export_file_path, "w") as f:
-            for msg in messages:
-                f.write(f"{json.dumps(msg.to_dict(serialize_datetimes_to_str=True))}\n")
+        cached_last_updated = dict(self._connection.execute(
+            "SELECT message_id, last_updated FROM messages WHERE dataset = ?", (engagement_db_dataset,)
+        ).fetchall())  # of message id -> last updated, as an iso string
+
+        rows_to_write = []
+        message_ids = set()
+        for msg in messages:
+            message_ids.add(msg.message_id)
+            last_updated = msg.last_updated.isoformat()
+            if cached_last_updated.get(msg.message_id) == last_updated:
+                continue
+            rows_to_write.append((
+                engagement_db_dataset, msg.message_id, last_updated,
+                json.dumps(project_analysis_message_dict(msg.to_dict(serialize_datetimes_to_str=True)))
+            ))
+        message_ids_to_delete = [(engagement_db_dataset, message_id)
+                                 for message_id in cached_last_updated.keys() if message_id not in message_ids]
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO messages (dataset, message_id, last_updated, message) VALUES (?, ?, ?, ?)",
+                rows_to_write
+            )
+            self._connection.executemany(
+                "DELETE FROM messages WHERE dataset = ? AND message_id = ?", message_ids_to_delete
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO cached_datasets (dataset) VALUES (?)", (engagement_db_dataset,)
+            )
+
+    def update_messages(self, engagement_db_dataset, updated_messages, removed_message_ids):
+        """
+        Updates the messages cached for the given engagement_db_dataset, without reading or re-writing the cached
+        messages that haven't changed.
+
+        :param engagement_db_dataset: Engagement db dataset name for this context.
+        :type engagement_db_dataset: str
+        :param updated_messages: Messages to insert, or to replace the cached version of.
+        :type updated_messages: iterable of engagement_database.data_models.Message
+        :param removed_message_ids: Ids of messages to remove from the cache for this dataset.
+        :type removed_message_ids: iterable of str
+        """
+        if not self._has_dataset(engagement_db_dataset):
+            # Migrate any messages for this dataset that are still in a legacy jsonl file before updating them.
+            self.set_messages(engagement_db_dataset, self.get_messages(engagement_db_dataset))
+
+        rows_to_write = [
+            (engagement_db_dataset, msg.message_id, msg.last_updated.isoformat(),
+             json.dumps(project_analysis_message_dict(msg.to_dict(serialize_datetimes_to_str=True))))
+            for msg in updated_messages
+        ]
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO messages (dataset, message_id, last_updated, message) VALUES (?, ?, ?, ?)",
+                rows_to_write
+            )
+            self._connection.executemany(
+                "DELETE FROM messages WHERE dataset = ? AND message_id = ?",
+                [(engagement_db_dataset, message_id) for message_id in removed_message_ids]
+            )
+            self._connection.execute(
+                "INSERT OR IGNORE INTO cached_datasets (dataset) VALUES (?)", (engagement_db_dataset,)
+            )
 
     def set_synced_uuids(self, group_name, participants_uuids):
         """
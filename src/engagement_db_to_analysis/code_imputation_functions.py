@@ -1,3 +1,6 @@
+from dataclasses import dataclass
+from typing import List
+
 from core_data_modules.cleaners import Codes
 from core_data_modules.cleaners.cleaning_utils import CleaningUtils
 from core_data_modules.cleaners.location_tools import KenyaLocations
@@ -6,31 +9,24 @@ from core_data_modules.data_models.code_scheme import CodeTypes
 from core_data_modules.logging import Logger
 from core_data_modules.traced_data import Metadata
 from core_data_modules.util import TimeUtils
-from engagement_database.data_models import Message
 
-from src.engagement_db_to_analysis.column_view_conversion import (analysis_dataset_configs_to_column_configs,
-                                                                  analysis_dataset_configs_to_demog_column_configs)
-from src.engagement_db_to_analysis.column_view_conversion import (get_latest_labels_with_code_scheme,
-                                                                  analysis_dataset_config_for_message)
+from src.common.code_scheme_registry import CodeSchemeRegistry
+from src.engagement_db_to_analysis.column_view_conversion import get_latest_labels_with_code_scheme
 from src.pipeline_configuration_spec import *
 
 log = Logger(__name__)
 
 
-def _clear_latest_labels(user, message_td, code_schemes):
-    message = Message.from_dict(dict(message_td))
-    code_scheme_ids = [code_scheme.scheme_id for code_scheme in code_schemes]
+def _clear_latest_labels(user, message_td, code_scheme_registry):
+    message = message_td.get_message()
     for label in message.get_latest_labels():
-        cleared_label = None
-        for scheme_id in code_scheme_ids:
-            if label.scheme_id.startswith(scheme_id):
-                cleared_label = Label(
-                    label.scheme_id,
-                    "SPECIAL-MANUALLY_UNCODED",
-                    TimeUtils.utc_now_as_iso_string(),
-                    Origin(Metadata.get_call_location(), "Engagement DB -> Analysis", "External")
-                )
-        assert cleared_label is not None
+        assert code_scheme_registry.has_code_scheme(label.scheme_id)
+        cleared_label = Label(
+            label.scheme_id,
+            "SPECIAL-MANUALLY_UNCODED",
+            TimeUtils.utc_now_as_iso_string(),
+            Origin(Metadata.get_call_location(), "Engagement DB -> Analysis", "External")
+        )
         _insert_label_to_message_td(user, message_td, cleared_label)
 
 
@@ -40,8 +36,8 @@ def _insert_label_to_message_td(user, message_traced_data, label):
 
     :param user: Identifier of user running the pipeline.
     :type user: str
-    :param message_traced_data: Message TracedData objects to impute age_category.
-    :type message_traced_data: TracedData
+    :param message_traced_data: Message record to insert the label into.
+    :type message_traced_data: src.engagement_db_to_analysis.message_record.MessageRecord
     :param label: New label to insert to the message_traced_data
     :type: core_data_modules.data_models.Label
     """
@@ -53,9 +49,9 @@ def _insert_label_to_message_td(user, message_traced_data, label):
         Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
 
-def _impute_not_reviewed_labels(user, messages_traced_data, analysis_dataset_configs, ws_correct_dataset_code_scheme):
+def _impute_not_reviewed_labels(user, message_td, code_scheme_registry):
     """
-    Imputes Codes.NOT_REVIEWED label for messages that have not been manually checked in coda.
+    Imputes Codes.NOT_REVIEWED label for a message that has not been manually checked in coda.
 
     A message is considered to be manually checked if it contains only labels which are checked. Messages that fall
     into this case will not be modified.
@@ -66,97 +62,67 @@ def _impute_not_reviewed_labels(user, messages_traced_data, analysis_dataset_con
 
     :param user: Identifier of user running the pipeline.
     :type user: str
-    :param messages_traced_data: Messages TracedData objects to impute not reviewed labels.
-    :type messages_traced_data: list of TracedData
-    :param analysis_dataset_configs: Analysis dataset configuration in pipeline configuration module.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
-    :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
-    :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :param message_td: Message record to impute not reviewed labels for.
+    :type message_td: src.engagement_db_to_analysis.message_record.MessageRecord
+    :param code_scheme_registry: Registry of the message's analysis dataset code schemes and the WS - Correct Dataset
+                                 code scheme.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :return: The control code that was imputed (Codes.NOT_REVIEWED or Codes.CODING_ERROR), or None if the message was
+             exclusively manually reviewed so nothing was imputed.
+    :rtype: str | None
     """
+    message = message_td.get_message()
 
-    log.info(f"Imputing {Codes.NOT_REVIEWED} labels...")
-    messages_with_nr_imputed = 0
-    messages_with_ce_imputed = 0
-    for message_td in messages_traced_data:
-        message = Message.from_dict(dict(message_td))
-
-        message_analysis_config = analysis_dataset_config_for_message(analysis_dataset_configs, message)
-
-        # Check if the message has a manual label and impute NOT_REVIEWED if it doesn't
-        has_checked_label = False
-        has_unchecked_label = False
-        code_schemes = [c.code_scheme for c in message_analysis_config.coding_configs]
-        code_schemes.append(ws_correct_dataset_code_scheme)
-        for code_scheme in code_schemes:
-            latest_labels_with_code_scheme = get_latest_labels_with_code_scheme(
-                message, code_scheme
-            )
-            for label in latest_labels_with_code_scheme:
-                if label.checked:
-                    has_checked_label = True
-                else:
-                    has_unchecked_label = True
-
-        if has_checked_label and not has_unchecked_label:
-            # Message is exclusively manually reviewed
-            continue
-
-        if has_checked_label and has_unchecked_label:
-            # The message has been partially reviewed. Map this to coding error.
-            _clear_latest_labels(user, message_td, code_schemes)
+    # Check if the message has a manual label and impute NOT_REVIEWED if it doesn't
+    has_checked_label = False
+    has_unchecked_label = False
+    code_schemes = code_scheme_registry.code_schemes
+    for code_scheme in code_schemes:
+        latest_labels_with_code_scheme = get_latest_labels_with_code_scheme(
+            message, code_scheme
+        )
+        for label in latest_labels_with_code_scheme:
+            if label.checked:
+                has_checked_label = True
+            else:
+                has_unchecked_label = True
 
-            for code_scheme in code_schemes:
-                coding_error_label = CleaningUtils.make_label_from_cleaner_code(
-                    code_scheme, code_scheme.get_code_with_control_code(Codes.CODING_ERROR),
-                    Metadata.get_call_location())
+    if has_checked_label and not has_unchecked_label:
+        # Message is exclusively manually reviewed
+        return None
 
-                # Insert a coding error label to the list of labels for this message, and write-back to TracedData.
-                _insert_label_to_message_td(user, message_td, coding_error_label)
-            messages_with_ce_imputed += 1
-            continue
+    if has_checked_label and has_unchecked_label:
+        # The message has been partially reviewed. Map this to coding error.
+        _clear_latest_labels(user, message_td, code_scheme_registry)
 
-        # Label has not been manually reviewed at all, so replace the codes with Codes.NOT_REVIEWED
-        assert not has_checked_label
-        _clear_latest_labels(user, message_td, code_schemes)
         for code_scheme in code_schemes:
-            not_reviewed_label = CleaningUtils.make_label_from_cleaner_code(
-                code_scheme, code_scheme.get_code_with_control_code(Codes.NOT_REVIEWED),
+            coding_error_label = CleaningUtils.make_label_from_cleaner_code(
+                code_scheme,
+                code_scheme_registry.get_code_with_control_code(code_scheme.scheme_id, Codes.CODING_ERROR),
                 Metadata.get_call_location())
 
-            # Insert not_reviewed_label to the list of labels for this message, and write-back to TracedData.
-            _insert_label_to_message_td(user, message_td, not_reviewed_label)
-        messages_with_nr_imputed += 1
+            # Insert a coding error label to the list of labels for this message, and write-back to TracedData.
+            _insert_label_to_message_td(user, message_td, coding_error_label)
+        return Codes.CODING_ERROR
 
-    log.info(f"Processed {Codes.NOT_REVIEWED} labels for {len(messages_traced_data)} messages traced data. "
-             f"Imputed {Codes.NOT_REVIEWED} labels for {messages_with_nr_imputed} messages, and "
-             f"imputed {Codes.CODING_ERROR} labels for {messages_with_ce_imputed} messages")
-
-
-def _code_for_label(label, code_schemes):
-    """
-    Returns the code for the given label.
-
-    Handles duplicated scheme ids (i.e. schemes ending in '-1', '-2' etc.).
-    Raises a ValueError if the label isn't for any of the given code schemes.
-
-    :param label: Label to get the code for.
-    :type label: core_data_modules.data_models.Label
-    :param code_schemes: Code schemes to check for the given label.
-    :type code_schemes: list of core_data_modules.data_models.CodeScheme
-    :return: Code for the label.
-    :rtype: core_data_modules.data_models.Code
-    """
+    # Label has not been manually reviewed at all, so replace the codes with Codes.NOT_REVIEWED
+    assert not has_checked_label
+    _clear_latest_labels(user, message_td, code_scheme_registry)
     for code_scheme in code_schemes:
-        if label.scheme_id.startswith(code_scheme.scheme_id):
-            return code_scheme.get_code_with_code_id(label.code_id)
+        not_reviewed_label = CleaningUtils.make_label_from_cleaner_code(
+            code_scheme,
+            code_scheme_registry.get_code_with_control_code(code_scheme.scheme_id, Codes.NOT_REVIEWED),
+            Metadata.get_call_location())
 
-    raise ValueError(f"Label's scheme id '{label.scheme_id}' is not in any of the given `code_schemes` "
-                     f"(these have ids {[scheme.scheme_id for scheme in code_schemes]})")
+        # Insert not_reviewed_label to the list of labels for this message, and write-back to TracedData.
+        _insert_label_to_message_td(user, message_td, not_reviewed_label)
+    return Codes.NOT_REVIEWED
 
 
-def _impute_ws_coding_errors(user, messages_traced_data, analysis_dataset_configs, ws_correct_dataset_code_scheme):
+def _impute_ws_coding_errors(user, message_td, analysis_dataset_config, ws_correct_dataset_code_scheme,
+                             code_scheme_registry):
     """
-    Imputes Codes.CODING_ERROR labels for messages that have a coding error in the WS labels that have been applied.
+    Imputes Codes.CODING_ERROR labels for a message that has a coding error in the WS labels that have been applied.
 
     We consider WS labels to have a coding error if either of these conditions holds:
      - There is a WS label applied in a normal code scheme, but there is no label in the WS - Correct Dataset code scheme.
@@ -164,76 +130,80 @@ def _impute_ws_coding_errors(user, messages_traced_data, analysis_dataset_config
 
     :param user: Identifier of user running the pipeline.
     :type user: str
-    :param messages_traced_data: Messages TracedData objects to impute ws coding errors.
-    :type messages_traced_data: list of TracedData
-    :param analysis_dataset_configs: Analysis dataset configuration in pipeline configuration module.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param message_td: Message record to impute ws coding errors for.
+    :type message_td: src.engagement_db_to_analysis.message_record.MessageRecord
+    :param analysis_dataset_config: Analysis dataset configuration for this message.
+    :type analysis_dataset_config: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
     :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
     :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :param code_scheme_registry: Registry of the message's analysis dataset code schemes and the WS - Correct Dataset
+                                 code scheme.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :return: Whether coding error labels were imputed.
+    :rtype: bool
     """
-    log.info(f"Imputing {Codes.CODING_ERROR} labels for WS codes...")
-    imputed_labels = 0
-    for message_td in messages_traced_data:
-        message = Message.from_dict(dict(message_td))
+    message = message_td.get_message()
+    normal_code_schemes = [c.code_scheme for c in analysis_dataset_config.coding_configs]
 
-        message_analysis_config = analysis_dataset_config_for_message(analysis_dataset_configs, message)
-        normal_code_schemes = [c.code_scheme for c in message_analysis_config.coding_configs]
+    # Check for a WS code in any of the normal code schemes
+    ws_code_in_normal_scheme = False
+    for label in message.get_latest_labels():
+        if not label.checked:
+            continue
 
-        # Check for a WS code in any of the normal code schemes
-        ws_code_in_normal_scheme = False
-        for label in message.get_latest_labels():
-            if not label.checked:
-                continue
+        if label.scheme_id != ws_correct_dataset_code_scheme.scheme_id:
+            code = code_scheme_registry.get_code_for_label(label)
+            if code.control_code == Codes.WRONG_SCHEME:
+                ws_code_in_normal_scheme = True
 
-            if label.scheme_id != ws_correct_dataset_code_scheme.scheme_id:
-                code = _code_for_label(label, normal_code_schemes)
-                if code.control_code == Codes.WRONG_SCHEME:
-                    ws_code_in_normal_scheme = True
+    # Check for a code in the WS code scheme
+    code_in_ws_scheme = False
+    for label in message.get_latest_labels():
+        if not label.checked:
+            continue
 
-        # Check for a code in the WS code scheme
-        code_in_ws_scheme = False
-        for label in message.get_latest_labels():
-            if not label.checked:
-                continue
+        if label.scheme_id == ws_correct_dataset_code_scheme.scheme_id:
+            code_in_ws_scheme = True
+
+    if ws_code_in_normal_scheme == code_in_ws_scheme:
+        return False
+
+    # Clear all existing labels, in preparation for the new coding error labels we'll write afterwards.
+    # (This is because messages store labels in Coda format, so before we write the new labels we need to
+    #  insert special un-coded labels in place of all the existing labels, including labels assigned under
+    #  duplicate schemes, in order to guarantee that no pre-existing label is preserved in the next steps of
+    #  analysis)
+    _clear_latest_labels(user, message_td, code_scheme_registry)
+
+    # Append a CE code under every normal + WS code scheme
+    for code_scheme in normal_code_schemes + [ws_correct_dataset_code_scheme]:
+        ce_label = CleaningUtils.make_label_from_cleaner_code(
+            code_scheme,
+            code_scheme_registry.get_code_with_control_code(code_scheme.scheme_id, Codes.CODING_ERROR),
+            Metadata.get_call_location(),
+            set_checked=True
+        )
+        _insert_label_to_message_td(user, message_td, ce_label)
+    return True
 
-            if label.scheme_id == ws_correct_dataset_code_scheme.scheme_id:
-                code_in_ws_scheme = True
-
-        if ws_code_in_normal_scheme != code_in_ws_scheme:
-            imputed_labels += 1
-
-            # Clear all existing labels, in preparation for the new coding error labels we'll write afterwards.
-            # (This is because messages store labels in Coda format, so before we write the new labels we need to
-            #  insert special un-coded labels in place of all the existing labels, including labels assigned under
-            #  duplicate schemes, in order to guarantee that no pre-existing label is preserved in the next steps of
-            #  analysis)
-            _clear_latest_labels(user, message_td, normal_code_schemes + [ws_correct_dataset_code_scheme])
-
-            # Append a CE code under every normal + WS code scheme
-            for code_scheme in normal_code_schemes + [ws_correct_dataset_code_scheme]:
-                ce_label = CleaningUtils.make_label_from_cleaner_code(
-                    code_scheme,
-                    code_scheme.get_code_with_control_code(Codes.CODING_ERROR),
-                    Metadata.get_call_location(),
-                    set_checked=True
-                )
-                _insert_label_to_message_td(user, message_td, ce_label)
 
-    log.info(f"Imputed {imputed_labels} {Codes.CODING_ERROR} labels for WS codes")
+@dataclass
+class _AgeCategoryImputationConfig:
+    age_coding_config: CodingConfiguration
+    age_category_coding_config: CodingConfiguration
+    age_engagement_db_datasets: List[str]
+    age_code_scheme_registry: CodeSchemeRegistry
 
 
-def _impute_age_category(user, messages_traced_data, analysis_dataset_configs):
+def _get_age_category_imputation_config(analysis_dataset_configs):
     """
-    Imputes age category for age dataset messages.
+    Finds the coding configurations needed to impute age categories for age dataset messages.
 
-    :param user: Identifier of user running the pipeline.
-    :type user: str
-    :param messages_traced_data: Messages TracedData objects to impute age_category.
-    :type messages_traced_data: list of TracedData
     :param analysis_dataset_configs: Analysis dataset configuration in pipeline configuration module.
     :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :return: Configuration for imputing age categories, or None if there is no age category coding configuration.
+    :rtype: _AgeCategoryImputationConfig | None
     """
-
     # Get the coding configurations for age and age_category analysis datasets
     age_category_coding_config = None
     for analysis_dataset_config in analysis_dataset_configs:
@@ -248,7 +218,7 @@ def _impute_age_category(user, messages_traced_data, analysis_dataset_configs):
 
     if age_category_coding_config is None:
         log.info(f"No age category configuration found, returning without imputing any age categories")
-        return
+        return None
 
     age_coding_config = None
     age_engagement_db_datasets = None
@@ -261,42 +231,58 @@ def _impute_age_category(user, messages_traced_data, analysis_dataset_configs):
                 age_coding_config = coding_config
                 age_engagement_db_datasets = analysis_dataset_config.engagement_db_datasets
 
-    # Check and impute age_category in age messages only
-    log.info(f"Imputing {age_category_coding_config.analysis_dataset} labels for {age_coding_config.analysis_dataset} messages...")
-    imputed_labels = 0
-    age_messages = 0
-    for message_td in messages_traced_data:
-        if message_td["dataset"] in age_engagement_db_datasets:
-            age_messages += 1
+    age_code_scheme_registry = CodeSchemeRegistry(
+        [age_coding_config.code_scheme, age_category_coding_config.code_scheme]
+    )
 
-            age_labels = get_latest_labels_with_code_scheme(Message.from_dict(dict(message_td)), age_coding_config.code_scheme)
-            age_code = age_coding_config.code_scheme.get_code_with_code_id(age_labels[0].code_id)
-
-            # Impute age_category for this age_code
-            if age_code.code_type == CodeTypes.NORMAL:
-                age_category = None
-                for age_range, category in age_category_coding_config.age_category_config.categories.items():
-                    if age_range[0] <= age_code.numeric_value <= age_range[1]:
-                        age_category = category
-                assert age_category is not None
-                age_category_code = age_category_coding_config.code_scheme.get_code_with_match_value(age_category)
-            elif age_code.code_type == CodeTypes.META:
-                age_category_code = age_category_coding_config.code_scheme.get_code_with_meta_code(age_code.meta_code)
-            else:
-                assert age_code.code_type == CodeTypes.CONTROL
-                age_category_code = age_category_coding_config.code_scheme.get_code_with_control_code(
-                    age_code.control_code)
+    return _AgeCategoryImputationConfig(
+        age_coding_config=age_coding_config,
+        age_category_coding_config=age_category_coding_config,
+        age_engagement_db_datasets=age_engagement_db_datasets,
+        age_code_scheme_registry=age_code_scheme_registry
+    )
 
-            age_category_label = CleaningUtils.make_label_from_cleaner_code(
-                age_category_coding_config.code_scheme, age_category_code, Metadata.get_call_location()
-            )
 
-            # Inserts this age_category_label to the list of labels for this message, and write-back to TracedData.
-            _insert_label_to_message_td(user, message_td, age_category_label)
+def _impute_age_category(user, message_td, age_category_imputation_config):
+    """
+    Imputes age category for an age dataset message.
 
-            imputed_labels += 1
+    :param user: Identifier of user running the pipeline.
+    :type user: str
+    :param message_td: Age dataset message record to impute age_category for.
+    :type message_td: src.engagement_db_to_analysis.message_record.MessageRecord
+    :param age_category_imputation_config: Configuration for imputing age categories.
+    :type age_category_imputation_config: _AgeCategoryImputationConfig
+    """
+    age_coding_config = age_category_imputation_config.age_coding_config
+    age_category_coding_config = age_category_imputation_config.age_category_coding_config
+    age_code_scheme_registry = age_category_imputation_config.age_code_scheme_registry
+
+    age_labels = get_latest_labels_with_code_scheme(message_td.get_message(), age_coding_config.code_scheme)
+    age_code = age_code_scheme_registry.get_code(age_coding_config.code_scheme.scheme_id, age_labels[0].code_id)
+
+    # Impute age_category for this age_code
+    if age_code.code_type == CodeTypes.NORMAL:
+        age_category = None
+        for age_range, category in age_category_coding_config.age_category_config.categories.items():
+            if age_range[0] <= age_code.numeric_value <= age_range[1]:
+                age_category = category
+        assert age_category is not None
+        age_category_code = age_category_coding_config.code_scheme.get_code_with_match_value(age_category)
+    elif age_code.code_type == CodeTypes.META:
+        age_category_code = age_code_scheme_registry.get_code_with_meta_code(
+            age_category_coding_config.code_scheme.scheme_id, age_code.meta_code)
+    else:
+        assert age_code.code_type == CodeTypes.CONTROL
+        age_category_code = age_code_scheme_registry.get_code_with_control_code(
+            age_category_coding_config.code_scheme.scheme_id, age_code.control_code)
 
-    log.info(f"Imputed {imputed_labels} age category labels for {age_messages} age messages")
+    age_category_label = CleaningUtils.make_label_from_cleaner_code(
+        age_category_coding_config.code_scheme, age_category_code, Metadata.get_call_location()
+    )
+
+    # Inserts this age_category_label to the list of labels for this message, and write-back to TracedData.
+    _insert_label_to_message_td(user, message_td, age_category_label)
 
 
 def _make_location_code(scheme, clean_value):
@@ -306,19 +292,31 @@ def _make_location_code(scheme, clean_value):
         return scheme.get_code_with_match_value(clean_value)
 
 
-def _impute_kenya_location_codes(user, messages_traced_data, analysis_dataset_configs):
+@dataclass
+class _KenyaLocationImputationConfig:
+    constituency_coding_config: CodingConfiguration
+    county_coding_config: CodingConfiguration
+    location_engagement_db_datasets: List[str]
+
+
+@dataclass
+class _KenyaLocationImputationCounts:
+    imputed_normal_labels: int = 0
+    imputed_meta_labels: int = 0
+    imputed_control_labels: int = 0
+    detected_coding_errors: int = 0
+
+
+def _get_kenya_location_imputation_config(analysis_dataset_configs):
     """
-    Imputes Kenya location labels for location dataset messages.
+    Finds the coding configurations needed to impute Kenya location labels for location dataset messages.
 
-    :param user: Identifier of user running the pipeline.
-    :type user: str
-    :param messages_traced_data: Messages TracedData objects to impute age_category.
-    :type messages_traced_data: list of TracedData
     :param analysis_dataset_configs: Analysis dataset configuration in pipeline configuration module.
     :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :return: Configuration for imputing Kenya locations, or None if the constituency and county coding configurations
+             aren't both present.
+    :rtype: _KenyaLocationImputationConfig | None
     """
-    log.info(f"Imputing Kenya location labels for location messages...")
-
     # Get the coding configurations for constituency and county analysis datasets
     constituency_coding_config = None
     county_coding_config = None
@@ -340,111 +338,179 @@ def _impute_kenya_location_codes(user, messages_traced_data, analysis_dataset_co
                     f"analysis_dataset_config, expected one crashing"
                 county_coding_config = coding_config
 
-    if constituency_coding_config is not None and county_coding_config is not None:
-        imputed_normal_labels = 0
-        imputed_meta_labels = 0
-        imputed_control_labels = 0
-        detected_coding_errors = 0
-
-        for message_traced_data in messages_traced_data:
-            message = Message.from_dict(dict(message_traced_data))
-            if message.dataset in location_engagement_db_datasets:
-                message_analysis_config = analysis_dataset_config_for_message(analysis_dataset_configs, message)
-
-                # Up to 1 location code should have been assigned in Coda. Search for that code,
-                # ensuring that only 1 has been assigned or, if multiple have been assigned, that they are non-conflicting control codes
-                # Multiple normal codes will be converted to Coding Error, even if they were compatible (e.g. langata + nairobi)
-                location_code = None
-                for coding_config in message_analysis_config.coding_configs:
-                    latest_coding_config_labels = get_latest_labels_with_code_scheme(message, coding_config.code_scheme)
-
-                    if len(latest_coding_config_labels) > 0:
-                        latest_coding_config_label = latest_coding_config_labels[0]
-
-                        coda_code = coding_config.code_scheme.get_code_with_code_id(latest_coding_config_label.code_id)
-                        if location_code is not None:
-                            if location_code.code_id != coda_code.code_id:
-                                location_code = constituency_coding_config.code_scheme.get_code_with_control_code(
-                                    Codes.CODING_ERROR
-                                )
-                                detected_coding_errors += 1
-                        else:
-                            location_code = coda_code
-
-                # If a control or meta code was found, set all other location keys to that control/meta code,
-                # otherwise convert the provided location to the other locations in the hierarchy.
-                if location_code.code_type == CodeTypes.CONTROL:
-                    for coding_config in message_analysis_config.coding_configs:
-                        control_code_label = CleaningUtils.make_label_from_cleaner_code(
-                            coding_config.code_scheme,
-                            coding_config.code_scheme.get_code_with_control_code(location_code.control_code),
-                            Metadata.get_call_location())
-
-                        _insert_label_to_message_td(user, message_traced_data, control_code_label)
-                        imputed_control_labels += 1
-                elif location_code.code_type == CodeTypes.META:
-                    for coding_config in message_analysis_config.coding_configs:
-                        meta_code_label = CleaningUtils.make_label_from_cleaner_code(
-                            coding_config.code_scheme,
-                            coding_config.code_scheme.get_code_with_meta_code(location_code.meta_code),
-                            Metadata.get_call_location())
-
-                        _insert_label_to_message_td(user, message_traced_data, meta_code_label)
-                        imputed_meta_labels += 1
-                else:
-                    location = location_code.match_values[0]
-                    constituency_label = CleaningUtils.make_label_from_cleaner_code(
-                        constituency_coding_config.code_scheme,
-                        _make_location_code(constituency_coding_config.code_scheme,
-                                            KenyaLocations.constituency_for_location_code(location)),
-                        Metadata.get_call_location()
-                    )
+    if constituency_coding_config is None or county_coding_config is None:
+        assert county_coding_config is None or constituency_coding_config is None
+        log.warning("Missing location coding_config(s) in analysis_dataset_config, skipping imputing location labels...")
+        return None
 
-                    county_label = CleaningUtils.make_label_from_cleaner_code(
-                        county_coding_config.code_scheme,
-                        _make_location_code(
-                            county_coding_config.code_scheme,
-                            KenyaLocations.county_for_location_code(location)
-                        ),
-                        Metadata.get_call_location()
-                    )
+    return _KenyaLocationImputationConfig(
+        constituency_coding_config=constituency_coding_config,
+        county_coding_config=county_coding_config,
+        location_engagement_db_datasets=location_engagement_db_datasets
+    )
 
-                    _insert_label_to_message_td(user, message_traced_data, constituency_label)
-                    _insert_label_to_message_td(user, message_traced_data, county_label)
-                    imputed_normal_labels += 1
 
-        log.info(f"Detected {detected_coding_errors} coding errors, and imputed {imputed_normal_labels} normal, "
-                 f"{imputed_meta_labels} meta, and {imputed_control_labels} control Kenyan location labels.")
-    else:
-        assert county_coding_config is None or constituency_coding_config is None
-        log.warning("Missing location coding_config(s) in analysis_dataset_config, skipping imputing location labels...")
+def _impute_kenya_location_codes(user, message_traced_data, analysis_dataset_config, code_scheme_registry,
+                                 location_imputation_config, counts):
+    """
+    Imputes Kenya location labels for a location dataset message.
 
+    :param user: Identifier of user running the pipeline.
+    :type user: str
+    :param message_traced_data: Location dataset message record to impute Kenya location labels for.
+    :type message_traced_data: src.engagement_db_to_analysis.message_record.MessageRecord
+    :param analysis_dataset_config: Analysis dataset configuration for this message.
+    :type analysis_dataset_config: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+    :param code_scheme_registry: Registry of the message's analysis dataset code schemes and the WS - Correct Dataset
+                                 code scheme.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param location_imputation_config: Configuration for imputing Kenya locations.
+    :type location_imputation_config: _KenyaLocationImputationConfig
+    :param counts: Counts of the location labels imputed so far, to update with the labels imputed for this message.
+    :type counts: _KenyaLocationImputationCounts
+    """
+    constituency_coding_config = location_imputation_config.constituency_coding_config
+    county_coding_config = location_imputation_config.county_coding_config
+    message = message_traced_data.get_message()
+
+    # Up to 1 location code should have been assigned in Coda. Search for that code,
+    # ensuring that only 1 has been assigned or, if multiple have been assigned, that they are non-conflicting control codes
+    # Multiple normal codes will be converted to Coding Error, even if they were compatible (e.g. langata + nairobi)
+    location_code = None
+    for coding_config in analysis_dataset_config.coding_configs:
+        latest_coding_config_labels = get_latest_labels_with_code_scheme(message, coding_config.code_scheme)
+
+        if len(latest_coding_config_labels) > 0:
+            latest_coding_config_label = latest_coding_config_labels[0]
+
+            coda_code = code_scheme_registry.get_code(
+                coding_config.code_scheme.scheme_id, latest_coding_config_label.code_id)
+            if location_code is not None:
+                if location_code.code_id != coda_code.code_id:
+                    location_code = code_scheme_registry.get_code_with_control_code(
+                        constituency_coding_config.code_scheme.scheme_id, Codes.CODING_ERROR
+                    )
+                    counts.detected_coding_errors += 1
+            else:
+                location_code = coda_code
+
+    # If a control or meta code was found, set all other location keys to that control/meta code,
+    # otherwise convert the provided location to the other locations in the hierarchy.
+    if location_code.code_type == CodeTypes.CONTROL:
+        for coding_config in analysis_dataset_config.coding_configs:
+            control_code_label = CleaningUtils.make_label_from_cleaner_code(
+                coding_config.code_scheme,
+                code_scheme_registry.get_code_with_control_code(
+                    coding_config.code_scheme.scheme_id, location_code.control_code),
+                Metadata.get_call_location())
 
-def impute_codes_by_message(user, messages_traced_data, analysis_dataset_configs, ws_correct_dataset_code_scheme):
+            _insert_label_to_message_td(user, message_traced_data, control_code_label)
+            counts.imputed_control_labels += 1
+    elif location_code.code_type == CodeTypes.META:
+        for coding_config in analysis_dataset_config.coding_configs:
+            meta_code_label = CleaningUtils.make_label_from_cleaner_code(
+                coding_config.code_scheme,
+                code_scheme_registry.get_code_with_meta_code(
+                    coding_config.code_scheme.scheme_id, location_code.meta_code),
+                Metadata.get_call_location())
+
+            _insert_label_to_message_td(user, message_traced_data, meta_code_label)
+            counts.imputed_meta_labels += 1
+    else:
+        location = location_code.match_values[0]
+        constituency_label = CleaningUtils.make_label_from_cleaner_code(
+            constituency_coding_config.code_scheme,
+            _make_location_code(constituency_coding_config.code_scheme,
+                                KenyaLocations.constituency_for_location_code(location)),
+            Metadata.get_call_location()
+        )
+
+        county_label = CleaningUtils.make_label_from_cleaner_code(
+            county_coding_config.code_scheme,
+            _make_location_code(
+                county_coding_config.code_scheme,
+                KenyaLocations.county_for_location_code(location)
+            ),
+            Metadata.get_call_location()
+        )
+
+        _insert_label_to_message_td(user, message_traced_data, constituency_label)
+        _insert_label_to_message_td(user, message_traced_data, county_label)
+        counts.imputed_normal_labels += 1
+
+
+def impute_codes_by_message(user, messages_traced_data, indexed_analysis_config):
     """
     Imputes codes for messages TracedData in-place.
 
     Runs the following imputations:
      - Imputes Codes.NOT_REVIEWED for messages that have not been manually labelled in coda.
+     - Imputes Codes.CODING_ERROR for messages that have inconsistent WS labels.
      - Imputes Age category labels for age dataset messages.
      - Imputes Kenya Location labels for location dataset messages.
 
+    Each imputation only reads and writes the labels of the message it's imputing for, so all the imputations are
+    applied to each message in turn, in a single pass over the messages. This gives the same results as running each
+    imputation over all the messages before starting the next.
+
     :param user: Identifier of user running the pipeline.
     :type user: str
     :param messages_traced_data: Messages TracedData objects to impute age_category.
-    :type messages_traced_data: list of TracedData
-    :param analysis_dataset_configs: Analysis dataset configuration in pipeline configuration module.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
-    :param ws_correct_dataset_code_scheme: WS - Correct Dataset code scheme.
-    :type ws_correct_dataset_code_scheme: core_data_modules.data_models.CodeScheme
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
+    :param indexed_analysis_config: Analysis configuration for the imputation.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
-    _impute_not_reviewed_labels(user, messages_traced_data, analysis_dataset_configs, ws_correct_dataset_code_scheme)
-    _impute_ws_coding_errors(user, messages_traced_data, analysis_dataset_configs, ws_correct_dataset_code_scheme)
-    _impute_age_category(user, messages_traced_data, analysis_dataset_configs)
-    _impute_kenya_location_codes(user, messages_traced_data, analysis_dataset_configs)
+    ws_correct_dataset_code_scheme = indexed_analysis_config.ws_correct_dataset_code_scheme
+    age_category_imputation_config = _get_age_category_imputation_config(indexed_analysis_config.dataset_configurations)
+    location_imputation_config = _get_kenya_location_imputation_config(indexed_analysis_config.dataset_configurations)
+
+    log.info(f"Imputing {Codes.NOT_REVIEWED} labels, {Codes.CODING_ERROR} labels for WS codes, age category labels, "
+             f"and Kenya location labels for {len(messages_traced_data)} messages...")
+    messages_with_nr_imputed = 0
+    messages_with_ce_imputed = 0
+    ws_ce_labels_imputed = 0
+    age_category_labels_imputed = 0
+    age_messages = 0
+    location_counts = _KenyaLocationImputationCounts()
+    for message_td in messages_traced_data:
+        dataset = message_td["dataset"]
+        message_analysis_config = indexed_analysis_config.get_dataset_config(dataset)
+        code_scheme_registry = indexed_analysis_config.get_code_scheme_registry(message_analysis_config)
+
+        imputed_code = _impute_not_reviewed_labels(user, message_td, code_scheme_registry)
+        if imputed_code == Codes.NOT_REVIEWED:
+            messages_with_nr_imputed += 1
+        elif imputed_code == Codes.CODING_ERROR:
+            messages_with_ce_imputed += 1
 
+        if _impute_ws_coding_errors(user, message_td, message_analysis_config, ws_correct_dataset_code_scheme,
+                                    code_scheme_registry):
+            ws_ce_labels_imputed += 1
 
-def _impute_true_missing(user, column_traced_data_iterable, analysis_dataset_configs):
+        if age_category_imputation_config is not None and \
+                dataset in age_category_imputation_config.age_engagement_db_datasets:
+            age_messages += 1
+            _impute_age_category(user, message_td, age_category_imputation_config)
+            age_category_labels_imputed += 1
+
+        if location_imputation_config is not None and \
+                dataset in location_imputation_config.location_engagement_db_datasets:
+            _impute_kenya_location_codes(user, message_td, message_analysis_config, code_scheme_registry,
+                                         location_imputation_config, location_counts)
+
+    log.info(f"Processed {Codes.NOT_REVIEWED} labels for {len(messages_traced_data)} messages traced data. "
+             f"Imputed {Codes.NOT_REVIEWED} labels for {messages_with_nr_imputed} messages, and "
+             f"imputed {Codes.CODING_ERROR} labels for {messages_with_ce_imputed} messages")
+    log.info(f"Imputed {ws_ce_labels_imputed} {Codes.CODING_ERROR} labels for WS codes")
+    if age_category_imputation_config is not None:
+        log.info(f"Imputed {age_category_labels_imputed} age category labels for {age_messages} age messages")
+    if location_imputation_config is not None:
+        log.info(f"Detected {location_counts.detected_coding_errors} coding errors, and imputed "
+                 f"{location_counts.imputed_normal_labels} normal, {location_counts.imputed_meta_labels} meta, and "
+                 f"{location_counts.imputed_control_labels} control Kenyan location labels.")
+
+
+def _impute_true_missing(user, column_traced_data_iterable, indexed_analysis_config):
     """
     Imputes TRUE_MISSING codes on column-view datasets.
 
@@ -454,13 +520,13 @@ def _impute_true_missing(user, column_traced_data_iterable, analysis_dataset_con
     :type user: str
     :param column_traced_data_iterable: Column-view traced data objects to apply the impute function to.
     :type column_traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Analysis dataset configurations for the imputation.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param indexed_analysis_config: Analysis configuration for the imputation.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
     imputed_codes = 0
     log.info(f"Imputing {Codes.TRUE_MISSING} codes...")
 
-    column_configs = analysis_dataset_configs_to_column_configs(analysis_dataset_configs)
+    column_configs = indexed_analysis_config.column_configs
 
     for td in column_traced_data_iterable:
         na_dict = dict()
@@ -525,7 +591,7 @@ def _get_control_and_meta_labels(column_traced_data, column_config):
     return control_and_meta_labels
 
 
-def _impute_nic_demogs(user, column_traced_data_iterable, analysis_dataset_configs):
+def _impute_nic_demogs(user, column_traced_data_iterable, indexed_analysis_config):
     """
     Imputes NOT_INTERNALLY_CONSISTENT labels on the demographic columns of column-view datasets.
 
@@ -543,13 +609,13 @@ def _impute_nic_demogs(user, column_traced_data_iterable, analysis_dataset_confi
     :type user: str
     :param column_traced_data_iterable: Column-view traced data objects to apply the impute function to.
     :type column_traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Analysis dataset configurations for the imputation.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param indexed_analysis_config: Analysis configuration for the imputation.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
     imputed_codes = 0
     log.info(f"Imputing {Codes.NOT_INTERNALLY_CONSISTENT} codes...")
 
-    demog_column_configs = analysis_dataset_configs_to_demog_column_configs(analysis_dataset_configs)
+    demog_column_configs = indexed_analysis_config.demog_column_configs
     for td in column_traced_data_iterable:
         for column_config in demog_column_configs:
             if _demog_has_conflicting_normal_labels(td, column_config):
@@ -573,21 +639,21 @@ def _impute_nic_demogs(user, column_traced_data_iterable, analysis_dataset_confi
              f"traced data items")
 
 
-def _get_consent_withdrawn_participant_uuids(column_traced_data_iterable, analysis_dataset_configs):
+def _get_consent_withdrawn_participant_uuids(column_traced_data_iterable, indexed_analysis_config):
     """
     Gets the participant uuids of participants who withdrew consent.
 
     A participant is considered to have withdrawn consent if any of their labels have control code Codes.STOP in any
-    of the datasets in the given `analysis_dataset_configs`.
+    of the datasets in the given `indexed_analysis_config`.
 
     :param column_traced_data_iterable: Column-view traced data objects to search for consent withdrawn status.
     :type column_traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Analysis dataset configurations for the search.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param indexed_analysis_config: Analysis configuration for the search.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :return: Uuids of participants who withdrew consent.
     :rtype: set of str
     """
-    column_configs = analysis_dataset_configs_to_column_configs(analysis_dataset_configs)
+    column_configs = indexed_analysis_config.column_configs
     consent_withdrawn_uuids = set()
 
     for td in column_traced_data_iterable:
@@ -600,12 +666,12 @@ def _get_consent_withdrawn_participant_uuids(column_traced_data_iterable, analys
     return consent_withdrawn_uuids
 
 
-def _impute_consent_withdrawn(user, column_traced_data_iterable, analysis_dataset_configs):
+def _impute_consent_withdrawn(user, column_traced_data_iterable, indexed_analysis_config):
     """
     Imputes consent_withdrawn on column-view datasets.
 
-    Searches the given data for participants who are labelled Codes.STOP under any of the given
-    `analysis_dataset_configs`.
+    Searches the given data for participants who are labelled Codes.STOP under any of the datasets in the given
+    `indexed_analysis_config`.
 
     If the participant withdrew consent:
      - Imputes {consent_withdrawn: Codes.TRUE}
@@ -618,14 +684,14 @@ def _impute_consent_withdrawn(user, column_traced_data_iterable, analysis_datase
     :type user: str
     :param column_traced_data_iterable: Column-view traced data objects to apply the impute function to.
     :type column_traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Analysis dataset configurations for the imputation.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param indexed_analysis_config: Analysis configuration for the imputation.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
     log.info("Imputing consent withdrawn...")
-    consent_withdrawn_uuids = _get_consent_withdrawn_participant_uuids(column_traced_data_iterable, analysis_dataset_configs)
+    consent_withdrawn_uuids = _get_consent_withdrawn_participant_uuids(column_traced_data_iterable, indexed_analysis_config)
     log.info(f"Found {len(consent_withdrawn_uuids)} participants who withdrew consent")
 
-    column_configs = analysis_dataset_configs_to_column_configs(analysis_dataset_configs)
+    column_configs = indexed_analysis_config.column_configs
     consent_withdrawn_tds = 0
     for td in column_traced_data_iterable:
         if td["participant_uuid"] in consent_withdrawn_uuids:
@@ -647,7 +713,7 @@ def _impute_consent_withdrawn(user, column_traced_data_iterable, analysis_datase
              f"{len(consent_withdrawn_uuids)} items were marked as consent_withdrawn")
 
 
-def impute_codes_by_column_traced_data(user, column_traced_data_iterable, analysis_dataset_configs):
+def impute_codes_by_column_traced_data(user, column_traced_data_iterable, indexed_analysis_config):
     """
     Imputes codes for column-view TracedData in-place.
 
@@ -660,9 +726,9 @@ def impute_codes_by_column_traced_data(user, column_traced_data_iterable, analys
     :type user: str
     :param column_traced_data_iterable: Column-view traced data objects to apply the impute function to.
     :type column_traced_data_iterable: iterable of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Analysis dataset configurations for the imputation.
-    :type analysis_dataset_configs: pipeline_config.analysis_configs.dataset_configurations
+    :param indexed_analysis_config: Analysis configuration for the imputation.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
-    _impute_true_missing(user, column_traced_data_iterable, analysis_dataset_configs)
-    _impute_nic_demogs(user, column_traced_data_iterable, analysis_dataset_configs)
-    _impute_consent_withdrawn(user, column_traced_data_iterable, analysis_dataset_configs)
+    _impute_true_missing(user, column_traced_data_iterable, indexed_analysis_config)
+    _impute_nic_demogs(user, column_traced_data_iterable, indexed_analysis_config)
+    _impute_consent_withdrawn(user, column_traced_data_iterable, indexed_analysis_config)
@@ -1,9 +1,10 @@
+import copy
+
 from core_data_modules.analysis import AnalysisConfiguration
 from core_data_modules.logging import Logger
 from core_data_modules.traced_data import Metadata, TracedData
 from core_data_modules.traced_data.util.fold_traced_data import FoldStrategies
 from core_data_modules.util import TimeUtils
-from engagement_database.data_models import Message
 
 from src.engagement_db_to_analysis.configuration import DatasetTypes
 
@@ -95,31 +96,13 @@ def analysis_dataset_configs_to_demog_column_configs(analysis_dataset_configs):
     return demog_column_configs
 
 
-def analysis_dataset_config_for_message(analysis_dataset_configs, message):
-    """
-    Gets the analysis dataset configuration to use to process this message, by looking-up the configuration that refers
-    to this message's engagement db "dataset" property.
-
-    :param analysis_dataset_configs: Dataset configurations to search for the one that relates to the given message.
-    :type analysis_dataset_configs: list of src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
-    :param message: Message to retrieve the analysis dataset configuration for.
-    :type message: engagement_database.data_models.Message
-    :return: Analysis dataset configuration to use for this message.
-    :rtype: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
-    """
-    for config in analysis_dataset_configs:
-        if message.dataset in config.engagement_db_datasets:
-            return config
-    raise ValueError(f"No analysis dataset configuration found for message '{message.message_id}', which has engagement"
-                     f"db dataset {message.dataset}")
-
-
 def get_latest_labels_with_code_scheme(message, code_scheme):
     """
     Gets the labels assigned to this message under the given `code_scheme` (or a duplicate of this code scheme).
 
     Labels assigned under duplicate code schemes are normalised to have the primary code scheme id e.g. scheme_id
-    'scheme-abc123-1' will be re-written to 'scheme-abc123'.
+    'scheme-abc123-1' will be re-written to 'scheme-abc123'. The normalised labels are copies, so the message's own labels
+    are left unchanged.
 
     :param message: Message to get the labels from.
     :type message: engagement_database.data_models.Message
@@ -131,34 +114,28 @@ def get_latest_labels_with_code_scheme(message, code_scheme):
     latest_labels_with_code_scheme = []
     for label in message.get_latest_labels():
         if label.scheme_id.startswith(code_scheme.scheme_id):
+            label = copy.copy(label)
             label.scheme_id = code_scheme.scheme_id
             latest_labels_with_code_scheme.append(label)
     return latest_labels_with_code_scheme
 
 
-def _filter_out_demogs_only(messages_traced_data, analysis_dataset_configs):
+def _filter_out_demogs_only(messages_traced_data, indexed_analysis_config):
     """
     Filters out messages from participants who only sent demographics.
 
     :param messages_traced_data: Messages traced data to filter.
-    :type messages_traced_data: list of core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Configuration for the filter.
-    :type analysis_dataset_configs: list of src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
+    :param indexed_analysis_config: Configuration for the filter.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :param messages_traced_data: Filtered messages traced data.
-    :type messages_traced_data: list of core_data_modules.traced_data.TracedData
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
     """
-    # Find the rqa engagement_db datasets in the given configuration.
-    rqa_engagement_db_datasets = []
-    for config in analysis_dataset_configs:
-        if config.dataset_type == DatasetTypes.RESEARCH_QUESTION_ANSWER:
-            rqa_engagement_db_datasets.extend(config.engagement_db_datasets)
-
     # Find the participants who have a message in an rqa engagement_db dataset
     rqa_participant_uuids = set()
     for msg in messages_traced_data:
-        for rqa_dataset in rqa_engagement_db_datasets:
-            if msg["dataset"] == rqa_dataset:
-                rqa_participant_uuids.add(msg["participant_uuid"])
+        if msg["dataset"] in indexed_analysis_config.rqa_engagement_db_datasets:
+            rqa_participant_uuids.add(msg["participant_uuid"])
 
     # Filter all the messages so that we exclude messages from people who didn't send an rqa.
     filtered = []
@@ -174,7 +151,7 @@ def _filter_out_demogs_only(messages_traced_data, analysis_dataset_configs):
     return filtered
 
 
-def _add_message_to_column_td(user, message_td, column_td, analysis_dataset_configs):
+def _add_message_to_column_td(user, message_td, column_td, indexed_analysis_config):
     """
     Adds a message to a "column-view" TracedData object in-place.
 
@@ -185,21 +162,19 @@ def _add_message_to_column_td(user, message_td, column_td, analysis_dataset_conf
 
     :param user: Identifier of user running the pipeline.
     :type user: str
-    :param message_td: TracedData representing the message to add
-    :type message_td: core_data_modules.traced_data.TracedData
+    :param message_td: Record of the message to add
+    :type message_td: src.engagement_db_to_analysis.message_record.MessageRecord
     :param column_td: An existing TracedData object in column-view format, to which the relevant data from this message
                       will be appended.
     :type column_td: core_data_modules.traced_data.TracedData
-    :param analysis_dataset_configs: Dataset configurations to use to decide how to process the message.
-    :type analysis_dataset_configs: list of src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+    :param indexed_analysis_config: Configuration to use to decide how to process the message.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     """
-    message = Message.from_dict(dict(message_td))
-
-    # Get the analysis dataset configuration for this message
-    message_analysis_dataset_config = analysis_dataset_config_for_message(analysis_dataset_configs, message)
+    message = message_td.get_message()
 
-    # Convert the analysis dataset config to its "column-view" configurations
-    column_configs = analysis_dataset_config_to_column_configs(message_analysis_dataset_config)
+    # Get the analysis dataset configuration for this message, and its "column-view" configurations
+    message_analysis_dataset_config = indexed_analysis_config.get_dataset_config_for_message(message)
+    column_configs = indexed_analysis_config.get_column_configs(message_analysis_dataset_config)
 
     updated_column_data = dict()
 
@@ -231,8 +206,9 @@ def _add_message_to_column_td(user, message_td, column_td, analysis_dataset_conf
                 column_config.code_scheme, existing_labels, latest_labels_with_code_scheme
             )
 
-    # Append the TracedData history for this message to the column-view.
-    message_td = message_td.copy()
+    # Append the TracedData history for this message to the column-view. The record's TracedData is built once and
+    # shared by every column-view TracedData the message is appended to.
+    message_td = message_td.to_traced_data()
     message_td.hide_keys(message_td.keys(), Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
     column_td.append_traced_data("appended_message", message_td, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
@@ -241,7 +217,7 @@ def _add_message_to_column_td(user, message_td, column_td, analysis_dataset_conf
     column_td.append_data(updated_column_data, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
 
 
-def convert_to_messages_column_format(user, messages_traced_data, analysis_config):
+def convert_to_messages_column_format(user, messages_traced_data, indexed_analysis_config):
     """
     Converts a list of messages traced data into "column-view" format by rqa-message.
 
@@ -251,15 +227,15 @@ def convert_to_messages_column_format(user, messages_traced_data, analysis_confi
     :param user: Identifier of user running the pipeline.
     :type user: str
     :param messages_traced_data: Messages traced data to convert.
-    :type messages_traced_data: list of core_data_modules.traced_data.TracedData
-    :param analysis_config: Configuration for the conversion.
-    :type analysis_config: src.engagement_db_to_analysis.configuration.AnalysisConfiguration
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
+    :param indexed_analysis_config: Configuration for the conversion.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :return: Messages organised by rqa message into column-view format suitable for further analysis.
     :rtype: list of core_data_modules.traced_data.TracedData
     """
     log.info(f"Converting {len(messages_traced_data)} messages traced data objects to column-view format by "
              f"message...")
-    messages_traced_data = _filter_out_demogs_only(messages_traced_data, analysis_config.dataset_configurations)
+    messages_traced_data = _filter_out_demogs_only(messages_traced_data, indexed_analysis_config)
 
     messages_by_column = dict()  # of participant_uuid -> list of rqa messages in column view
 
@@ -267,8 +243,8 @@ def convert_to_messages_column_format(user, messages_traced_data, analysis_confi
     # Pass 1: Convert each rqa message to a new TracedData object in column-view.
     for msg_td in messages_traced_data:
         # Skip this message if it's not an RQA
-        message = Message.from_dict(dict(msg_td))
-        analysis_dataset_config = analysis_dataset_config_for_message(analysis_config.dataset_configurations, message)
+        message = msg_td.get_message()
+        analysis_dataset_config = indexed_analysis_config.get_dataset_config_for_message(message)
         if analysis_dataset_config.dataset_type != DatasetTypes.RESEARCH_QUESTION_ANSWER:
             continue
 
@@ -277,7 +253,7 @@ def convert_to_messages_column_format(user, messages_traced_data, analysis_confi
             {"participant_uuid": message.participant_uuid, "timestamp": message.timestamp.isoformat()},
             Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string())
         )
-        _add_message_to_column_td(user, msg_td, column_td, analysis_config.dataset_configurations)
+        _add_message_to_column_td(user, msg_td, column_td, indexed_analysis_config)
 
         # Add to the list of converted rqa messages for this participant.
         if message.participant_uuid not in messages_by_column:
@@ -287,15 +263,15 @@ def convert_to_messages_column_format(user, messages_traced_data, analysis_confi
     # Pass 2: Update each converted rqa message with the demographic messages
     for msg_td in messages_traced_data:
         # Skip this message if it's not a demographic.
-        message = Message.from_dict(dict(msg_td))
-        analysis_dataset_config = analysis_dataset_config_for_message(analysis_config.dataset_configurations, message)
+        message = msg_td.get_message()
+        analysis_dataset_config = indexed_analysis_config.get_dataset_config_for_message(message)
         if analysis_dataset_config.dataset_type != DatasetTypes.DEMOGRAPHIC:
             continue
 
         # Add this demographic to each of the column-view rqa message TracedData for this participant.
         # (Use messages_by_column.get() because we might have demographics for people who never sent an RQA message).
         for column_td in messages_by_column.get(message.participant_uuid, []):
-            _add_message_to_column_td(user, msg_td, column_td, analysis_config.dataset_configurations)
+            _add_message_to_column_td(user, msg_td, column_td, indexed_analysis_config)
 
     flattened_messages = []
     for msgs in messages_by_column.values():
@@ -306,7 +282,7 @@ def convert_to_messages_column_format(user, messages_traced_data, analysis_confi
     return flattened_messages
 
 
-def convert_to_participants_column_format(user, messages_traced_data, analysis_config):
+def convert_to_participants_column_format(user, messages_traced_data, indexed_analysis_config):
     """
     Converts a list of messages traced data into "column-view" format by participant.
 
@@ -316,19 +292,19 @@ def convert_to_participants_column_format(user, messages_traced_data, analysis_c
     :param user: Identifier of user running the pipeline.
     :type user: str
     :param messages_traced_data: Messages traced data to convert.
-    :type messages_traced_data: list of core_data_modules.traced_data.TracedData
-    :param analysis_config: Configuration for the conversion.
-    :type analysis_config: src.engagement_db_to_analysis.configuration.AnalysisConfiguration
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
+    :param indexed_analysis_config: Configuration for the conversion.
+    :type indexed_analysis_config: src.engagement_db_to_analysis.indexed_analysis_configuration.IndexedAnalysisConfiguration
     :return: Messages organised by participant into column-view format  suitable for further analysis.
     :rtype: list of core_data_modules.traced_data.TracedData
     """
     log.info(f"Converting {len(messages_traced_data)} messages traced data objects to column-view format by "
              f"participant...")
-    messages_traced_data = _filter_out_demogs_only(messages_traced_data, analysis_config.dataset_configurations)
+    messages_traced_data = _filter_out_demogs_only(messages_traced_data, indexed_analysis_config)
 
     participants_by_column = dict()  # of participant_uuid -> participant traced data in column view
     for msg_td in messages_traced_data:
-        message = Message.from_dict(dict(msg_td))
+        message = msg_td.get_message()
 
         # If we've not seen this participant before, create an empty Traced Data to represent them.
         if message.participant_uuid not in participants_by_column:
@@ -339,7 +315,7 @@ def convert_to_participants_column_format(user, messages_traced_data, analysis_c
 
         # Add this message to the relevant participant's column-view TracedData.
         participant = participants_by_column[message.participant_uuid]
-        _add_message_to_column_td(user, msg_td, participant, analysis_config.dataset_configurations)
+        _add_message_to_column_td(user, msg_td, participant, indexed_analysis_config)
 
     log.info(f"Converted {len(messages_traced_data)} messages traced data objects to "
              f"{len(participants_by_column.values())} column-view format objects, by participant")
@@ -58,3 +58,4 @@ class AnalysisConfiguration:
     ws_correct_dataset_code_scheme: CodeScheme
     google_drive_upload: Optional[GoogleDriveUploadConfiguration] = None
     membership_group_configuration: Optional[MembershipGroupConfiguration] = None
+    max_concurrent_downloads: int = 4  # Maximum number of engagement db datasets to download at once.
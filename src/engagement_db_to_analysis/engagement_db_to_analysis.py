@@ -1,5 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from core_data_modules.logging import Logger
-from core_data_modules.traced_data import TracedData, Metadata
+from core_data_modules.traced_data import Metadata
 from core_data_modules.traced_data.io import TracedDataJsonIO
 from core_data_modules.util import TimeUtils
 
@@ -11,18 +13,108 @@ from src.engagement_db_to_analysis.code_imputation_functions import (impute_code
                                                                      impute_codes_by_column_traced_data)
 from src.engagement_db_to_analysis.column_view_conversion import (convert_to_messages_column_format,
                                                                   convert_to_participants_column_format)
+from src.engagement_db_to_analysis.indexed_analysis_configuration import IndexedAnalysisConfiguration
 from src.engagement_db_to_analysis.traced_data_filters import filter_messages
 from src.engagement_db_to_analysis.membership_group import (tag_membership_groups_participants)
+from src.engagement_db_to_analysis.message_record import MessageRecord
+from src.engagement_db_to_analysis.message_schema import get_analysis_messages, project_analysis_message_dict
 from src.engagement_db_to_analysis.rapid_pro_advert_functions import sync_advert_contacts_to_rapidpro
 
 log = Logger(__name__)
 
 
-def _get_project_messages_from_engagement_db(analysis_dataset_configurations, engagement_db, cache_path=None):
+def _upsert_messages_by_id(messages_by_id, updated_messages, moved_message_ids=frozenset()):
+    """
+    Upserts messages into a dictionary of message id -> the latest snapshot of that message, in place.
+
+    :param messages_by_id: Dictionary of message id -> message to upsert into.
+    :type messages_by_id: dict of str -> engagement_database.data_models.Message
+    :param updated_messages: Messages to upsert. A message only replaces an existing message with the same id if it has
+                             the same or a later `last_updated`.
+    :type updated_messages: iterable of engagement_database.data_models.Message
+    :param moved_message_ids: Ids of messages to remove from `messages_by_id` before upserting `updated_messages`,
+                              because they have been moved out of this dataset.
+    :type moved_message_ids: set of str
+    :return: `messages_by_id`
+    :rtype: dict of str -> engagement_database.data_models.Message
+    """
+    for message_id in moved_message_ids:
+        messages_by_id.pop(message_id, None)
+
+    for msg in updated_messages:
+        existing = messages_by_id.get(msg.message_id)
+        if existing is None or msg.last_updated >= existing.last_updated:
+            messages_by_id[msg.message_id] = msg
+
+    return messages_by_id
+
+
+def _download_dataset_messages(engagement_db, engagement_db_dataset, latest_message_timestamp,
+                               latest_ws_message_timestamp):
+    """
+    Downloads the messages in an engagement database dataset that have changed since the previous run.
+
+    :param engagement_db: Engagement database to download the messages from.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param engagement_db_dataset: Engagement database dataset to download the messages of.
+    :type engagement_db_dataset: str
+    :param latest_message_timestamp: Latest `last_updated` of the messages in this dataset seen in previous runs, or
+                                     None to perform a full download.
+    :type latest_message_timestamp: datetime.datetime | None
+    :param latest_ws_message_timestamp: Latest `last_updated` of the messages seen in previous runs that were moved
+                                        out of this dataset, or None.
+    :type latest_ws_message_timestamp: datetime.datetime | None
+    :return: Tuple of (messages in this dataset updated since `latest_message_timestamp`,
+                       messages moved out of this dataset since `latest_ws_message_timestamp`).
+             If this is a full download, there are no moved messages.
+    :rtype: (list of engagement_database.data_models.Message, list of engagement_database.data_models.Message)
+    """
+    if latest_message_timestamp is None:
+        log.warning(f"Performing a full download for {engagement_db_dataset} messages...")
+
+        full_download_filter = lambda q: q.where("dataset", "==", engagement_db_dataset)
+
+        messages = get_analysis_messages(engagement_db, full_download_filter)
+        log.info(f"Downloaded {len(messages)} messages in {engagement_db_dataset}")
+        return messages, []
+
+    log.info(f"Performing incremental download for {engagement_db_dataset} messages...")
+
+    # Download messages that have been updated/created after the previous run
+    incremental_messages_filter = lambda q: q \
+        .where("dataset", "==", engagement_db_dataset) \
+        .where("last_updated", ">", latest_message_timestamp)
+
+    updated_messages = get_analysis_messages(engagement_db, incremental_messages_filter)
+
+    # Download the messages that have been ws corrected away from this dataset after the previous run, so they can be
+    # removed from the cached messages. We do this by searching for all messages that used to be in this dataset,
+    # that we haven't already seen.
+    if latest_ws_message_timestamp is None:
+        ws_corrected_messages_filter = lambda q: q \
+            .where("previous_datasets", "array_contains", engagement_db_dataset)
+    else:
+        ws_corrected_messages_filter = lambda q: q \
+            .where("previous_datasets", "array_contains", engagement_db_dataset) \
+            .where("last_updated", ">", latest_ws_message_timestamp)
+
+    ws_corrected_messages = get_analysis_messages(engagement_db, ws_corrected_messages_filter)
+
+    log.info(f"Downloaded {len(updated_messages)} updated messages in {engagement_db_dataset}, and "
+             f"{len(ws_corrected_messages)} messages that were previously in this dataset but have moved.")
+
+    return updated_messages, ws_corrected_messages
+
+
+def _get_project_messages_from_engagement_db(analysis_dataset_configurations, engagement_db, cache_path=None,
+                                             max_concurrent_downloads=4):
     """
     Downloads project messages from engagement database. It performs a full download if there is no cache path and
     incrementally otherwise.
 
+    The datasets are downloaded concurrently. The cache is only accessed from the calling thread, and is updated for
+    each dataset as soon as its download completes.
+
     :param analysis_dataset_configurations: Analysis dataset configurations in pipeline configuration module.
     :type analysis_dataset_configurations: list of src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
     :param engagement_db: Engagement database to download the messages from.
@@ -30,7 +122,10 @@ def _get_project_messages_from_engagement_db(analysis_dataset_configurations, en
     :param cache_path: Path to a directory to use to cache results needed for incremental operation.
                        If None, runs in non-incremental mode.
     :type cache_path: str
-    :return: engagement_db_dataset_messages_map of engagement_db_dataset to list of messages.
+    :param max_concurrent_downloads: Maximum number of datasets to download at once.
+    :type max_concurrent_downloads: int
+    :return: engagement_db_dataset_messages_map of engagement_db_dataset to list of messages, in the order the
+             datasets are configured in `analysis_dataset_configurations`.
     :rtype: dict of str -> list of engagement_database.data_models.Message
     """
 
@@ -41,40 +136,35 @@ def _get_project_messages_from_engagement_db(analysis_dataset_configurations, en
         log.info(f"Initialising EngagementAnalysisCache at '{cache_path}'")
         cache = AnalysisCache(f"{cache_path}")
 
-    engagement_db_dataset_messages_map = {}  # of engagement_db_dataset to list of messages
+    engagement_db_datasets = []
     for analysis_dataset_config in analysis_dataset_configurations:
         for engagement_db_dataset in analysis_dataset_config.engagement_db_datasets:
-            messages = []
-            latest_message_timestamp = None if cache is None else cache.get_latest_message_timestamp(engagement_db_dataset)
-            full_download_required = latest_message_timestamp is None
-            if not full_download_required:
-                log.info(f"Performing incremental download for {engagement_db_dataset} messages...")
-
-                # Download messages that have been updated/created after the previous run
-                incremental_messages_filter = lambda q: q \
-                    .where("dataset", "==", engagement_db_dataset) \
-                    .where("last_updated", ">", latest_message_timestamp)
+            if engagement_db_dataset not in engagement_db_datasets:
+                engagement_db_datasets.append(engagement_db_dataset)
 
-                updated_messages = engagement_db.get_messages(firestore_query_filter=incremental_messages_filter)
-                messages.extend(updated_messages)
-
-                # Check and remove cached messages that have been ws corrected away from this dataset after the previous
-                # run. We do this by searching for all messages that used to be in this dataset, that we haven't
-                # already seen.
+    engagement_db_dataset_messages_map = {}  # of engagement_db_dataset to list of messages
+    log.info(f"Downloading {len(engagement_db_datasets)} datasets, {max_concurrent_downloads} at a time...")
+    with ThreadPoolExecutor(max_workers=max_concurrent_downloads) as executor:
+        futures = dict()  # of future -> (engagement_db_dataset, latest_message_timestamp, latest_ws_message_timestamp)
+        for engagement_db_dataset in engagement_db_datasets:
+            latest_message_timestamp = None
+            latest_ws_message_timestamp = None
+            if cache is not None:
+                latest_message_timestamp = cache.get_latest_message_timestamp(engagement_db_dataset)
                 latest_ws_message_timestamp = cache.get_latest_message_timestamp(f"{engagement_db_dataset}_ws")
-                if latest_ws_message_timestamp is None:
-                    ws_corrected_messages_filter = lambda q: q \
-                        .where("previous_datasets", "array_contains", engagement_db_dataset)
-                else:
-                    ws_corrected_messages_filter = lambda q: q \
-                        .where("previous_datasets", "array_contains", engagement_db_dataset) \
-                        .where("last_updated", ">", latest_ws_message_timestamp)
-
-                ws_corrected_messages = engagement_db.get_messages(firestore_query_filter=ws_corrected_messages_filter)
+            future = executor.submit(_download_dataset_messages, engagement_db, engagement_db_dataset,
+                                     latest_message_timestamp, latest_ws_message_timestamp)
+            futures[future] = (engagement_db_dataset, latest_message_timestamp, latest_ws_message_timestamp)
 
-                log.info(f"Downloaded {len(updated_messages)} updated messages in this dataset, and "
-                         f"{len(ws_corrected_messages)} messages that were previously in this dataset but have moved.")
+        for future in as_completed(futures):
+            engagement_db_dataset, latest_message_timestamp, latest_ws_message_timestamp = futures[future]
+            updated_messages, ws_corrected_messages = future.result()
+            full_download_required = latest_message_timestamp is None
 
+            moved_message_ids = {msg.message_id for msg in ws_corrected_messages}
+            if full_download_required:
+                messages_by_id = _upsert_messages_by_id(dict(), updated_messages)
+            else:
                 # Update the latest seen ws message from this dataset
                 if len(ws_corrected_messages) > 0:
                     for msg in ws_corrected_messages:
@@ -82,33 +172,16 @@ def _get_project_messages_from_engagement_db(analysis_dataset_configurations, en
                             latest_ws_message_timestamp = msg.last_updated
                     cache.set_latest_message_timestamp(f"{engagement_db_dataset}_ws", latest_ws_message_timestamp)
 
-                cache_messages = cache.get_messages(engagement_db_dataset)
-                for msg in cache_messages:
-                    if msg.message_id in {msg.message_id for msg in ws_corrected_messages}:
-                        continue
-                    messages.append(msg)
-
-            else:
-                log.warning(f"Performing a full download for {engagement_db_dataset} messages...")
-
-                full_download_filter = lambda q: q \
-                    .where("dataset", "==", engagement_db_dataset)
-
-                messages = engagement_db.get_messages(firestore_query_filter=full_download_filter)
-                log.info(f"Downloaded {len(messages)} messages")
+                messages_by_id = _upsert_messages_by_id(
+                    {msg.message_id: msg for msg in cache.get_messages(engagement_db_dataset)},
+                    updated_messages,
+                    moved_message_ids=moved_message_ids
+                )
 
-            # Filter messages for their latest versions
-            # (Filter by sorting in reverse order of last_updated and keeping the first snapshot we see of each id)
-            latest_messages = []
-            seen_message_ids = set()
-            messages.sort(key=lambda msg: msg.last_updated, reverse=True)
-            for msg in messages:
-                if msg.message_id not in seen_message_ids:
-                    seen_message_ids.add(msg.message_id)
-                    latest_messages.append(msg)
-
-            log.info(f"Filtered for latest message snapshots: {len(latest_messages)}/{len(messages)} snapshots remain")
-            messages = latest_messages
+            # Order the latest snapshot of each message by last_updated, most recent first, so the outputs are in the
+            # same order regardless of whether this was an incremental or a full download.
+            messages = sorted(messages_by_id.values(), key=lambda msg: msg.last_updated, reverse=True)
+            log.info(f"Found {len(messages)} latest message snapshots in {engagement_db_dataset}")
             engagement_db_dataset_messages_map[engagement_db_dataset] = messages
 
             # Update latest_message_timestamp
@@ -127,34 +200,43 @@ def _get_project_messages_from_engagement_db(analysis_dataset_configurations, en
                         # this dataset before this initial fetch.
                         cache.set_latest_message_timestamp(f"{engagement_db_dataset}_ws", latest_message_timestamp)
 
-                # Export project engagement_dataset files
-                if len(messages) > 0:
-                    cache.set_messages(engagement_db_dataset, messages)
+                # Export project engagement_dataset files. After an incremental download, only write the messages that
+                # changed in this run.
+                if full_download_required:
+                    if len(messages) > 0:
+                        cache.set_messages(engagement_db_dataset, messages)
+                else:
+                    upserted_messages = [msg for msg in updated_messages if messages_by_id.get(msg.message_id) is msg]
+                    removed_message_ids = [message_id for message_id in moved_message_ids
+                                           if message_id not in messages_by_id]
+                    cache.update_messages(engagement_db_dataset, upserted_messages, removed_message_ids)
 
-    return engagement_db_dataset_messages_map
+    # Return the datasets in their configured order, regardless of the order the downloads completed in.
+    return {engagement_db_dataset: engagement_db_dataset_messages_map[engagement_db_dataset]
+            for engagement_db_dataset in engagement_db_datasets}
 
 
-def _convert_messages_to_traced_data(user, messages_map):
+def _convert_messages_to_records(user, messages_map):
     """
-    Converts messages dict objects to TracedData objects.
+    Converts messages to MessageRecord objects, for processing by the message-level stages of the analysis.
 
     :param user: Identifier of user running the pipeline.
     :type user: str
     :param messages_map: Dict of engagement db dataset -> list of Messages in that dataset.
     :type messages_map: dict of str -> list of engagement_database.data_models.Message
-    :return: A list of Traced data message objects.
-    :type: list of Traced data
+    :return: A list of message records.
+    :rtype: list of src.engagement_db_to_analysis.message_record.MessageRecord
     """
     messages_traced_data = []
     for engagement_db_dataset in messages_map:
         engagement_db_dataset_messages = messages_map[engagement_db_dataset]
         for msg in engagement_db_dataset_messages:
-            messages_traced_data.append(TracedData(
-                msg.to_dict(serialize_datetimes_to_str=True),
+            messages_traced_data.append(MessageRecord(
+                project_analysis_message_dict(msg.to_dict(serialize_datetimes_to_str=True)),
                 Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string())
             ))
 
-    log.info(f"Converted {len(messages_traced_data)} raw messages to TracedData")
+    log.info(f"Converted {len(messages_traced_data)} raw messages to message records")
 
     return messages_traced_data
 
@@ -167,31 +249,30 @@ def export_traced_data(traced_data, export_path):
 def generate_analysis_files(user, google_cloud_credentials_file_path, pipeline_config, uuid_table, engagement_db, rapid_pro,
                             membership_group_dir_path, output_dir, cache_path=None):
 
-    analysis_dataset_configurations = pipeline_config.analysis.dataset_configurations
-    # TODO: Tidy up which functions get passed analysis_configs and which get passed dataset_configurations
+    indexed_analysis_config = IndexedAnalysisConfiguration(pipeline_config.analysis)
+    analysis_dataset_configurations = indexed_analysis_config.dataset_configurations
 
-    messages_map = _get_project_messages_from_engagement_db(analysis_dataset_configurations, engagement_db, cache_path)
+    messages_map = _get_project_messages_from_engagement_db(
+        analysis_dataset_configurations, engagement_db, cache_path, pipeline_config.analysis.max_concurrent_downloads
+    )
 
-    messages_traced_data = _convert_messages_to_traced_data(user, messages_map)
+    messages_traced_data = _convert_messages_to_records(user, messages_map)
 
     messages_traced_data = filter_messages(user, messages_traced_data, pipeline_config)
 
-    impute_codes_by_message(
-        user, messages_traced_data, analysis_dataset_configurations,
-        pipeline_config.analysis.ws_correct_dataset_code_scheme
-    )
+    impute_codes_by_message(user, messages_traced_data, indexed_analysis_config)
 
-    messages_by_column = convert_to_messages_column_format(user, messages_traced_data, pipeline_config.analysis)
-    participants_by_column = convert_to_participants_column_format(user, messages_traced_data, pipeline_config.analysis)
+    messages_by_column = convert_to_messages_column_format(user, messages_traced_data, indexed_analysis_config)
+    participants_by_column = convert_to_participants_column_format(user, messages_traced_data, indexed_analysis_config)
 
     log.info(f"Imputing messages column-view traced data...")
-    impute_codes_by_column_traced_data(user, messages_by_column, pipeline_config.analysis.dataset_configurations)
+    impute_codes_by_column_traced_data(user, messages_by_column, indexed_analysis_config)
 
     log.info(f"Imputing participants column-view traced data...")
-    impute_codes_by_column_traced_data(user, participants_by_column, pipeline_config.analysis.dataset_configurations)
+    impute_codes_by_column_traced_data(user, participants_by_column, indexed_analysis_config)
 
     # Export to hard-coded files for now.
-    export_production_file(messages_by_column, pipeline_config.analysis, f"{output_dir}/production.csv")
+    export_production_file(messages_by_column, indexed_analysis_config, f"{output_dir}/production.csv")
 
     if pipeline_config.analysis.membership_group_configuration is not None:
 
@@ -205,13 +286,15 @@ def generate_analysis_files(user, google_cloud_credentials_file_path, pipeline_c
         tag_membership_groups_participants(user, participants_by_column, google_cloud_credentials_file_path, 
                                            membership_group_csv_urls, membership_group_dir_path)
 
-    export_analysis_file(messages_by_column, pipeline_config, f"{output_dir}/messages.csv", export_timestamps=True)
-    export_analysis_file(participants_by_column, pipeline_config, f"{output_dir}/participants.csv")
+    export_analysis_file(messages_by_column, indexed_analysis_config, f"{output_dir}/messages.csv",
+                         export_timestamps=True)
+    export_analysis_file(participants_by_column, indexed_analysis_config, f"{output_dir}/participants.csv")
 
     export_traced_data(messages_by_column, f"{output_dir}/messages.jsonl")
     export_traced_data(participants_by_column, f"{output_dir}/participants.jsonl")
 
-    run_automated_analysis(messages_by_column, participants_by_column, pipeline_config.analysis, f"{output_dir}/automated-analysis")
+    run_automated_analysis(messages_by_column, participants_by_column, indexed_analysis_config,
+                           f"{output_dir}/automated-analysis")
 
     if pipeline_config.analysis.google_drive_upload is None:
         log.debug("Not uploading to Google Drive, because the 'google_drive_upload' configuration was None")
@@ -0,0 +1,98 @@
+from src.common.code_scheme_registry import CodeSchemeRegistry
+from src.engagement_db_to_analysis.column_view_conversion import (analysis_dataset_config_to_column_configs,
+                                                                  analysis_dataset_configs_to_rqa_column_configs,
+                                                                  analysis_dataset_configs_to_demog_column_configs)
+from src.engagement_db_to_analysis.configuration import DatasetTypes
+
+
+class IndexedAnalysisConfiguration:
+    def __init__(self, analysis_config):
+        """
+        Initialises an index of an analysis configuration, for looking up the configuration that applies to each
+        message, and the configurations derived from it, without re-deriving them every time they're needed.
+
+        This should be built once per analysis run, then passed to each of the analysis stages in place of the raw
+        configuration.
+
+        :param analysis_config: Analysis configuration to index.
+        :type analysis_config: src.engagement_db_to_analysis.configuration.AnalysisConfiguration
+        """
+        self.analysis_config = analysis_config
+        self.dataset_configurations = analysis_config.dataset_configurations
+        self.ws_correct_dataset_code_scheme = analysis_config.ws_correct_dataset_code_scheme
+
+        # If an engagement db dataset is listed in more than one analysis dataset configuration, the first
+        # configuration is used.
+        self._dataset_configs = dict()  # of engagement db dataset -> AnalysisDatasetConfiguration
+        for dataset_config in self.dataset_configurations:
+            for engagement_db_dataset in dataset_config.engagement_db_datasets:
+                self._dataset_configs.setdefault(engagement_db_dataset, dataset_config)
+
+        self._column_configs = dict()  # of analysis dataset_name -> list of column-view AnalysisConfiguration
+        self.column_configs = []
+        for dataset_config in self.dataset_configurations:
+            dataset_column_configs = analysis_dataset_config_to_column_configs(dataset_config)
+            self._column_configs[dataset_config.dataset_name] = dataset_column_configs
+            self.column_configs.extend(dataset_column_configs)
+        self.rqa_column_configs = analysis_dataset_configs_to_rqa_column_configs(self.dataset_configurations)
+        self.demog_column_configs = analysis_dataset_configs_to_demog_column_configs(self.dataset_configurations)
+
+        self.rqa_engagement_db_datasets = set()
+        self.demog_engagement_db_datasets = set()
+        for dataset_config in self.dataset_configurations:
+            if dataset_config.dataset_type == DatasetTypes.RESEARCH_QUESTION_ANSWER:
+                self.rqa_engagement_db_datasets.update(dataset_config.engagement_db_datasets)
+            elif dataset_config.dataset_type == DatasetTypes.DEMOGRAPHIC:
+                self.demog_engagement_db_datasets.update(dataset_config.engagement_db_datasets)
+
+        # Registries of the code schemes that labels in each analysis dataset may be assigned under.
+        self._code_scheme_registries = dict()  # of analysis dataset_name -> CodeSchemeRegistry
+        for dataset_config in self.dataset_configurations:
+            code_schemes = [c.code_scheme for c in dataset_config.coding_configs]
+            code_schemes.append(self.ws_correct_dataset_code_scheme)
+            self._code_scheme_registries[dataset_config.dataset_name] = CodeSchemeRegistry(code_schemes)
+
+    def get_dataset_config(self, engagement_db_dataset):
+        """
+        :param engagement_db_dataset: Engagement db dataset to get the analysis dataset configuration for.
+        :type engagement_db_dataset: str
+        :return: Analysis dataset configuration to use to process messages in the given engagement db dataset.
+        :rtype: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+        """
+        dataset_config = self._dataset_configs.get(engagement_db_dataset)
+        if dataset_config is None:
+            raise ValueError(f"No analysis dataset configuration found for engagement db dataset "
+                             f"'{engagement_db_dataset}'")
+        return dataset_config
+
+    def get_dataset_config_for_message(self, message):
+        """
+        :param message: Message to get the analysis dataset configuration for.
+        :type message: engagement_database.data_models.Message
+        :return: Analysis dataset configuration to use to process this message.
+        :rtype: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+        """
+        dataset_config = self._dataset_configs.get(message.dataset)
+        if dataset_config is None:
+            raise ValueError(f"No analysis dataset configuration found for message '{message.message_id}', which has "
+                             f"engagement db dataset {message.dataset}")
+        return dataset_config
+
+    def get_column_configs(self, dataset_config):
+        """
+        :param dataset_config: Analysis dataset configuration to get the "column-view" configurations for.
+        :type dataset_config: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+        :return: The column-view configurations for the given analysis dataset configuration. These are shared, so must
+                 not be modified.
+        :rtype: list of core_data_modules.analysis.analysis_utils.AnalysisConfiguration
+        """
+        return self._column_configs[dataset_config.dataset_name]
+
+    def get_code_scheme_registry(self, dataset_config):
+        """
+        :param dataset_config: Analysis dataset configuration to get the code scheme registry for.
+        :type dataset_config: src.engagement_db_to_analysis.configuration.AnalysisDatasetConfiguration
+        :return: Registry of the code schemes of the given analysis dataset, and the WS - Correct Dataset code scheme.
+        :rtype: src.common.code_scheme_registry.CodeSchemeRegistry
+        """
+        return self._code_scheme_registries[dataset_config.dataset_name]
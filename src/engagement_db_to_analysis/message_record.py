@@ -0,0 +1,95 @@
+from collections.abc import Mapping
+
+from core_data_modules.traced_data import TracedData
+
+from src.engagement_db_to_analysis.message_schema import analysis_message_from_dict
+
+
+class MessageRecord(Mapping):
+    __slots__ = ("_data", "_events", "_message", "_traced_data")
+
+    def __init__(self, data, metadata):
+        """
+        Initialises a lightweight, read-only mapping of message data, which records its provenance as a compact log of
+        the updates made to it.
+
+        This is used in place of TracedData for the message-level stages of the analysis, which only need to read the
+        current data and append updates. Unlike TracedData, appending an update doesn't hash or copy the existing data,
+        and an update with no data (to record that a message passed through a stage) only stores the metadata.
+        Records can be converted into an equivalent TracedData with `to_traced_data` when their history needs to be
+        exported.
+
+        The record also caches its data parsed as a Message (see `get_message`), so that stages which read the
+        message's labels don't each need to re-parse them.
+
+        :param data: Initial data for this record.
+        :type data: dict
+        :param metadata: Metadata describing where the initial data came from.
+        :type metadata: core_data_modules.traced_data.Metadata
+        """
+        self._data = dict(data)
+        self._events = [(data, metadata)]  # of (data updated or None, metadata)
+        self._message = None
+        self._traced_data = None
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def append_data(self, new_data, metadata):
+        """
+        Updates this record with new data.
+
+        :param new_data: Data to add to this record, overwriting any existing values for the same keys.
+        :type new_data: dict
+        :param metadata: Metadata describing this update.
+        :type metadata: core_data_modules.traced_data.Metadata
+        """
+        if len(new_data) == 0:
+            self._events.append((None, metadata))
+            return
+
+        new_data = dict(new_data)
+        self._data.update(new_data)
+        self._events.append((new_data, metadata))
+        self._message = None
+        self._traced_data = None
+
+    def get_message(self):
+        """
+        Gets this record's data as a Message.
+
+        The Message is parsed the first time this is called, then cached until this record's data is next updated.
+        The Message returned is shared between callers, so must not be modified. Its fields that aren't in the
+        analysis message schema are placeholders (see `src.engagement_db_to_analysis.message_schema`).
+
+        :return: This record's data, as a Message.
+        :rtype: engagement_database.data_models.Message
+        """
+        if self._message is None:
+            self._message = analysis_message_from_dict(self._data)
+        return self._message
+
+    def to_traced_data(self):
+        """
+        Gets a TracedData with the same data and history as this record.
+
+        The TracedData is built the first time this is called, then cached until this record's data is next updated,
+        so that a record appended to many column-view TracedData is only materialised once. The TracedData returned is
+        shared between callers, in the same way that a message's TracedData was shared before records were introduced.
+
+        :return: A TracedData with the same data and history as this record.
+        :rtype: core_data_modules.traced_data.TracedData
+        """
+        if self._traced_data is None:
+            initial_data, initial_metadata = self._events[0]
+            td = TracedData(dict(initial_data), initial_metadata)
+            for new_data, metadata in self._events[1:]:
+                td.append_data(dict() if new_data is None else new_data, metadata)
+            self._traced_data = td
+        return self._traced_data
@@ -0,0 +1,79 @@
+from engagement_database.data_models import Message, MessageOrigin
+
+# Fields of engagement database messages that the analysis stage uses. Messages are downloaded from the engagement
+# database, cached, and converted to message records with only these fields, to reduce the network transfer and memory
+# use of this stage.
+ANALYSIS_MESSAGE_FIELDS = [
+    "message_id",
+    "participant_uuid",
+    "text",
+    "timestamp",
+    "dataset",
+    "labels",
+    "status",
+    "last_updated",
+    "previous_datasets"
+]
+
+# Placeholder values for the fields that are needed to construct an engagement_database.data_models.Message, but that
+# the analysis doesn't use so doesn't download.
+_PLACEHOLDER_FIELDS = {
+    "direction": None,
+    "channel_operator": None,
+    "origin": MessageOrigin(origin_id="", origin_type="").to_dict(),
+    "coda_id": None
+}
+
+
+def select_analysis_message_fields(query):
+    """
+    :param query: Firestore query for engagement database messages.
+    :type query: google.cloud.firestore.Query
+    :return: `query`, projected to only return the fields in `ANALYSIS_MESSAGE_FIELDS`.
+    :rtype: google.cloud.firestore.Query
+    """
+    return query.select(ANALYSIS_MESSAGE_FIELDS)
+
+
+def project_analysis_message_dict(message_dict):
+    """
+    :param message_dict: Serialized engagement database message.
+    :type message_dict: dict
+    :return: A copy of `message_dict` with only the fields in `ANALYSIS_MESSAGE_FIELDS`.
+    :rtype: dict
+    """
+    return {field: message_dict[field] for field in ANALYSIS_MESSAGE_FIELDS if field in message_dict}
+
+
+def analysis_message_from_dict(message_dict):
+    """
+    Constructs a Message from a serialized engagement database message that may only have the fields in
+    `ANALYSIS_MESSAGE_FIELDS`. The other fields that a Message needs are set to placeholder values, so must not be used.
+
+    :param message_dict: Serialized engagement database message.
+    :type message_dict: dict
+    :return: Message constructed from `message_dict`.
+    :rtype: engagement_database.data_models.Message
+    """
+    d = dict(_PLACEHOLDER_FIELDS)
+    d.update(message_dict)
+    return Message.from_dict(d)
+
+
+def get_analysis_messages(engagement_db, firestore_query_filter):
+    """
+    Downloads messages from the engagement database, with only the fields in `ANALYSIS_MESSAGE_FIELDS`.
+
+    `EngagementDatabase.get_messages` can't be used for this because it parses each document it downloads into a
+    Message, which fails without the fields that aren't downloaded. Instead, this queries the messages collection
+    directly, and constructs the messages with `analysis_message_from_dict`.
+
+    :param engagement_db: Engagement database to download the messages from.
+    :type engagement_db: engagement_database.EngagementDatabase
+    :param firestore_query_filter: Filter to apply to the messages collection to select the messages to download.
+    :type firestore_query_filter: function of google.cloud.firestore.CollectionReference -> google.cloud.firestore.Query
+    :return: Downloaded messages.
+    :rtype: list of engagement_database.data_models.Message
+    """
+    query = select_analysis_message_fields(firestore_query_filter(engagement_db._messages_ref()))
+    return [analysis_message_from_dict(doc.to_dict()) for doc in query.stream()]
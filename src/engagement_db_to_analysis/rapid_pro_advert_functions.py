@@ -3,6 +3,8 @@ from core_data_modules.analysis import analysis_utils, AnalysisConfiguration as
 from core_data_modules.cleaners import Codes
 from core_data_modules.logging import Logger
 
+from src.common.rapid_pro_contact_updates import reidentify_and_update_contacts
+from src.common.rapid_pro_writer import RapidProContactWriter
 from src.engagement_db_to_analysis.cache import AnalysisCache
 from src.engagement_db_to_analysis.membership_group import (get_membership_groups_data)
 from src.pipeline_configuration_spec import *
@@ -11,6 +13,9 @@ log = Logger(__name__)
 
 CONSENT_WITHDRAWN_KEY = "consent_withdrawn"
 
+# Number of contacts to update between each save of the synced uuids to the cache.
+_SYNCED_UUIDS_SAVE_INTERVAL = 100
+
 #TODO move this to engagement db to rapid_pro sync once we support syncing imputed labels to db
 
 def _generate_weekly_advert_and_opt_out_uuids(participants_by_column, analysis_config,
@@ -108,26 +113,6 @@ def _generate_non_relevant_advert_uuids_by_dataset(participants_by_column, analy
     return non_relevant_uuids
 
 
-def _convert_uuids_to_urns(uuids_group, uuid_table):
-    """
-    Converts a list of UUIDs to their respective rapid_pro urns.
-
-    :param uuids_group: set of participant UUIDs to convert.
-    :type uuids_group: set of participant UUIDs.
-    :param uuid_table: UUID table to use to de-identify contact urns.
-    :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
-    :return urns: a set of de-identified urn.
-    :rtype: set of str
-    """
-
-    log.info(f"Converting {len(uuids_group)} uuids to urns...")
-    urn_lut = uuid_table.uuid_to_data_batch(uuids_group)
-    urns = {urn_lut[uuid] for uuid in uuids_group}
-    log.info(f"Converted {len(uuids_group)} uuids to {len(urns)} urns")
-
-    return urns
-
-
 #Todo: standardize and move to rapidpro tools
 def _ensure_contact_field_exists(workspace_contact_fields, contact_field, rapid_pro):
     """
@@ -145,7 +130,7 @@ def _ensure_contact_field_exists(workspace_contact_fields, contact_field, rapid_
         rapid_pro.create_field(field_id=contact_field.key, label=contact_field.label)
 
 
-def _sync_advert_contacts_fields_to_rapid_pro(cache, target_uuids, advert_contact_field_key, uuid_table, rapid_pro):
+def _sync_advert_contacts_fields_to_rapid_pro(cache, target_uuids, advert_contact_field_key, uuid_table, writer):
     '''
     Updates the advert contact field for the target urns.
 
@@ -157,8 +142,8 @@ def _sync_advert_contacts_fields_to_rapid_pro(cache, target_uuids, advert_contac
     :type advert_contact_field_key: str
     :param uuid_table: UUID table to use to de-identify contact urns.
     :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable.
-    :param rapid_pro: Rapid Pro client to sync the groups to.
-    :type rapid_pro: rapid_pro_tools.rapid_pro.RapidProClient
+    :param writer: Writer to update the Rapid Pro contacts with.
+    :type writer: src.common.rapid_pro_writer.RapidProContactWriter
     '''
 
     synced_uuids = []
@@ -173,16 +158,21 @@ def _sync_advert_contacts_fields_to_rapid_pro(cache, target_uuids, advert_contac
 
     if len(uuids_to_sync) > 0:
         log.info(f'Syncing {len(uuids_to_sync)} urns in this run ')
-        # Re-identify the uuids.
-        urns_to_sync = _convert_uuids_to_urns(uuids_to_sync, uuid_table)
-        # Update the advert contact field for the target urns.
-        for urn in urns_to_sync:
-            rapid_pro.update_contact(urn, contact_fields={advert_contact_field_key: "yes"})
-            synced_uuids.append(uuid_table.data_to_uuid(urn))
-
-            if cache is not None:
+
+        def on_participant_updated(participant_uuid):
+            synced_uuids.append(participant_uuid)
+            if cache is not None and len(synced_uuids) % _SYNCED_UUIDS_SAVE_INTERVAL == 0:
                 cache.set_synced_uuids(advert_contact_field_key, synced_uuids)
 
+        # Update the advert contact field for the target uuids.
+        reidentify_and_update_contacts(
+            writer, uuid_table, {uuid: {advert_contact_field_key: "yes"} for uuid in uuids_to_sync},
+            on_participant_updated
+        )
+
+        if cache is not None:
+            cache.set_synced_uuids(advert_contact_field_key, synced_uuids)
+
     else:
         assert len(uuids_to_sync) == 0
         log.info("Found 0 uuids to sync in this run skipping...")
@@ -229,6 +219,9 @@ def sync_advert_contacts_to_rapidpro(participants_by_column, uuid_table, pipelin
         google_cloud_credentials_file_path, membership_group_dir_path
     )
 
+    sync_config = pipeline_config.rapid_pro_target.sync_config
+    writer = RapidProContactWriter(rapid_pro, sync_config.max_concurrent_writes, sync_config.max_writes_per_second)
+
     # Get workspace contact fields to check whether our target contact field exists
     workspace_contact_fields = rapid_pro.get_fields()
 
@@ -239,14 +232,14 @@ def sync_advert_contacts_to_rapidpro(participants_by_column, uuid_table, pipelin
     _ensure_contact_field_exists(workspace_contact_fields, consent_withdrawn_contact_field, rapid_pro)
 
     _sync_advert_contacts_fields_to_rapid_pro(cache, opt_out_uuids, consent_withdrawn_contact_field.key, uuid_table,
-                                              rapid_pro)
+                                              writer)
 
     log.info(f'Syncing weekly advert contacts to rapid pro...')
     weekly_advert_contact_field = pipeline_config.rapid_pro_target.sync_config.weekly_advert_contact_field
     _ensure_contact_field_exists(workspace_contact_fields, weekly_advert_contact_field, rapid_pro)
 
     _sync_advert_contacts_fields_to_rapid_pro(cache, weekly_advert_uuids, weekly_advert_contact_field.key, uuid_table,
-                                              rapid_pro)
+                                              writer)
 
     #Update  dataset non relevant groups to rapid_pro
     log.info(f'Syncing contacts who sent non relevant messages for each episode...')
@@ -260,4 +253,4 @@ def sync_advert_contacts_to_rapidpro(participants_by_column, uuid_table, pipelin
 
             _sync_advert_contacts_fields_to_rapid_pro(cache, non_relevant_uuids,
                                                       analysis_dataset_config.rapid_pro_non_relevant_field.key,
-                                                      uuid_table, rapid_pro)
+                                                      uuid_table, writer)
@@ -16,11 +16,11 @@ def rqa_time_range_filter(user, messages_traced_data, pipeline_config):
     Filters a list of td for research question messages received within the given time range.
 
     :param messages_traced_data: List of message objects to filter.
-    :type messages_traced_data: list of TracedData
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
     :pipeline_config: pipeline configuration module
     :type PIPELINE_CONFIGURATION:
     :return: Filtered list.
-    :rtype: list of TracedData
+    :rtype: list of src.engagement_db_to_analysis.message_record.MessageRecord
     """
 
     # Inclusive start time of the time range to keep. Messages sent before this time will be dropped.
@@ -55,7 +55,7 @@ def rqa_time_range_filter(user, messages_traced_data, pipeline_config):
                 continue
             if end_time_inclusive is not None and isoparse(td["timestamp"]) > end_time_inclusive:
                 continue
-            td.append_data(td, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
+            td.append_data({}, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
             filtered.append(td)
         else:
             filtered.append(td)
@@ -70,11 +70,11 @@ def filter_test_messages(user, messages_traced_data, test_participant_uuids):
     Filters out test messages sent by pipeline_config.test_participant_uuids i.e AVF/Aggregator staff
 
     :param messages_traced_data: List of message objects to filter.
-    :type messages_traced_data: list of TracedData
+    :type messages_traced_data: list of src.engagement_db_to_analysis.message_record.MessageRecord
     :param test_participant_uuids: a list containing test participant uids.
     :type test_participant_uuids: list of str
-    :return: Filtered dict.
-    :rtype: dict of participant_uid -> TracedData
+    :return: Filtered list.
+    :rtype: list of src.engagement_db_to_analysis.message_record.MessageRecord
     """
     log.debug("Filtering test messages data...")
     filtered = []
@@ -87,8 +87,7 @@ def filter_test_messages(user, messages_traced_data, test_participant_uuids):
 
         # Updates the td object with new Metadata for this filter function.
         # The allows us to hold history of the td update for easy traceback.
-        td.append_data(td, Metadata(user, Metadata.get_call_location(),
-                                                    TimeUtils.utc_now_as_iso_string()))
+        td.append_data({}, Metadata(user, Metadata.get_call_location(), TimeUtils.utc_now_as_iso_string()))
         filtered.append(td)
 
     log.info(f"Filtered out {len(filtered_participants_uuids)}/{len(test_participant_uuids)} test participants messages...")
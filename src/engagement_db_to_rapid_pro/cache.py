@@ -0,0 +1,159 @@
+from datetime import datetime
+import json
+import sqlite3
+
+from core_data_modules.util import IOUtils
+from engagement_database.data_models import Message
+
+from src.common.cache import Cache
+from src.engagement_db_to_rapid_pro.participant_index import IndexedMessage
+
+
+class EngagementDBToRapidProCache(Cache):
+    def __init__(self, cache_dir):
+        """
+        Initialises an Engagement database -> Rapid Pro cache at the given directory.
+
+        In addition to the general-purpose entries provided by `src.common.cache.Cache`, this stores the following in a
+        sqlite database in `cache_dir`, so that each checkpoint only needs to write the rows that changed:
+         - The hash of the contact fields last written to each participant, keyed by participant uuid.
+         - The participant index, keyed by (participant uuid, message id), and the last message it has been synced up
+           to. These are always updated together, in one transaction.
+
+        :param cache_dir: Directory to use for the cache.
+        :type cache_dir: str
+        """
+        super().__init__(cache_dir)
+
+        db_path = f"{cache_dir}/engagement-db-to-rapid-pro-cache.sqlite"
+        IOUtils.ensure_dirs_exist_for_file(db_path)
+        # Shards synced in parallel threads each have their own cache, so a connection is only used by one thread at
+        # a time, but that isn't always the thread that created it.
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS written_contact_fields_hashes (
+                participant_uuid TEXT PRIMARY KEY,
+                contact_fields_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS participant_index (
+                participant_uuid TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                dataset TEXT NOT NULL,
+                text TEXT,
+                timestamp TEXT NOT NULL,
+                consent_withdrawn INTEGER NOT NULL,
+                PRIMARY KEY (participant_uuid, message_id)
+            );
+            CREATE TABLE IF NOT EXISTS participant_index_state (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._connection.commit()
+
+    def get_written_contact_fields_hashes(self):
+        """
+        :return: Dictionary of participant uuid -> hash of the contact fields last written to that participant.
+        :rtype: dict of str -> str
+        """
+        return dict(self._connection.execute(
+            "SELECT participant_uuid, contact_fields_hash FROM written_contact_fields_hashes"
+        ).fetchall())
+
+    def set_written_contact_fields_hashes(self, contact_fields_hashes):
+        """
+        Sets the hashes of the contact fields last written to the given participants. Hashes for participants not in
+        `contact_fields_hashes` are left unchanged.
+
+        :param contact_fields_hashes: Dictionary of participant uuid -> hash of the contact fields last written to that
+                                      participant.
+        :type contact_fields_hashes: dict of str -> str
+        """
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO written_contact_fields_hashes (participant_uuid, contact_fields_hash) VALUES (?, ?)",
+            contact_fields_hashes.items()
+        )
+        self._connection.commit()
+
+    def get_participant_index_state(self):
+        """
+        Gets the last message the participant index has been synced up to, and whether the index includes the text of
+        each message.
+
+        :return: Tuple of (last synced message, whether the index includes message texts), or (None, None) if there is
+                 no participant index yet.
+        :rtype: (engagement_database.data_models.Message, bool) | (None, None)
+        """
+        state = dict(self._connection.execute("SELECT name, value FROM participant_index_state").fetchall())
+        if "last_synced_message" not in state:
+            return None, None
+
+        message_dict = json.loads(state["last_synced_message"])
+        message_dict["timestamp"] = datetime.fromisoformat(message_dict["timestamp"])
+        message_dict["last_updated"] = datetime.fromisoformat(message_dict["last_updated"])
+        return Message.from_dict(message_dict), json.loads(state["includes_texts"])
+
+    def get_indexed_messages(self, participant_uuid):
+        """
+        :param participant_uuid: Uuid of the participant to get the indexed messages of.
+        :type participant_uuid: str
+        :return: Dictionary of message id -> indexed message, for each of the participant's indexed messages.
+        :rtype: dict of str -> src.engagement_db_to_rapid_pro.participant_index.IndexedMessage
+        """
+        rows = self._connection.execute(
+            "SELECT message_id, dataset, text, timestamp, consent_withdrawn FROM participant_index "
+            "WHERE participant_uuid = ?", (participant_uuid,)
+        ).fetchall()
+        return {
+            message_id: IndexedMessage(dataset=dataset, text=text, timestamp=timestamp,
+                                       consent_withdrawn=bool(consent_withdrawn))
+            for message_id, dataset, text, timestamp, consent_withdrawn in rows
+        }
+
+    def clear_participant_index(self):
+        """
+        Deletes the participant index and the last message it was synced up to, so that it can be rebuilt from scratch.
+        """
+        with self._connection:
+            self._connection.execute("DELETE FROM participant_index")
+            self._connection.execute("DELETE FROM participant_index_state")
+
+    def checkpoint_participant_index(self, indexed_message_updates, last_synced_message, includes_texts):
+        """
+        Writes changes to the participant index and the last message it has been synced up to, in one transaction.
+
+        :param indexed_message_updates: Updates to write, as tuples of (participant uuid, message id, indexed message
+                                        or None to delete the message from the index).
+        :type indexed_message_updates: iterable of
+                                       (str, str, src.engagement_db_to_rapid_pro.participant_index.IndexedMessage | None)
+        :param last_synced_message: Last message synced, up to and including which all the changes to the index have
+                                    been written.
+        :type last_synced_message: engagement_database.data_models.Message
+        :param includes_texts: Whether the index includes the text of each message.
+        :type includes_texts: bool
+        """
+        rows_to_write = []
+        keys_to_delete = []
+        for participant_uuid, message_id, indexed_message in indexed_message_updates:
+            if indexed_message is None:
+                keys_to_delete.append((participant_uuid, message_id))
+            else:
+                rows_to_write.append((participant_uuid, message_id, indexed_message.dataset, indexed_message.text,
+                                      indexed_message.timestamp, int(indexed_message.consent_withdrawn)))
+
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO participant_index "
+                "(participant_uuid, message_id, dataset, text, timestamp, consent_withdrawn) VALUES (?, ?, ?, ?, ?, ?)",
+                rows_to_write
+            )
+            self._connection.executemany(
+                "DELETE FROM participant_index WHERE participant_uuid = ? AND message_id = ?", keys_to_delete
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO participant_index_state (name, value) VALUES (?, ?)",
+                [("last_synced_message", json.dumps(last_synced_message.to_dict(serialize_datetimes_to_str=True))),
+                 ("includes_texts", json.dumps(includes_texts))]
+            )
@@ -31,3 +31,6 @@ class EngagementDBToRapidProConfiguration:
                                          # not be appropriate for continuous sync because a new message may have arrived
                                          # in Rapid Pro but not yet in the engagement database.
     sync_advert_contacts: bool = False   # Whether to sync advert contacts, consent withdrawn field to rapid pro
+    max_concurrent_writes: int = 1       # Maximum number of contact updates to have in flight to Rapid Pro at once.
+    max_writes_per_second: Optional[float] = None  # Maximum rate to start contact updates at. Set this to the
+                                                   # workspace's rate limit when using max_concurrent_writes > 1.
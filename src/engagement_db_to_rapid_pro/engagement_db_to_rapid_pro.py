@@ -1,20 +1,29 @@
-import glob
 import json
-from collections import defaultdict
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
 
-from core_data_modules.cleaners import Codes
-from core_data_modules.data_models import CodeScheme
 from core_data_modules.logging import Logger
+from core_data_modules.util import SHAUtils
 
-from src.common.cache import Cache
-from src.common.get_messages_in_datasets import get_messages_in_datasets
+from src.common.code_schemes import get_code_scheme_registry
+from src.common.rapid_pro_contact_updates import reidentify_and_update_contacts
+from src.common.rapid_pro_writer import RapidProContactWriter
+from src.common.sync_stats import format_eta
+from src.engagement_db_to_rapid_pro.cache import EngagementDBToRapidProCache
 from src.engagement_db_to_rapid_pro.configuration import WriteModes
+from src.engagement_db_to_rapid_pro.participant_index import ParticipantIndex
+from src.engagement_db_to_rapid_pro.sync_stats import EngagementDBToRapidProSyncStats, EngagementDBToRapidProSyncEvents
 
 log = Logger(__name__)
 
 # Value to write to a Rapid Pro contact field if we're only indicating the presence of an answer
 _PRESENCE_VALUE = "#ENGAGEMENT-DATABASE-HAS-RESPONSE"
 
+# Number of messages to process between each batch of contact updates. Progress is checkpointed after each batch.
+_CONTACT_UPDATE_BATCH_SIZE = 100
+
 
 def _engagement_db_datasets_in_sync_config(sync_config):
     """
@@ -35,37 +44,128 @@ def _engagement_db_datasets_in_sync_config(sync_config):
     return engagement_db_datasets
 
 
-def _get_all_messages(engagement_db, sync_config, cache=None):
+def _get_messages_updated_since(engagement_db, engagement_db_datasets, last_updated=None):
     """
-    Gets all the messages in the database relevant to this sync_config i.e. all messages in the engagement_db_datasets
-    in the sync_config.
+    Gets the messages that need to be applied to the participant index.
+
+    If `last_updated` is None, gets all the messages in the given datasets. Otherwise, gets all the messages in the
+    database that were updated at or after `last_updated`, in any dataset, so that the index can also see messages
+    that have been moved out of the given datasets.
 
     :param engagement_db: Engagement database to get messages from.
     :type engagement_db: engagement_database.EngagementDatabase
-    :param sync_config: Sync config defining which messages to get.
-    :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
-    :param cache: Cache to use for messages, or None.
-    :type cache: src.common.cache.Cache
-    :return: All messages in the datasets in the sync_config.
+    :param engagement_db_datasets: Datasets to get all the messages from, if `last_updated` is None.
+    :type engagement_db_datasets: iterable of str
+    :param last_updated: Time to get messages updated at or after, or None.
+    :type last_updated: datetime.datetime | None
+    :return: Messages, sorted by (last_updated, message_id).
     :rtype: list of engagement_database.data_models.Message
     """
-    engagement_db_datasets = _engagement_db_datasets_in_sync_config(sync_config)
-    messages_by_dataset = get_messages_in_datasets(engagement_db, engagement_db_datasets, cache)
-
     messages = []
-    for msgs in messages_by_dataset.values():
-        messages.extend(msgs)
+    if last_updated is None:
+        for engagement_db_dataset in sorted(engagement_db_datasets):
+            log.info(f"Downloading all messages in dataset '{engagement_db_dataset}'...")
+            messages.extend(engagement_db.get_messages(
+                firestore_query_filter=lambda q: q.where("dataset", "==", engagement_db_dataset)
+            ))
+    else:
+        log.info(f"Downloading all messages updated since {last_updated.isoformat()}...")
+        messages = engagement_db.get_messages(
+            firestore_query_filter=lambda q: q.where("last_updated", ">=", last_updated).order_by("last_updated")
+        )
 
+    messages.sort(key=lambda msg: (msg.last_updated, msg.message_id))
+    log.info(f"Downloaded {len(messages)} message(s)")
     return messages
 
 
-def _get_normal_contact_fields_for_participant(participant_messages, sync_config):
+def _is_at_or_before(message, cursor_message):
+    """
+    :param message: Message to check.
+    :type message: engagement_database.data_models.Message
+    :param cursor_message: Message to compare to, or None.
+    :type cursor_message: engagement_database.data_models.Message | None
+    :return: Whether `message` is at or before `cursor_message` in (last_updated, message_id) order. If `cursor_message`
+             is None, returns False.
+    :rtype: bool
+    """
+    if cursor_message is None:
+        return False
+    return (message.last_updated, message.message_id) <= (cursor_message.last_updated, cursor_message.message_id)
+
+
+def _make_normal_dataset_indices(sync_config):
+    """
+    :param sync_config: Sync config to index the normal datasets of.
+    :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
+    :return: Dictionary of engagement db dataset -> indices of the `sync_config.normal_datasets` which contain it.
+    :rtype: dict of str -> list of int
+    """
+    normal_dataset_indices = dict()
+    if sync_config.normal_datasets is None:
+        return normal_dataset_indices
+
+    for i, dataset_config in enumerate(sync_config.normal_datasets):
+        for engagement_db_dataset in dataset_config.engagement_db_datasets:
+            if engagement_db_dataset not in normal_dataset_indices:
+                normal_dataset_indices[engagement_db_dataset] = []
+            normal_dataset_indices[engagement_db_dataset].append(i)
+    return normal_dataset_indices
+
+
+@dataclass
+class _ParticipantSummary:
+    normal_datasets_present: int  # Bitset of the indices of the normal datasets that the participant has messages in.
+    normal_dataset_texts: Optional[Dict[int, List[str]]]  # Normal dataset index -> message strings, if the write mode
+                                                          # is CONCATENATE_TEXTS, otherwise None.
+    consent_withdrawn: bool
+
+
+def _summarise_participant(participant_messages, sync_config, normal_dataset_indices):
+    """
+    Summarises a participant's messages into the state needed to compute their contact fields, in one pass over the
+    messages.
+
+    :param participant_messages: All indexed messages from the participant to summarise, in the order they were sent.
+    :type participant_messages: list of src.engagement_db_to_rapid_pro.participant_index.IndexedMessage
+    :param sync_config: Sync config defining which messages to summarise.
+    :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
+    :param normal_dataset_indices: Dictionary of engagement db dataset -> indices of the normal datasets which contain
+                                   it, as returned by `_make_normal_dataset_indices`.
+    :type normal_dataset_indices: dict of str -> list of int
+    :return: Summary of the participant's messages.
+    :rtype: _ParticipantSummary
+    """
+    concatenate_texts = sync_config.write_mode == WriteModes.CONCATENATE_TEXTS
+    consent_withdrawn_datasets = set() if sync_config.consent_withdrawn_dataset is None else \
+        set(sync_config.consent_withdrawn_dataset.engagement_db_datasets)
+
+    summary = _ParticipantSummary(
+        normal_datasets_present=0,
+        normal_dataset_texts=dict() if concatenate_texts else None,
+        consent_withdrawn=False
+    )
+    for msg in participant_messages:
+        for i in normal_dataset_indices.get(msg.dataset, []):
+            summary.normal_datasets_present |= 1 << i
+            if concatenate_texts:
+                if i not in summary.normal_dataset_texts:
+                    summary.normal_dataset_texts[i] = []
+                summary.normal_dataset_texts[i].append(f"\"{msg.text}\" - engagement_db.{msg.dataset}")
+
+        if msg.consent_withdrawn and msg.dataset in consent_withdrawn_datasets:
+            summary.consent_withdrawn = True
+
+    return summary
+
+
+def _get_normal_contact_fields_for_participant(participant_summary, sync_config):
     """
     Gets the normal contact fields for a given participant and sync configuration.
 
-    :param participant_messages: All messages from the participant to process.
-    :type participant_messages: list of engagement_database.data_models.Message
-    :param sync_config: Sync config defining which messages to get.
+    :param participant_summary: Summary of the participant's messages.
+    :type participant_summary: _ParticipantSummary
+    :param sync_config: Sync config defining which contact fields to get.
     :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
     :return: Dictionary of Rapid Pro contact field id -> value.
     :rtype: dict of str -> str
@@ -74,20 +174,14 @@ def _get_normal_contact_fields_for_participant(participant_messages, sync_config
         return dict()
 
     contact_fields = dict()
-    for dataset_config in sync_config.normal_datasets:
-        # Find all the messages from this participant in this dataset
-        dataset_messages = []
-        for msg in participant_messages:
-            if msg.dataset in dataset_config.engagement_db_datasets:
-                dataset_messages.append(msg)
-
+    for i, dataset_config in enumerate(sync_config.normal_datasets):
         # If there are no messages in this dataset, either clear the contact field if we're allowed to, or simply skip
         # this dataset if not.
         # (We might not be able to be allowed to clear the field because doing so could cause synchronisation problems
         #  with Rapid Pro, due to the delay between a flow updating a contact field and that change being processed
         #  by our infrastructure and synced back - in other words, we can't guarantee read-after-write consistency
         #  between Rapid Pro and the engagement database)
-        if len(dataset_messages) == 0:
+        if not participant_summary.normal_datasets_present & (1 << i):
             if sync_config.allow_clearing_fields:
                 contact_fields[dataset_config.rapid_pro_contact_field.key] = ""
             continue
@@ -98,36 +192,29 @@ def _get_normal_contact_fields_for_participant(participant_messages, sync_config
             contact_fields[dataset_config.rapid_pro_contact_field.key] = _PRESENCE_VALUE
         else:
             assert sync_config.write_mode == WriteModes.CONCATENATE_TEXTS
-            message_strings = [f"\"{msg.text}\" - engagement_db.{msg.dataset}" for msg in dataset_messages]
-            contact_fields[dataset_config.rapid_pro_contact_field.key] = "; ".join(message_strings)
+            contact_fields[dataset_config.rapid_pro_contact_field.key] = \
+                "; ".join(participant_summary.normal_dataset_texts[i])
 
     return contact_fields
 
 
-def _get_consent_withdrawn_field_for_participant(participant_messages, sync_config, code_schemes):
+def _get_consent_withdrawn_field_for_participant(participant_summary, sync_config):
     """
     Gets the consent_withdrawn contact field for a given participant and sync configuration.
 
-    :param participant_messages: All messages from the participant to process.
-    :type participant_messages: list of engagement_database.data_models.Message
-    :param sync_config: Sync config defining which messages to get.
+    :param participant_summary: Summary of the participant's messages.
+    :type participant_summary: _ParticipantSummary
+    :param sync_config: Sync config defining which contact fields to get.
     :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
-    :param code_schemes: Project code schemes (used to decode the labels to identify consent withdrawn messages).
-    :type code_schemes: list of core_data_modules.data_models.CodeScheme
     :return: Dictionary of Rapid Pro contact field id -> value.
     :rtype: dict of str -> str
     """
     if sync_config.consent_withdrawn_dataset is None:
         return dict()
 
-    all_labels = []
-    for msg in participant_messages:
-        if msg.dataset in sync_config.consent_withdrawn_dataset.engagement_db_datasets:
-            all_labels.extend(msg.get_latest_labels())
-
     contact_fields = dict()
     consent_withdrawn_contact_field = sync_config.consent_withdrawn_dataset.rapid_pro_contact_field
-    if _labels_contain_consent_withdrawn(all_labels, code_schemes):
+    if participant_summary.consent_withdrawn:
         contact_fields[consent_withdrawn_contact_field.key] = "yes"
     elif sync_config.allow_clearing_fields:
         contact_fields[consent_withdrawn_contact_field.key] = ""
@@ -135,6 +222,16 @@ def _get_consent_withdrawn_field_for_participant(participant_messages, sync_conf
     return contact_fields
 
 
+def _contact_fields_hash(contact_fields):
+    """
+    :param contact_fields: Dictionary of Rapid Pro contact field id -> value.
+    :type contact_fields: dict of str -> str
+    :return: Hash of the contact fields, which is the same for equal dictionaries regardless of key order.
+    :rtype: str
+    """
+    return SHAUtils.sha_string(json.dumps(contact_fields, sort_keys=True))
+
+
 def _ensure_rapid_pro_has_contact_fields(rapid_pro, contact_fields):
     """
     Ensures a Rapid Pro workspace has the given contact fields.
@@ -151,33 +248,238 @@ def _ensure_rapid_pro_has_contact_fields(rapid_pro, contact_fields):
             rapid_pro.create_field(field_id=contact_field.key, label=contact_field.label)
 
 
-def _code_scheme_for_label(label, code_schemes):
-    for code_scheme in code_schemes:
-        if label.scheme_id.startswith(code_scheme.scheme_id):
-            return code_scheme
+def shard_of_participant(participant_uuid, shard_count):
+    """
+    :param participant_uuid: Uuid of the participant to get the shard of.
+    :type participant_uuid: str
+    :param shard_count: Number of shards participants are partitioned into.
+    :type shard_count: int
+    :return: Index of the shard that the participant belongs to, in the range [0, shard_count). This is stable across
+             processes and machines.
+    :rtype: int
+    """
+    return zlib.crc32(participant_uuid.encode("utf-8")) % shard_count
 
 
-def _labels_contain_consent_withdrawn(labels, code_schemes):
+def _load_shard_state(cache, include_texts):
     """
-    :param labels: Labels to check for consent withdrawn code.
-    :type labels: list of core_data_modules.data_models.Label
-    :param code_schemes: List of project code schemes.
-    :type code_schemes: iterable of core_data_modules.data_models.CodeScheme
-    :return: Whether any of the given labels contain a code with code id 'STOP'.
-    :rtype: bool
+    Loads a shard's participant index and the last message it synced from its cache.
+
+    :param cache: Cache for the shard, or None if running in non-incremental mode.
+    :type cache: src.engagement_db_to_rapid_pro.cache.EngagementDBToRapidProCache | None
+    :param include_texts: Whether the participant index needs to include the text of each message.
+    :type include_texts: bool
+    :return: Tuple of (participant index, or None if there is no usable index yet, last synced message or None).
+    :rtype: (src.engagement_db_to_rapid_pro.participant_index.ParticipantIndex | None,
+             engagement_database.data_models.Message | None)
     """
-    for label in labels:
-        code_scheme = _code_scheme_for_label(label, code_schemes)
-        if code_scheme.get_code_with_code_id(label.code_id).control_code == Codes.STOP:
-            return True
+    if cache is None:
+        return None, None
+
+    last_synced_message, index_includes_texts = cache.get_participant_index_state()
+    if last_synced_message is None:
+        # Caches written by earlier versions of this tool stored the cursor in a message entry, alongside a participant
+        # index that isn't read any more. Use that cursor to avoid re-triggering syncs for messages that were already
+        # synced, but rebuild the index.
+        return None, cache.get_message("last_synced")
+
+    if index_includes_texts != include_texts:
+        # The contact fields depend on the write mode, so re-trigger a sync of every message as well as rebuilding
+        # the index. Participants whose contact fields are unchanged are still skipped.
+        log.info(f"The cached participant index at '{cache.cache_dir}' was built for a different write mode, so will be "
+                 f"rebuilt")
+        return None, None
 
-    return False
+    return ParticipantIndex(cache, include_texts), last_synced_message
 
 
-def sync_engagement_db_to_rapid_pro(engagement_db, rapid_pro, uuid_table, sync_config, cache_path=None):
+def _checkpoint_shard(cache, participant_index, index_updates, last_synced_message):
+    """
+    Writes the changes made to a shard's participant index by the messages up to and including `last_synced_message`
+    to the cache, together with `last_synced_message` as the shard's new cursor.
+
+    This must only be called once the contacts of all the participants with changes up to `last_synced_message` have
+    been written to Rapid Pro, because messages at or before the cursor don't trigger a sync in later runs.
+
+    :param cache: Cache for the shard.
+    :type cache: src.engagement_db_to_rapid_pro.cache.EngagementDBToRapidProCache
+    :param participant_index: The shard's participant index.
+    :type participant_index: src.engagement_db_to_rapid_pro.participant_index.ParticipantIndex
+    :param index_updates: Messages that changed the participant index and haven't been written to the cache yet, in the
+                          order they were applied. The messages that are written are removed from the front of this
+                          list.
+    :type index_updates: list of engagement_database.data_models.Message
+    :param last_synced_message: Message to move the shard's cursor to.
+    :type last_synced_message: engagement_database.data_models.Message
+    """
+    checkpointed_count = 0
+    while checkpointed_count < len(index_updates) and \
+            _is_at_or_before(index_updates[checkpointed_count], last_synced_message):
+        checkpointed_count += 1
+
+    cache.checkpoint_participant_index(
+        [(msg.participant_uuid, msg.message_id,
+          participant_index.get_indexed_message(msg.participant_uuid, msg.message_id))
+         for msg in index_updates[:checkpointed_count]],
+        last_synced_message, participant_index.include_texts
+    )
+    del index_updates[:checkpointed_count]
+
+
+def _sync_shard_to_rapid_pro(writer, uuid_table, sync_config, code_scheme_registry, cache, shard_index, shard_count,
+                             messages, participant_index, last_synced_message, last_downloaded_message):
+    """
+    Synchronises the participants in one shard of an engagement database to Rapid Pro.
+
+    :param writer: Writer to update Rapid Pro contacts with.
+    :type writer: src.common.rapid_pro_writer.RapidProContactWriter
+    :param uuid_table: UUID table to use to de-identify contact urns.
+    :type uuid_table: id_infrastructure.firestore_uuid_table.FirestoreUuidTable
+    :param sync_config: Configuration for the sync.
+    :type sync_config: src.engagement_db_to_rapid_pro.configuration.EngagementDBToRapidProConfiguration
+    :param code_scheme_registry: Registry of the project code schemes.
+    :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+    :param cache: Cache for this shard's participant index and cursors, or None to run in non-incremental mode.
+    :type cache: src.engagement_db_to_rapid_pro.cache.EngagementDBToRapidProCache | None
+    :param shard_index: Index of the shard to sync.
+    :type shard_index: int
+    :param shard_count: Number of shards participants are partitioned into.
+    :type shard_count: int
+    :param messages: The downloaded messages from participants in this shard, sorted by (last_updated, message_id).
+    :type messages: list of engagement_database.data_models.Message
+    :param participant_index: This shard's participant index, to update with the `messages`. Changes to the index are
+                              written to the `cache` as the contacts they affect are synced.
+    :type participant_index: src.engagement_db_to_rapid_pro.participant_index.ParticipantIndex
+    :param last_synced_message: The last message this shard synced, or None. Messages at or before this message don't
+                                trigger a sync.
+    :type last_synced_message: engagement_database.data_models.Message | None
+    :param last_downloaded_message: The last message downloaded for all the shards, or None if no messages were
+                                    downloaded. Once this shard is synced, its cursor is moved to this message.
+    :type last_downloaded_message: engagement_database.data_models.Message | None
+    :return: Sync stats for this shard.
+    :rtype: src.engagement_db_to_rapid_pro.sync_stats.EngagementDBToRapidProSyncStats
+    """
+    sync_stats = EngagementDBToRapidProSyncStats()
+    shard_name = f"shard {shard_index + 1}/{shard_count}"
+
+    engagement_db_datasets = _engagement_db_datasets_in_sync_config(sync_config)
+    consent_withdrawn_datasets = set() if sync_config.consent_withdrawn_dataset is None else \
+        set(sync_config.consent_withdrawn_dataset.engagement_db_datasets)
+
+    # Update the participant index with each of the downloaded messages from participants in this shard. Each message
+    # that changed the index, or that's in one of the datasets being synced, triggers a sync of its participant unless
+    # it was already synced in a previous run.
+    # The changes to the index are only written to the cache at each checkpoint, together with the cursor, once the
+    # contacts affected by those changes have been written. If this run is interrupted, the next run re-applies the
+    # messages since the last checkpoint to the index as it was at that checkpoint, so they trigger a sync again.
+    messages_triggering_sync = []
+    preceding_messages = []  # of the message processed immediately before each message in messages_triggering_sync
+    index_updates = []  # of the messages that changed the index since the last checkpoint, in the order applied
+    last_processed_message = None
+    for msg in messages:
+        sync_stats.add_event(EngagementDBToRapidProSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB)
+        index_changed = participant_index.update_message(
+            msg, engagement_db_datasets, consent_withdrawn_datasets, code_scheme_registry
+        )
+        if index_changed:
+            index_updates.append(msg)
+        if (index_changed or msg.dataset in engagement_db_datasets) and \
+                not _is_at_or_before(msg, last_synced_message):
+            preceding_messages.append(last_processed_message)
+            messages_triggering_sync.append(msg)
+        last_processed_message = msg
+    log.info(f"{len(messages_triggering_sync)} message(s) in {shard_name} need syncing")
+
+    # Load the hashes of the contact fields we last wrote for each participant, so we can skip updating participants
+    # whose contact fields haven't changed. Hashes are only recorded after a successful update, so if this run is
+    # interrupted before the hashes are saved, the next run will just repeat some updates.
+    written_contact_fields_hashes = dict()  # of participant uuid -> hash of the contact fields last written
+    if cache is not None:
+        written_contact_fields_hashes = cache.get_written_contact_fields_hashes()
+
+    # Sync the messages to Rapid Pro in batches, by recomputing the state of each participant with a message in the
+    # batch, then re-identifying and writing all the participants whose contact fields changed together.
+    normal_dataset_indices = _make_normal_dataset_indices(sync_config)
+    participants_synced_this_cycle = set()
+    for batch_start in range(0, len(messages_triggering_sync), _CONTACT_UPDATE_BATCH_SIZE):
+        batch = messages_triggering_sync[batch_start:batch_start + _CONTACT_UPDATE_BATCH_SIZE]
+        contact_fields_to_write = dict()  # of participant uuid -> (dict of contact field id -> value)
+        contact_fields_hashes_to_write = dict()  # of participant uuid -> hash of the contact fields to write
+        for i, message in enumerate(batch, start=batch_start):
+            sync_stats.add_event(EngagementDBToRapidProSyncEvents.MESSAGE_TRIGGERING_SYNC)
+            eta = sync_stats.eta_seconds(EngagementDBToRapidProSyncEvents.MESSAGE_TRIGGERING_SYNC,
+                                         len(messages_triggering_sync))
+            log.info(f"Syncing message {i + 1}/{len(messages_triggering_sync)} in {shard_name} ({format_eta(eta)}): "
+                     f"{message.message_id}...")
+            participant_uuid = message.participant_uuid
+            if participant_uuid in participants_synced_this_cycle:
+                log.info(f"Skipping this message because we've already synced participant_uuid {participant_uuid} in "
+                         f"this pipeline run")
+                sync_stats.add_event(EngagementDBToRapidProSyncEvents.PARTICIPANT_ALREADY_SYNCED)
+                continue
+            participants_synced_this_cycle.add(participant_uuid)
+
+            # Build a dictionary of contact_field -> value for all the latest values for this participant.
+            participant_summary = _summarise_participant(
+                participant_index.get_participant_messages(participant_uuid), sync_config, normal_dataset_indices
+            )
+            contact_fields = dict()
+            contact_fields.update(_get_normal_contact_fields_for_participant(participant_summary, sync_config))
+            contact_fields.update(_get_consent_withdrawn_field_for_participant(participant_summary, sync_config))
+
+            # TODO: Update special group membership status e.g listening groups
+
+            contact_fields_hash = _contact_fields_hash(contact_fields)
+            if written_contact_fields_hashes.get(participant_uuid) == contact_fields_hash:
+                log.info(f"Skipping this participant because their contact fields are unchanged since they were last "
+                         f"written to Rapid Pro")
+                sync_stats.add_event(EngagementDBToRapidProSyncEvents.CONTACT_FIELDS_UNCHANGED)
+                continue
+
+            contact_fields_to_write[participant_uuid] = contact_fields
+            contact_fields_hashes_to_write[participant_uuid] = contact_fields_hash
+
+        updated_contact_fields_hashes = dict()  # of participant uuid -> hash of the contact fields written this batch
+
+        def on_participant_updated(participant_uuid):
+            updated_contact_fields_hashes[participant_uuid] = contact_fields_hashes_to_write[participant_uuid]
+            sync_stats.add_event(EngagementDBToRapidProSyncEvents.UPDATE_RAPID_PRO_CONTACT)
+
+        with sync_stats.timer("rapid_pro.reidentify_and_update_contacts"):
+            reidentify_and_update_contacts(writer, uuid_table, contact_fields_to_write, on_participant_updated)
+        written_contact_fields_hashes.update(updated_contact_fields_hashes)
+
+        if cache is not None:
+            cache.set_written_contact_fields_hashes(updated_contact_fields_hashes)
+            # Move the cursor past every message processed before the next message that needs syncing, not just past
+            # the messages that triggered a sync, so that messages which didn't need syncing aren't downloaded again.
+            batch_end = batch_start + len(batch)
+            if batch_end < len(messages_triggering_sync):
+                _checkpoint_shard(cache, participant_index, index_updates, preceding_messages[batch_end])
+
+    # All the downloaded messages that are relevant to this shard have now been synced, so move the cursor to the end
+    # of the download, even if the last messages downloaded were from participants in other shards.
+    if cache is not None and last_downloaded_message is not None:
+        _checkpoint_shard(cache, participant_index, index_updates, last_downloaded_message)
+
+    sync_stats.stop()
+    return sync_stats
+
+
+def sync_engagement_db_to_rapid_pro(engagement_db, rapid_pro, uuid_table, sync_config, cache_path=None,
+                                    shard_count=1, shard_indices=None):
     """
     Synchronises an engagement database to Rapid Pro.
 
+    Participants can be partitioned into `shard_count` shards by a hash of their participant uuid. Each shard has its
+    own participant index and cursors in the cache, so shards can be synced independently of each other, either in
+    parallel threads in this process (by passing multiple `shard_indices`) or in separate processes/containers (by
+    passing a different shard index to each). Because each participant's contact fields only depend on that
+    participant's messages, the contact fields written are the same regardless of the number of shards. Shards synced
+    in the same process share a single download of the updated messages, which is split between them.
+
+    Changing `shard_count` for an existing cache starts new shard caches, so the next sync will be a full sync.
+
     :param engagement_db: Engagement database to sync from.
     :type engagement_db: engagement_database.EngagementDatabase
     :param rapid_pro: Rapid Pro client to sync to.
@@ -189,83 +491,102 @@ def sync_engagement_db_to_rapid_pro(engagement_db, rapid_pro, uuid_table, sync_c
     :param cache_path: Path to a directory to use to cache results needed for incremental operation.
                        If None, runs in non-incremental mode.
     :type cache_path: str | None
+    :param shard_count: Number of shards to partition participants into.
+    :type shard_count: int
+    :param shard_indices: Indices of the shards to sync, in parallel, or None to sync all the shards.
+    :type shard_indices: iterable of int | None
+    :return: Sync stats for the update.
+    :rtype: src.engagement_db_to_rapid_pro.sync_stats.EngagementDBToRapidProSyncStats
     """
-    # Initialise the cache
+    assert shard_count >= 1, f"shard_count must be >= 1, but was {shard_count}"
+    shard_indices = list(range(shard_count)) if shard_indices is None else sorted(set(shard_indices))
+    for shard_index in shard_indices:
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Shard index {shard_index} is out of range for shard_count {shard_count}")
+
+    # Initialise a cache for each shard. If there's only one shard, its cache is the original unsharded cache.
     if cache_path is None:
-        cache = None
+        shard_caches = {shard_index: None for shard_index in shard_indices}
         log.warning(f"No `cache_path` provided. This tool will sync all relevant engagement db messages from all of time")
+    elif shard_count == 1:
+        log.info(f"Initialising engagement db to Rapid Pro cache at '{cache_path}/engagement_db_to_rapid_pro'")
+        shard_caches = {0: EngagementDBToRapidProCache(f"{cache_path}/engagement_db_to_rapid_pro")}
     else:
-        log.info(f"Initialising Coda sync cache at '{cache_path}/engagement_db_to_rapid_pro'")
-        cache = Cache(f"{cache_path}/engagement_db_to_rapid_pro")
+        shard_caches = dict()
+        for shard_index in shard_indices:
+            shard_cache_path = f"{cache_path}/engagement_db_to_rapid_pro/shard-{shard_index}-of-{shard_count}"
+            log.info(f"Initialising cache for shard {shard_index + 1}/{shard_count} at '{shard_cache_path}'")
+            shard_caches[shard_index] = EngagementDBToRapidProCache(shard_cache_path)
 
-    # Get all the messages from the datasets we're interested in syncing, and group them by participant
-    messages = _get_all_messages(engagement_db, sync_config, cache)
-    messages_by_participant = defaultdict(list)  # of participant_uuid -> list of Message
-    for msg in messages:
-        messages_by_participant[msg.participant_uuid].append(msg)
-
-    # Get the messages updated since the message we last synced. We'll update contacts for each of these messages.
-    last_synced_message = None
-    if cache is not None:
-        last_synced_message = cache.get_message("last_synced")
+    sync_stats = EngagementDBToRapidProSyncStats()
 
-    if last_synced_message is None:
-        messages_triggering_sync = messages
-    else:
-        messages_triggering_sync = []
-        for msg in messages:
-            if msg.last_updated < last_synced_message.last_updated:
-                continue
-            if msg.last_updated == last_synced_message.last_updated and msg.message_id <= last_synced_message.message_id:
-                continue
-            messages_triggering_sync.append(msg)
-    messages_triggering_sync.sort(key=lambda msg: (msg.last_updated, msg.message_id))
+    # Load all the project code schemes so we can easily scan for STOP messages later.
+    code_scheme_registry = get_code_scheme_registry()
 
     # Make sure all the contact fields exist in the Rapid Pro workspace.
     contact_fields_to_sync = [dataset_config.rapid_pro_contact_field \
         for dataset_config in sync_config.normal_datasets] if sync_config.normal_datasets is not None else []
     if sync_config.consent_withdrawn_dataset is not None:
         contact_fields_to_sync.append(sync_config.consent_withdrawn_dataset.rapid_pro_contact_field)
-    _ensure_rapid_pro_has_contact_fields(rapid_pro, contact_fields_to_sync)
-
-    # Load all the project code schemes so we can easily scan for STOP messages later.
-    code_schemes = []
-    for path in glob.glob("code_schemes/*.json"):
-        with open(path) as f:
-            code_schemes.append(CodeScheme.from_firebase_map(json.load(f)))
-
-    # Sync each message to Rapid Pro, by recomputing the state of every participant.
-    participants_synced_this_cycle = set()
-    for i, message in enumerate(messages_triggering_sync):
-        log.info(f"Syncing message {i + 1}/{len(messages_triggering_sync)}: {message.message_id}...")
-        participant_uuid = message.participant_uuid
-        if participant_uuid in participants_synced_this_cycle:
-            log.info(f"Skipping this message because we've already synced participant_uuid {participant_uuid} in this "
-                     f"pipeline run")
-            if cache is not None:
-                cache.set_message("last_synced", message)
-            continue
+    with sync_stats.timer("rapid_pro.ensure_contact_fields"):
+        _ensure_rapid_pro_has_contact_fields(rapid_pro, contact_fields_to_sync)
+
+    # Share one writer between all the shards synced by this process, so they share its rate limit.
+    writer = RapidProContactWriter(rapid_pro, sync_config.max_concurrent_writes, sync_config.max_writes_per_second)
+
+    # Load each shard's participant index and cursor, then download the messages for all the shards in one go.
+    # If any shard doesn't have a participant index yet, download all the messages in the datasets being synced and
+    # rebuild every shard's index from them, because a full download doesn't include the messages that were moved
+    # out of the synced datasets since a shard's last sync. Otherwise, download all the messages updated since the
+    # shard that is furthest behind last synced.
+    include_texts = sync_config.write_mode == WriteModes.CONCATENATE_TEXTS
+    shard_states = {
+        shard_index: _load_shard_state(shard_caches[shard_index], include_texts) for shard_index in shard_indices
+    }
+    if any(participant_index is None for participant_index, _ in shard_states.values()):
+        updated_after = None
+        for shard_cache in shard_caches.values():
+            if shard_cache is not None:
+                shard_cache.clear_participant_index()
+        shard_states = {
+            shard_index: (ParticipantIndex(include_texts=include_texts), last_synced_message)
+            for shard_index, (_, last_synced_message) in shard_states.items()
+        }
+    elif any(last_synced_message is None for _, last_synced_message in shard_states.values()):
+        updated_after = None
+    else:
+        updated_after = min(last_synced_message.last_updated for _, last_synced_message in shard_states.values())
 
-        # Build a dictionary of contact_field -> value for all the latest values for this participant.
-        contact_fields = dict()
-        contact_fields.update(
-            _get_normal_contact_fields_for_participant(messages_by_participant[participant_uuid], sync_config)
+    with sync_stats.timer("engagement_db.get_messages_updated_since"):
+        messages = _get_messages_updated_since(
+            engagement_db, _engagement_db_datasets_in_sync_config(sync_config), updated_after
         )
-        contact_fields.update(
-            _get_consent_withdrawn_field_for_participant(messages_by_participant[participant_uuid], sync_config, code_schemes)
-        )
-
-        # TODO: Update special group membership status e.g listening groups
+    last_downloaded_message = messages[-1] if len(messages) > 0 else None
 
-        # Re-identify the participant.
-        urn = uuid_table.uuid_to_data(participant_uuid)
+    # Split the messages between the shards being synced, preserving their order.
+    shard_messages = {shard_index: [] for shard_index in shard_indices}
+    for msg in messages:
+        shard_index = shard_of_participant(msg.participant_uuid, shard_count)
+        if shard_index in shard_messages:
+            shard_messages[shard_index].append(msg)
+    del messages
+
+    def sync_shard(shard_index):
+        participant_index, last_synced_message = shard_states[shard_index]
+        return _sync_shard_to_rapid_pro(
+            writer, uuid_table, sync_config, code_scheme_registry, shard_caches[shard_index], shard_index, shard_count,
+            shard_messages[shard_index], participant_index, last_synced_message, last_downloaded_message
+        )
 
-        # Write the contact fields to rapid pro
-        rapid_pro.update_contact(urn, contact_fields=contact_fields)
+    if len(shard_indices) == 1:
+        sync_stats.add_stats(sync_shard(shard_indices[0]))
+    else:
+        log.info(f"Syncing {len(shard_indices)} shard(s) in parallel...")
+        with ThreadPoolExecutor(max_workers=len(shard_indices)) as executor:
+            for shard_stats in executor.map(sync_shard, shard_indices):
+                sync_stats.add_stats(shard_stats)
 
-        participants_synced_this_cycle.add(participant_uuid)
-        if cache is not None:
-            cache.set_message("last_synced", message)
+    log.info(f"Summary of actions:")
+    sync_stats.print_summary()
 
-    log.info(f"Done")
-    # TODO: Print summary of actions
+    return sync_stats
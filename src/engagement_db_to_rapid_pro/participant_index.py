@@ -0,0 +1,112 @@
+from dataclasses import dataclass
+from typing import Optional
+
+from core_data_modules.cleaners import Codes
+from engagement_database.data_models import MessageStatuses
+
+
+@dataclass
+class IndexedMessage:
+    dataset: str
+    text: Optional[str]  # None if the index doesn't include message texts.
+    timestamp: str  # ISO 8601
+    consent_withdrawn: bool
+
+
+class ParticipantIndex:
+    def __init__(self, cache=None, include_texts=True):
+        """
+        Initialises an index of the state of each participant that is needed to compute their Rapid Pro contact fields.
+
+        For each participant, the index stores the subset of each of their messages that's needed to compute their
+        contact fields, for the messages that are in the datasets being synced. It's updated incrementally with each
+        message that has changed since the last sync, so that each sync only needs to download the changed messages
+        rather than every message in every dataset.
+
+        Participants are loaded from the `cache` the first time they're needed, so only the participants with changed
+        messages are read. Changes are only held in memory; it's up to the caller to write them to the cache, using
+        `get_indexed_message` to look up the latest state of each changed message.
+
+        :param cache: Cache to load the previously indexed messages of each participant from, or None to start from an
+                      empty index.
+        :type cache: src.engagement_db_to_rapid_pro.cache.EngagementDBToRapidProCache | None
+        :param include_texts: Whether to index the text of each message. This is only needed if the contact fields are
+                              written in `WriteModes.CONCATENATE_TEXTS` mode.
+        :type include_texts: bool
+        """
+        self._cache = cache
+        self.include_texts = include_texts
+        self._participants = dict()  # of participant uuid -> (dict of message id -> IndexedMessage)
+
+    def _get_participant(self, participant_uuid):
+        # Participants stay in memory once loaded, even if they have no messages left, so that changes that haven't
+        # been written to the cache yet aren't overwritten by reloading the participant.
+        if participant_uuid not in self._participants:
+            self._participants[participant_uuid] = dict() if self._cache is None else \
+                self._cache.get_indexed_messages(participant_uuid)
+        return self._participants[participant_uuid]
+
+    def update_message(self, message, engagement_db_datasets, consent_withdrawn_datasets, code_scheme_registry):
+        """
+        Updates the index with the latest version of a message.
+
+        Messages that are no longer live, or no longer in any of the `engagement_db_datasets` (e.g. because they were
+        WS-corrected to another dataset) are removed from the index.
+
+        :param message: Message to update the index with.
+        :type message: engagement_database.data_models.Message
+        :param engagement_db_datasets: Engagement database datasets to index.
+        :type engagement_db_datasets: set of str
+        :param consent_withdrawn_datasets: Engagement database datasets to check for consent withdrawn labels in.
+        :type consent_withdrawn_datasets: set of str
+        :param code_scheme_registry: Registry of the project code schemes, used to decode the labels to identify consent
+                                     withdrawn messages.
+        :type code_scheme_registry: src.common.code_scheme_registry.CodeSchemeRegistry
+        :return: Whether this update changed the participant's indexed state.
+        :rtype: bool
+        """
+        participant_messages = self._get_participant(message.participant_uuid)
+        previous = participant_messages.get(message.message_id)
+
+        if message.status not in [MessageStatuses.LIVE, MessageStatuses.STALE] or \
+                message.dataset not in engagement_db_datasets:
+            if previous is None:
+                return False
+            del participant_messages[message.message_id]
+            return True
+
+        consent_withdrawn = message.dataset in consent_withdrawn_datasets and any(
+            code_scheme_registry.get_code_for_label(label).control_code == Codes.STOP
+            for label in message.get_latest_labels()
+        )
+        indexed_message = IndexedMessage(
+            dataset=message.dataset,
+            text=message.text if self.include_texts else None,
+            timestamp=message.timestamp.isoformat(),
+            consent_withdrawn=consent_withdrawn
+        )
+        if indexed_message == previous:
+            return False
+
+        participant_messages[message.message_id] = indexed_message
+        return True
+
+    def get_indexed_message(self, participant_uuid, message_id):
+        """
+        :param participant_uuid: Uuid of the participant who sent the message.
+        :type participant_uuid: str
+        :param message_id: Id of the message to get.
+        :type message_id: str
+        :return: The indexed state of the message, or None if the message isn't in the index.
+        :rtype: IndexedMessage | None
+        """
+        return self._get_participant(participant_uuid).get(message_id)
+
+    def get_participant_messages(self, participant_uuid):
+        """
+        :param participant_uuid: Uuid of the participant to get the indexed messages for.
+        :type participant_uuid: str
+        :return: The participant's indexed messages, in the order they were sent.
+        :rtype: list of IndexedMessage
+        """
+        return sorted(self._get_participant(participant_uuid).values(), key=lambda msg: msg.timestamp)
@@ -0,0 +1,37 @@
+from core_data_modules.logging import Logger
+
+from src.common.sync_stats import SyncStats
+
+log = Logger(__name__)
+
+
+class EngagementDBToRapidProSyncEvents:
+    READ_MESSAGE_FROM_ENGAGEMENT_DB = "read_message_from_engagement_db"
+    MESSAGE_TRIGGERING_SYNC = "message_triggering_sync"
+    PARTICIPANT_ALREADY_SYNCED = "participant_already_synced"
+    UPDATE_RAPID_PRO_CONTACT = "update_rapid_pro_contact"
+    CONTACT_FIELDS_UNCHANGED = "contact_fields_unchanged"
+
+
+class EngagementDBToRapidProSyncStats(SyncStats):
+    def __init__(self):
+        super().__init__({
+            EngagementDBToRapidProSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB: 0,
+            EngagementDBToRapidProSyncEvents.MESSAGE_TRIGGERING_SYNC: 0,
+            EngagementDBToRapidProSyncEvents.PARTICIPANT_ALREADY_SYNCED: 0,
+            EngagementDBToRapidProSyncEvents.UPDATE_RAPID_PRO_CONTACT: 0,
+            EngagementDBToRapidProSyncEvents.CONTACT_FIELDS_UNCHANGED: 0
+        })
+
+    def print_summary(self):
+        log.info(f"Messages read from engagement db: "
+                 f"{self.event_counts[EngagementDBToRapidProSyncEvents.READ_MESSAGE_FROM_ENGAGEMENT_DB]}")
+        log.info(f"Messages updated since the last sync: "
+                 f"{self.event_counts[EngagementDBToRapidProSyncEvents.MESSAGE_TRIGGERING_SYNC]}")
+        log.info(f"Messages from participants already synced in this run: "
+                 f"{self.event_counts[EngagementDBToRapidProSyncEvents.PARTICIPANT_ALREADY_SYNCED]}")
+        log.info(f"Rapid Pro contacts updated: "
+                 f"{self.event_counts[EngagementDBToRapidProSyncEvents.UPDATE_RAPID_PRO_CONTACT]}")
+        log.info(f"Rapid Pro contact updates skipped because the contact fields were unchanged: "
+                 f"{self.event_counts[EngagementDBToRapidProSyncEvents.CONTACT_FIELDS_UNCHANGED]}")
+        self.print_timings_summary()
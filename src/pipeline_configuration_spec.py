@@ -1,9 +1,7 @@
-import json
 from dataclasses import dataclass
 from datetime import datetime
 
-from core_data_modules.data_models import CodeScheme
-
+from src.common.code_schemes import load_code_scheme
 from src.common.configuration import (RapidProClientConfiguration, CodaClientConfiguration, UUIDTableClientConfiguration,
                                       EngagementDatabaseClientConfiguration, OperationsDashboardConfiguration,
                                       ArchiveConfiguration)
@@ -20,11 +18,6 @@ from src.engagement_db_to_analysis.configuration import (AnalysisDatasetConfigur
                                                          AnalysisConfiguration)
 
 
-def load_code_scheme(fname):
-    with open(f"code_schemes/{fname}.json") as f:
-        return CodeScheme.from_firebase_map(json.load(f))
-
-
 @dataclass
 class RapidProSource:
     rapid_pro: RapidProClientConfiguration
@@ -174,14 +174,16 @@ def sync_rapid_pro_to_engagement_db(rapid_pro, engagement_db, uuid_table, rapid_
         sync_stats = RapidProToEngagementDBSyncStats()
         # Get the latest runs for this flow.
         flow_id = rapid_pro.get_flow_id(flow_config.flow_name)
-        runs = _get_new_runs(rapid_pro, flow_id, flow_config.flow_result_field, cache)
+        with sync_stats.timer("rapid_pro.get_runs"):
+            runs = _get_new_runs(rapid_pro, flow_id, flow_config.flow_result_field, cache)
 
         for _ in runs:
             sync_stats.add_event(RapidProSyncEvents.READ_RUN_FROM_RAPID_PRO)
 
         # Get any contacts that have been updated since we last asked, in case any of the downloaded runs are for very
         # new contacts.
-        contacts = rapid_pro.update_raw_contacts_with_latest_modified(contacts)
+        with sync_stats.timer("rapid_pro.update_raw_contacts"):
+            contacts = rapid_pro.update_raw_contacts_with_latest_modified(contacts)
         if cache is not None:
             cache.set_contacts(contacts)
         contacts_lut = {c.uuid: c for c in contacts}
@@ -234,7 +236,8 @@ def sync_rapid_pro_to_engagement_db(rapid_pro, engagement_db, uuid_table, rapid_
                         cache.set_latest_run_timestamp(flow_id, flow_config.flow_result_field, run.modified_on)
                     continue
 
-            participant_uuid = uuid_table.data_to_uuid(contact_urn)
+            with sync_stats.timer("uuid_table.data_to_uuid"):
+                participant_uuid = uuid_table.data_to_uuid(contact_urn)
 
             # Create a message and origin objects for this result and ensure it's in the engagement database.
             msg = Message(
@@ -258,13 +261,15 @@ def sync_rapid_pro_to_engagement_db(rapid_pro, engagement_db, uuid_table, rapid_
                 "flow_name": flow_config.flow_name,
                 "run_value": rapid_pro_result.serialize()
             }
-            sync_event = _ensure_engagement_db_has_message(engagement_db, msg, message_origin_details)
+            with sync_stats.timer("engagement_db.ensure_message"):
+                sync_event = _ensure_engagement_db_has_message(engagement_db, msg, message_origin_details)
             sync_stats.add_event(sync_event)
 
             # Update the cache so we know not to check this run again in this flow + result field context.
             if cache is not None:
                 cache.set_latest_run_timestamp(flow_id, flow_config.flow_result_field, run.modified_on)
 
+        sync_stats.stop()
         dataset_to_sync_stats[f"{flow_config.flow_name}.{flow_config.flow_result_field}"] = sync_stats
 
     # Log the summaries of actions taken for each dataset then for all datasets combined.
@@ -35,3 +35,4 @@ class RapidProToEngagementDBSyncStats(SyncStats):
         log.info(f"Runs from contacts not in the uuid filter: {self.event_counts[RapidProSyncEvents.CONTACT_NOT_IN_UUID_FILTER]}")
         log.info(f"Messages already in engagement db: {self.event_counts[RapidProSyncEvents.MESSAGE_ALREADY_IN_ENGAGEMENT_DB]}")
         log.info(f"Messages added to engagement db: {self.event_counts[RapidProSyncEvents.ADD_MESSAGE_TO_ENGAGEMENT_DB]}")
+        self.print_timings_summary()
@@ -6,7 +6,10 @@ from core_data_modules.logging import Logger
 from engagement_database.data_models import HistoryEntryOrigin
 
 from src.engagement_db_coda_sync.coda_to_engagement_db import sync_coda_to_engagement_db
+from src.engagement_db_coda_sync.engagement_db_to_coda import sync_engagement_db_to_coda
+from src.engagement_db_coda_sync.follow import follow
 from src.engagement_db_coda_sync.lib import ensure_coda_datasets_up_to_date
+from src.engagement_db_coda_sync.sync_stats import CodaSyncEvents
 
 log = Logger(__name__)
 
@@ -15,6 +18,9 @@ if __name__ == "__main__":
 
     parser.add_argument("--incremental-cache-path",
                         help="Path to a directory to use to cache results needed for incremental operation.")
+    parser.add_argument("--follow", action="store_true",
+                        help="Keep running, syncing new changes as they arrive until interrupted. "
+                             "Requires --incremental-cache-path")
     parser.add_argument("user", help="Identifier of the user launching this program")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
@@ -24,8 +30,11 @@ if __name__ == "__main__":
                              "This module must contain a PIPELINE_CONFIGURATION property")
 
     args = parser.parse_args()
+    if args.follow and args.incremental_cache_path is None:
+        parser.error("--follow requires --incremental-cache-path")
 
     incremental_cache_path = args.incremental_cache_path
+    follow_changes = args.follow
     user = args.user
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     pipeline_config = importlib.import_module(args.configuration_module).PIPELINE_CONFIGURATION
@@ -44,5 +53,25 @@ if __name__ == "__main__":
     engagement_db = pipeline_config.engagement_database.init_engagement_db_client(google_cloud_credentials_file_path)
     coda = pipeline_config.coda_sync.coda.init_coda_client(google_cloud_credentials_file_path)
 
-    ensure_coda_datasets_up_to_date(coda, pipeline_config.coda_sync.sync_config, google_cloud_credentials_file_path)
-    sync_coda_to_engagement_db(coda, engagement_db, pipeline_config.coda_sync.sync_config, incremental_cache_path)
+    ensure_coda_datasets_up_to_date(coda, pipeline_config.coda_sync.sync_config, google_cloud_credentials_file_path,
+                                    incremental_cache_path)
+
+    def sync_pass():
+        sync_stats, ws_corrected_datasets = sync_coda_to_engagement_db(
+            coda, engagement_db, pipeline_config.coda_sync.sync_config, incremental_cache_path
+        )
+
+        # Sync the messages that were WS-corrected to their new datasets in Coda now, re-syncing only the datasets
+        # that messages were moved to.
+        if len(ws_corrected_datasets) > 0:
+            log.info(f"Re-syncing the engagement db datasets that messages were WS-corrected to: "
+                     f"{sorted(ws_corrected_datasets)}")
+            sync_engagement_db_to_coda(engagement_db, coda, pipeline_config.coda_sync.sync_config,
+                                       incremental_cache_path, engagement_db_datasets=ws_corrected_datasets)
+
+        return sync_stats.event_counts[CodaSyncEvents.READ_MESSAGE_FROM_CODA] > 0
+
+    if follow_changes:
+        follow(sync_pass)
+    else:
+        sync_pass()
@@ -14,6 +14,12 @@ if __name__ == "__main__":
 
     parser.add_argument("--incremental-cache-path",
                         help="Path to a directory to use to cache results needed for incremental operation.")
+    parser.add_argument("--shard-count", type=int, default=1,
+                        help="Number of shards to partition participants into. Each shard has its own incremental "
+                             "cache, so changing this for an existing cache triggers a full sync. Defaults to 1")
+    parser.add_argument("--shard-index", type=int, action="append", dest="shard_indices",
+                        help="Index of a shard to sync, in the range [0, shard-count). May be given multiple times to "
+                             "sync several shards in parallel. Defaults to syncing all the shards in parallel")
     parser.add_argument("user", help="Identifier of the user launching this program")
     parser.add_argument("google_cloud_credentials_file_path", metavar="google-cloud-credentials-file-path",
                         help="Path to a Google Cloud service account credentials file to use to access the "
@@ -25,6 +31,8 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     incremental_cache_path = args.incremental_cache_path
+    shard_count = args.shard_count
+    shard_indices = args.shard_indices
     user = args.user
     google_cloud_credentials_file_path = args.google_cloud_credentials_file_path
     pipeline_config = importlib.import_module(args.configuration_module).PIPELINE_CONFIGURATION
@@ -44,4 +52,5 @@ if __name__ == "__main__":
     rapid_pro = pipeline_config.rapid_pro_target.rapid_pro.init_rapid_pro_client(google_cloud_credentials_file_path)
     sync_config = pipeline_config.rapid_pro_target.sync_config
 
-    sync_engagement_db_to_rapid_pro(engagement_db, rapid_pro, uuid_table, sync_config, incremental_cache_path)
+    sync_engagement_db_to_rapid_pro(engagement_db, rapid_pro, uuid_table, sync_config, incremental_cache_path,
+                                    shard_count, shard_indices)